@@ -0,0 +1,119 @@
+"""
+Throughput of the generation pipeline for each key algorithm.
+
+Runs the pipeline of bench_pipeline.py once per algorithm, on a fresh
+synthetic config whose users and CAs all use that algorithm, and reports
+the latency percentiles of each stage and the number of certificates
+signed per second of each, as JSON and as a table:
+
+    python benchmarks/bench_algorithms.py --groups 1 --users 50 --jobs 4
+    python benchmarks/bench_algorithms.py --algorithms rsa:2048,ec:P-384,ed25519 --output algorithms.json
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from argparse import ArgumentParser
+from argparse import Namespace
+import bench_pipeline
+import json
+import platform
+import tempfile
+
+
+def parse_algorithm(algorithm):
+    """
+    Args:
+        algorithm (str) : rsa:<bits>, ec:<curve> or ed25519.
+
+    Returns:
+        (tuple) : key type, bits and curve of the algorithm.
+    """
+
+    key_type, _, option = algorithm.partition(':')
+    if key_type == 'rsa':
+        return key_type, option or '2048', 'P-256'
+    if key_type == 'ec':
+        return key_type, '2048', option or 'P-256'
+    if key_type == 'ed25519':
+        return key_type, '2048', 'P-256'
+    raise ValueError('Unknown algorithm {0}.'.format(algorithm))
+
+
+def table(results):
+    """
+    Prints the p50 of the key, csr and sign stages and the throughput of
+    each algorithm.
+    """
+
+    stages = ('key', 'csr', 'sign')
+    print('{0:<14}'.format('algorithm') +
+          ''.join('{0:>14}'.format(stage + ' p50') for stage in stages) +
+          '{0:>12}'.format('certs/sec'))
+    for algorithm, result in results.items():
+        row = '{0:<14}'.format(algorithm)
+        for stage in stages:
+            summary = result['stages'].get(stage)
+            row += '{0:>14.6f}'.format(summary['p50']) if summary else '{0:>14}'.format('-')
+        rate = result.get('certificates_per_second')
+        row += '{0:>12.1f}'.format(rate) if rate is not None else '{0:>12}'.format('-')
+        print(row)
+
+
+def main():
+    parser = ArgumentParser(description="Benchmarks the generation pipeline for each key algorithm.")
+    parser.add_argument('--algorithms', type=str, default='rsa:2048,rsa:4096,ec:P-256,ed25519',
+                        help="Algorithms to compare, separated by ',', defaults to "
+                             "rsa:2048,rsa:4096,ec:P-256,ed25519.")
+    parser.add_argument('--groups', type=int, default=1,
+                        help="Number of groups, defaults to 1.")
+    parser.add_argument('--users', type=int, default=50,
+                        help="Number of users per group, defaults to 50.")
+    parser.add_argument('--protected-ratio', dest='protected_ratio', type=float, default=0.0,
+                        help="Share of the users with a protected key, defaults to 0.")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="Number of steps executed in parallel, defaults to 1.")
+    parser.add_argument('--openssl', type=str, default='/usr/bin/openssl',
+                        help="Location of the openssl binaries, defaults to /usr/bin/openssl.")
+    parser.add_argument('--backend', choices=['openssl', 'cryptography'], default='openssl',
+                        help="Backend generating the files, defaults to openssl.")
+    parser.add_argument('--output', type=str, default=None,
+                        help="Location of the JSON results, printed if not specified.")
+    args = parser.parse_args()
+
+    results = {}
+    for algorithm in args.algorithms.split(','):
+        key_type, bits, curve = parse_algorithm(algorithm)
+        run_args = Namespace(groups=args.groups,
+                             users=args.users,
+                             bits=bits,
+                             protected_ratio=args.protected_ratio,
+                             key_type=key_type,
+                             curve=curve,
+                             jobs=args.jobs,
+                             openssl=args.openssl,
+                             backend=args.backend)
+        with tempfile.TemporaryDirectory() as directory:
+            results[algorithm] = bench_pipeline.run(run_args, directory)
+    content = json.dumps({'algorithms': results,
+                          'parameters': {'groups': args.groups,
+                                         'users': args.users,
+                                         'protected_ratio': args.protected_ratio,
+                                         'jobs': args.jobs,
+                                         'backend': args.backend},
+                          'environment': {'python': platform.python_version(),
+                                          'platform': platform.platform(),
+                                          'openssl': bench_pipeline.openssl_version(args.openssl),
+                                          'cpus': os.cpu_count()}},
+                         indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(content)
+    else:
+        print(content)
+    table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""
+End to end benchmark of the generation pipeline.
+
+Generates a synthetic config of groups x users, with mixed key sizes and
+protected and unprotected keys, then times each stage: reading the config,
+parsing it, setting up the directories, and generating the keys, requests
+and certificates. Reports latency percentiles for each stage and the number
+of certificates signed per second, and writes the results as JSON so runs
+of different versions can be compared with --compare.
+
+Runs offline against the local openssl binaries:
+
+    python benchmarks/bench_pipeline.py --groups 2 --users 50 --jobs 4 --output results.json
+    python benchmarks/bench_pipeline.py --groups 2 --users 50 --jobs 4 --compare results.json
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+from argparse import ArgumentParser
+from certautomator.backends import CryptographyBackend
+from certautomator.crypto_cmds import CryptoCommands
+from certautomator.scheduler import Task
+from certautomator.utils import Config
+from certautomator.utils_parser import Utils_Parser
+import json
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+
+
+class StageTimer:
+
+    def __init__(self):
+        """
+        Records the duration of each call of each stage. Safe to use
+        from the scheduler's workers.
+        """
+
+        self._lock = threading.Lock()
+        self._durations = {}
+
+    def record(self, stage, duration):
+        with self._lock:
+            self._durations.setdefault(stage, []).append(duration)
+
+    def time(self, stage, method):
+        """
+        Wraps method so the duration of each call is recorded under stage.
+
+        Args:
+            stage (str) : name of the stage.
+            method (method) : the method to time.
+
+        Returns:
+            method : calls method and records its duration.
+        """
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        """
+        Returns:
+            (dictionary) : count, total, mean, min, percentiles and max of
+                           the durations of each stage, in seconds.
+        """
+
+        with self._lock:
+            return {stage: summarize(durations)
+                    for stage, durations in self._durations.items()}
+
+
+def percentile(durations, p):
+    """
+    Nearest rank percentile of sorted durations.
+    """
+
+    index = max(0, min(len(durations) - 1, int(round(p / 100.0 * len(durations) + 0.5)) - 1))
+    return durations[index]
+
+
+def summarize(durations):
+    durations = sorted(durations)
+    return {'count': len(durations),
+            'total': sum(durations),
+            'mean': sum(durations) / len(durations),
+            'min': durations[0],
+            'p50': percentile(durations, 50),
+            'p90': percentile(durations, 90),
+            'p99': percentile(durations, 99),
+            'max': durations[-1]}
+
+
+def synthetic_config(directory, groups, users, bits, protected_ratio, key_type='rsa', curve='P-256'):
+    """
+    Builds a config of groups with a CA and users each. Key sizes cycle
+    through bits, and every 1 / protected_ratio user is protected.
+
+    Args:
+        directory (str) : where the keys, requests and certificates are generated.
+        groups (int) : number of groups.
+        users (int) : number of users per group.
+        bits (list) : key sizes of the users.
+        protected_ratio (float) : share of the users with a protected key.
+        key_type (str) : algorithm of the keys, rsa, ec or ed25519.
+        curve (str) : curve of the ec keys.
+
+    Returns:
+        (dictionary) : the config.
+    """
+
+    config = {}
+    for g in range(groups):
+        group_dir = os.path.join(directory, 'group{0}'.format(g))
+        group_users = {}
+        for u in range(users):
+            name = 'user{0}'.format(u)
+            user = {'common_name': '{0}.group{1}.example.com'.format(name, g),
+                    'key_name': '{0}.key'.format(name),
+                    'cert_name': '{0}.crt'.format(name),
+                    'cert_request_name': '{0}.csr'.format(name),
+                    'bits': bits[u % len(bits)]}
+            if protected_ratio > 0 and int(u * protected_ratio) != int((u + 1) * protected_ratio):
+                user['protected'] = True
+                user['password'] = 'benchmark{0}'.format(u)
+            group_users[name] = user
+        config['group{0}'.format(g)] = {
+            'ssl_defaults': {'bits': bits[0],
+                             'days': 30,
+                             'protected': False,
+                             'message_digest': 'sha256',
+                             'key_type': key_type,
+                             'curve': curve,
+                             'user_dir': os.path.join(group_dir, 'users'),
+                             'ca_dir': os.path.join(group_dir, 'ca')},
+            'name_defaults': {'country': 'US',
+                              'state': 'State',
+                              'locality': 'City',
+                              'organization_name': 'Benchmark',
+                              'organizational_unit_name': 'Performance',
+                              'email': 'benchmark@example.com'},
+            'ca': {'ca': {'common_name': 'ca.group{0}.example.com'.format(g),
+                          'key_name': 'ca.key',
+                          'cert_name': 'ca.crt',
+                          'cert_request_name': 'ca.csr',
+                          'protected': True,
+                          'password': 'benchmark-ca'}},
+            'users': group_users}
+    return config
+
+
+def openssl_version(openssl):
+    try:
+        return subprocess.run([openssl, 'version'],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except OSError:
+        return None
+
+
+def run(args, directory):
+    """
+    Runs every stage once on a fresh config in directory.
+
+    Returns:
+        (dictionary) : the results of the run.
+    """
+
+    timer = StageTimer()
+    config_file = os.path.join(directory, 'config.json')
+    with open(config_file, 'w') as f:
+        json.dump(synthetic_config(directory,
+                                   args.groups,
+                                   args.users,
+                                   [int(b) for b in args.bits.split(',')],
+                                   args.protected_ratio,
+                                   getattr(args, 'key_type', 'rsa'),
+                                   getattr(args, 'curve', 'P-256')), f)
+
+    start = time.perf_counter()
+    content = Config().read_config(config_file)
+    timer.record('config_read', time.perf_counter() - start)
+
+    parser = Utils_Parser()
+    parser.setup_directories = timer.time('directory_setup', parser.setup_directories)
+    start = time.perf_counter()
+    data = parser.parse(content)
+    timer.record('parse', time.perf_counter() - start)
+
+    crypto_commands = CryptoCommands(openssl_location=args.openssl)
+    if args.backend == 'cryptography':
+        crypto_commands.backend = CryptographyBackend()
+    crypto_commands.generate_key = timer.time('key', crypto_commands.generate_key)
+    crypto_commands.generate_csr = timer.time('csr', crypto_commands.generate_csr)
+    crypto_commands.generate_ca_certificate = timer.time(
+        'ca_certificate', crypto_commands.generate_ca_certificate)
+    crypto_commands.sign_certificate = timer.time('sign', crypto_commands.sign_certificate)
+    parameters = {'all': True,
+                  'overwrite': False,
+                  'jobs': args.jobs,
+                  'key_jobs': getattr(args, 'key_jobs', None)}
+    scheduler = CryptoCommands.scheduler(parameters)
+    for group_key, group_value in data.items():
+        crypto_commands.add_tasks(scheduler, parameters, group_value, group_key)
+    start = time.perf_counter()
+    results = scheduler.run()
+    elapsed = time.perf_counter() - start
+
+    certificates = sum(1 for key, state in results.items()
+                       if key[2] == 'crt' and state == Task.SUCCEEDED)
+    failed = sum(1 for state in results.values() if state != Task.SUCCEEDED)
+    return {'stages': timer.summary(),
+            'generation_seconds': elapsed,
+            'certificates': certificates,
+            'failed_steps': failed,
+            'certificates_per_second': certificates / elapsed if elapsed > 0 else None}
+
+
+def compare(results, baseline):
+    """
+    Prints the change of each stage's p50 and p90 and of the throughput
+    against a previous run.
+    """
+
+    print('{0:<24}{1:>12}{2:>12}{3:>10}'.format('stage', 'baseline', 'current', 'change'))
+    rows = []
+    for stage, summary in sorted(results['stages'].items()):
+        previous = baseline.get('stages', {}).get(stage)
+        if previous is None:
+            continue
+        for p in ('p50', 'p90'):
+            rows.append(('{0} {1}'.format(stage, p), previous[p], summary[p]))
+    rows.append(('certs/sec',
+                 baseline.get('certificates_per_second'),
+                 results.get('certificates_per_second')))
+    for name, previous, current in rows:
+        if not previous or current is None:
+            continue
+        print('{0:<24}{1:>12.6f}{2:>12.6f}{3:>+9.1f}%'.format(
+            name, previous, current, (current - previous) / previous * 100))
+
+
+def main():
+    parser = ArgumentParser(description="Benchmarks the generation pipeline.")
+    parser.add_argument('--groups', type=int, default=2,
+                        help="Number of groups, defaults to 2.")
+    parser.add_argument('--users', type=int, default=50,
+                        help="Number of users per group, defaults to 50.")
+    parser.add_argument('--bits', type=str, default='2048,3072',
+                        help="Key sizes of the users, separated by ',', defaults to 2048,3072.")
+    parser.add_argument('--protected-ratio', dest='protected_ratio', type=float, default=0.5,
+                        help="Share of the users with a protected key, defaults to 0.5.")
+    parser.add_argument('--key-type', dest='key_type', choices=['rsa', 'ec', 'ed25519'], default='rsa',
+                        help="Algorithm of the keys, defaults to rsa.")
+    parser.add_argument('--curve', type=str, default='P-256',
+                        help="Curve of the ec keys, defaults to P-256.")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="Number of steps executed in parallel, defaults to 1.")
+    parser.add_argument('--key-jobs', dest='key_jobs', type=int, default=None,
+                        help="Number of keys generated in parallel, in addition to --jobs, "
+                             "defaults to keys sharing --jobs.")
+    parser.add_argument('--openssl', type=str, default='/usr/bin/openssl',
+                        help="Location of the openssl binaries, defaults to /usr/bin/openssl.")
+    parser.add_argument('--backend', choices=['openssl', 'cryptography'], default='openssl',
+                        help="Backend generating the files, defaults to openssl.")
+    parser.add_argument('--workdir', type=str, default=None,
+                        help="Directory to generate the files in, defaults to a temporary directory.")
+    parser.add_argument('--output', type=str, default=None,
+                        help="Location of the JSON results, printed if not specified.")
+    parser.add_argument('--compare', type=str, default=None,
+                        help="JSON results of a previous run to compare with.")
+    args = parser.parse_args()
+
+    if args.workdir is not None:
+        os.makedirs(args.workdir, exist_ok=True)
+        results = run(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run(args, directory)
+    results['parameters'] = {'groups': args.groups,
+                             'users': args.users,
+                             'bits': args.bits,
+                             'protected_ratio': args.protected_ratio,
+                             'key_type': args.key_type,
+                             'curve': args.curve,
+                             'jobs': args.jobs,
+                             'key_jobs': args.key_jobs,
+                             'backend': args.backend}
+    results['environment'] = {'python': platform.python_version(),
+                              'platform': platform.platform(),
+                              'openssl': openssl_version(args.openssl),
+                              'cpus': os.cpu_count()}
+    content = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(content)
+    else:
+        print(content)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
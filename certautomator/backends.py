@@ -0,0 +1,263 @@
+from certautomator.utils import FileHandler
+import datetime
+import logging
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+except ImportError:
+    x509 = None
+
+
+class CryptographyBackend:
+    """
+    Generates the keys, requests and certificates in process using the
+    cryptography package instead of executing the openssl binaries.
+
+    CryptoCommands uses a backend through the methods below, each returning
+    True if its file was written, False otherwise. CryptoCommands checks
+    that the input files exist and that the outputs may be written before
+    calling the backend. Passwords are given as openssl pass phrase
+    arguments, i.e. pass:<secret> or file:<location>, or None if the key is
+    not protected.
+
+        generate_key(user, password) : the key of the user at user.key_file.
+        generate_pool_key(filename, bits, password) : a key of the given size
+            at filename for the key pool, encrypted with the pool's password.
+        import_key(filename, pool_password, user, password) : the pooled key
+            at filename, encrypted with pool_password, as the key of the user.
+        generate_csr(user, password) : the request of the user at
+            user.certificate_signing_request_file, using user.key_file.
+        generate_ca_certificate(ca, password) : the self signed certificate
+            of the CA at ca.certificate_file.
+        open_signing_context(ca, ca_password) : loads the key and certificate
+            of the CA to sign several requests with, None if an error occurred.
+        sign_with_context(user, context, serial) : signs the request of the
+            user with a loaded CA, with the serial number or a random one, and
+            writes the certificate at user.certificate_file.
+    """
+
+    # -- Curves of the ec keys, by their openssl names. --
+    CURVES = {'P-256': 'SECP256R1',
+              'prime256v1': 'SECP256R1',
+              'P-384': 'SECP384R1',
+              'secp384r1': 'SECP384R1',
+              'P-521': 'SECP521R1',
+              'secp521r1': 'SECP521R1'}
+
+    def __init__(self,
+                 logger=logging.getLogger('certautomator.backends'),
+                 filehandler=FileHandler(),
+                 public_exponent=65537):
+        """
+        Args:
+            logger (logging.Logger) : Handles logging features.
+            filehandler (certautomator.FileHandler) : object responsible for file operations.
+            public_exponent (int) : public exponent of the generated RSA keys.
+        """
+
+        if x509 is None:
+            raise Exception(
+                'The cryptography package is required to use the cryptography backend.')
+        self._logger = logger
+        self._fh = filehandler
+        self._public_exponent = public_exponent
+
+    def generate_key(self, user, password=None):
+        try:
+            if user.key_type == 'ec':
+                key = ec.generate_private_key(getattr(ec, CryptographyBackend.CURVES[user.curve])())
+            elif user.key_type == 'ed25519':
+                key = ed25519.Ed25519PrivateKey.generate()
+            elif user.key_type == 'rsa':
+                key = rsa.generate_private_key(public_exponent=self._public_exponent,
+                                               key_size=user.bits)
+            else:
+                self._logger.warning("Unknown key type %s for %s.", user.key_type, user.name)
+                return False
+            return self._write_key(user.key_file, key, password)
+        except Exception as e:
+            self._logger.warning(
+                "Unable to generate key for %s: %s", user.name, e)
+        return False
+
+    def generate_pool_key(self, filename, bits, password):
+        try:
+            key = rsa.generate_private_key(public_exponent=self._public_exponent,
+                                           key_size=bits)
+            return self._write_key(filename, key, password)
+        except Exception as e:
+            self._logger.warning(
+                "Unable to generate key for the key pool: %s", e)
+        return False
+
+    def import_key(self, filename, pool_password, user, password=None):
+        try:
+            key = self._load_key(filename, pool_password)
+            return self._write_key(user.key_file, key, password)
+        except Exception as e:
+            self._logger.warning(
+                "Unable to import pooled key for %s: %s", user.name, e)
+        return False
+
+    def generate_csr(self, user, password=None):
+        try:
+            key = self._load_key(user.key_file, password)
+            request = x509.CertificateSigningRequestBuilder().subject_name(
+                self._subject(user)).sign(key, self._hash(user.message_digest, key))
+            return self._fh.write_bytes(user.certificate_signing_request_file,
+                                        request.public_bytes(serialization.Encoding.PEM))
+        except Exception as e:
+            self._logger.warning(
+                "Unable to generate certificate request for %s: %s", user.name, e)
+        return False
+
+    def generate_ca_certificate(self, ca, password=None):
+        try:
+            key = self._load_key(ca.key_file, password)
+            subject = self._subject(ca)
+            builder = self._certificate_builder(subject,
+                                                subject,
+                                                key.public_key(),
+                                                key.public_key(),
+                                                ca.certificate_expiration)
+            builder = builder.add_extension(
+                x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            certificate = builder.sign(key, self._hash(ca.message_digest, key))
+            return self._fh.write_bytes(ca.certificate_file,
+                                        certificate.public_bytes(serialization.Encoding.PEM))
+        except Exception as e:
+            self._logger.warning(
+                "Unable to generate CA certificate for %s: %s", ca.name, e)
+        return False
+
+    def open_signing_context(self, ca, ca_password=None):
+        try:
+            ca_key = self._load_key(ca.key_file, ca_password)
+            ca_certificate = x509.load_pem_x509_certificate(
+                self._read_bytes(ca.certificate_file))
+            return (ca_certificate, ca_key)
+        except Exception as e:
+            self._logger.warning(
+                "Unable to load Certificate Authority %s: %s", ca.name, e)
+        return None
+
+    def sign_with_context(self, user, context, serial=None):
+        ca_certificate, ca_key = context
+        try:
+            request = x509.load_pem_x509_csr(
+                self._read_bytes(user.certificate_signing_request_file))
+            if not request.is_signature_valid:
+                self._logger.warning(
+                    "Certificate signing request of %s has an invalid signature.", user.name)
+                return False
+            certificate = self._certificate_builder(request.subject,
+                                                    ca_certificate.subject,
+                                                    request.public_key(),
+                                                    ca_key.public_key(),
+                                                    user.certificate_expiration,
+                                                    serial).sign(ca_key, self._hash(user.message_digest, ca_key))
+            return self._fh.write_bytes(user.certificate_file,
+                                        certificate.public_bytes(serialization.Encoding.PEM))
+        except Exception as e:
+            self._logger.warning(
+                "Unable to sign certificate for %s: %s", user.name, e)
+        return False
+
+    def _certificate_builder(self, subject, issuer, public_key, issuer_public_key, days, serial=None):
+        """
+        Returns a certificate builder valid from now for the number of days,
+        with the serial number, random if None, and the key identifier extensions.
+        """
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return x509.CertificateBuilder().subject_name(
+            subject
+        ).issuer_name(
+            issuer
+        ).public_key(
+            public_key
+        ).serial_number(
+            serial if serial is not None else x509.random_serial_number()
+        ).not_valid_before(
+            now
+        ).not_valid_after(
+            now + datetime.timedelta(days=days)
+        ).add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(public_key), critical=False
+        ).add_extension(
+            x509.AuthorityKeyIdentifier.from_issuer_public_key(issuer_public_key), critical=False
+        )
+
+    @staticmethod
+    def _hash(digest, key):
+        """
+        Returns the hash algorithm of the message digest, e.g. sha256, or
+        None for ed25519 keys, which sign without a separate digest.
+        """
+
+        if isinstance(key, ed25519.Ed25519PrivateKey):
+            return None
+        return getattr(hashes, digest.upper())()
+
+    def _subject(self, user):
+        """
+        Returns the distinguished names of the user as an x509.Name, in the
+        same order as format_distinguished_names.
+        """
+
+        values = [(NameOID.COUNTRY_NAME, user.country),
+                  (NameOID.STATE_OR_PROVINCE_NAME, user.state),
+                  (NameOID.LOCALITY_NAME, user.locality),
+                  (NameOID.ORGANIZATION_NAME, user.organization_name),
+                  (NameOID.ORGANIZATIONAL_UNIT_NAME, user.organizational_unit_name),
+                  (NameOID.COMMON_NAME, user.common_name),
+                  (NameOID.EMAIL_ADDRESS, user.email)]
+        return x509.Name([x509.NameAttribute(oid, value)
+                          for oid, value in values if value is not None])
+
+    def _write_key(self, filename, key, password):
+        encryption = serialization.NoEncryption()
+        if password is not None:
+            encryption = serialization.BestAvailableEncryption(
+                self._passphrase(password))
+        return self._fh.write_bytes(filename,
+                                    key.private_bytes(serialization.Encoding.PEM,
+                                                      serialization.PrivateFormat.PKCS8,
+                                                      encryption),
+                                    permissions=0o600)
+
+    def _load_key(self, filename, password):
+        return serialization.load_pem_private_key(
+            self._read_bytes(filename),
+            self._passphrase(password) if password is not None else None)
+
+    def _read_bytes(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def _passphrase(self, password):
+        """
+        Returns the secret of an openssl pass phrase argument. As with
+        openssl, only the first line of a password file is used.
+
+        Args:
+            password (str) : pass:<secret> or file:<location>.
+
+        Returns:
+            (bytes) : the secret.
+        """
+
+        if password.startswith('pass:'):
+            return password[len('pass:'):].encode()
+        if password.startswith('file:'):
+            content = self._fh.read(password[len('file:'):])
+            if content is None:
+                raise Exception('Unable to read password file.')
+            return content.splitlines()[0].encode() if content else b''
+        raise Exception('Unsupported password argument.')
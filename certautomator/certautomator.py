@@ -1,10 +1,28 @@
 from argparse import ArgumentParser
 from certautomator.utils import Config
 from certautomator.utils import FileHandler
+from certautomator.utils import SnapshotFileHandler
 from certautomator.utils_parser import Utils_Parser
+from certautomator.backends import CryptographyBackend
 from certautomator.crypto_cmds import CryptoCommands
+from certautomator.crypto_cmds import Issuer
+from certautomator.daemon import Daemon
+from certautomator.journal import Journal
+from certautomator.key_pool import KeyPool
+from certautomator.manifest import BuildManifest
+from certautomator.metrics import Metrics
+from certautomator.plan import Plan
+from certautomator.scheduler import Task
+from certautomator.serials import CounterSerials
+from certautomator.watcher import ConfigWatcher
+from json.decoder import JSONDecodeError
+import asyncio
 import logging
 import operator
+import os
+import signal
+import threading
+import time
 
 
 class Main():
@@ -23,6 +41,275 @@ class Main():
         self._fh.setFormatter(self._formatter)
         self._logger.addHandler(self._fh)
 
+    def _start_key_pool(self, cmds):
+        """
+        Sets up the key pool specified by --key-pool and starts refilling it
+        in the background. The sizes of the keys are added as the users are read.
+
+        Args:
+            cmds (dictionary) : The parsed command line arguments
+
+        Returns:
+            certautomator.KeyPool : the started pool, None if no pool was specified.
+        """
+
+        if cmds.get('key_pool') is None:
+            return None
+        key_pool = KeyPool(cmds.get('key_pool'),
+                           self._crypto_commands.generate_pool_key,
+                           size=cmds.get('key_pool_size'),
+                           jobs=cmds.get('key_jobs') or cmds.get('jobs'))
+        if key_pool.setup() is False:
+            raise Exception(
+                'Unable to setup the key pool at {0}.'.format(cmds.get('key_pool')))
+        self._crypto_commands.key_pool = key_pool
+        key_pool.start([])
+        return key_pool
+
+    def _open_journal(self, cmds):
+        """
+        Opens the journal specified by --journal, reading the steps of the
+        interrupted run first with --resume.
+
+        Args:
+            cmds (dictionary) : The parsed command line arguments
+
+        Returns:
+            certautomator.Journal : the opened journal, None if no journal was specified.
+        """
+
+        if cmds.get('journal') is None:
+            return None
+        journal = Journal(cmds.get('journal'))
+        if cmds.get('resume'):
+            journal.load()
+        if journal.open(resume=cmds.get('resume')) is False:
+            raise Exception(
+                'Unable to open the journal at {0}.'.format(cmds.get('journal')))
+        self._crypto_commands.journal = journal
+        return journal
+
+    def _generate(self, cmds, batches, key_pool):
+        """
+        Generates the files of each batch of cas and users read from the
+        config file. The cas of a group are generated before its users are
+        read, then each batch of users is generated before reading the next.
+        The signing sessions of the cas are kept for the whole run, so the
+        key of each ca is loaded once.
+
+        Args:
+            cmds (dictionary) : The parsed command line arguments
+            batches (iterator) : (group name, batch) as yielded by Utils_Parser.iter_parse.
+            key_pool (certautomator.KeyPool) : pool to add the sizes of the keys to, if any.
+
+        Returns:
+            (int) : number of batches generated.
+        """
+
+        scheduler = CryptoCommands.scheduler(cmds)
+        asynchronous = cmds.get('asyncio') is True
+        loop = asyncio.new_event_loop() if asynchronous else None
+        issuers = {}
+        count = 0
+        metrics = self._crypto_commands.metrics
+        batches = iter(batches)
+        try:
+            while True:
+                start = time.perf_counter()
+                group_key, batch = next(batches, (None, None))
+                if metrics is not None:
+                    metrics.stage('config_parse', time.perf_counter() - start)
+                if batch is None:
+                    break
+                if group_key not in issuers:
+                    self._logger.info(
+                        "Generating files for group: %s.", group_key)
+                    issuers[group_key] = None
+                count += 1
+                if key_pool is not None:
+                    key_pool.add_bits([entity.bits for entities in batch.values()
+                                       for entity in entities.values()
+                                       if entity is not None and entity.key_type == 'rsa'])
+                if 'ca' in batch:
+                    group_issuers = self._crypto_commands.add_ca_tasks(
+                        scheduler, cmds, batch.get('ca'), group_key, asynchronous)
+                    results = self._run(scheduler, loop)
+                    for name, issuer in group_issuers.items():
+                        if issuer.task is not None and results.get(issuer.task) != Task.SUCCEEDED:
+                            self._logger.warning(
+                                "Certificate Authority %s of group %s failed, its users will not be signed.",
+                                name, group_key)
+                            issuer = Issuer(None, None, issuer.fingerprint, None)
+                        # -- The CA is done, the users no longer depend on its task. --
+                        group_issuers[name] = issuer._replace(task=None)
+                    issuers[group_key] = group_issuers
+                else:
+                    self._crypto_commands.add_user_tasks(
+                        scheduler, cmds, batch.get('users'), group_key, issuers.get(group_key),
+                        asynchronous)
+                    self._run(scheduler, loop)
+        finally:
+            if loop is not None:
+                loop.close()
+        return count
+
+    def _plan(self, cmds, batches):
+        """
+        Plans the generation of each batch without performing it: the
+        operations are printed, or written to the plan file, with an
+        estimate of their duration from the timings of a previous run.
+        Key pools and serial files are left untouched and the manifest
+        is read but not saved.
+
+        Args:
+            cmds (dictionary) : The parsed command line arguments
+            batches (iterator) : (group name, batch) as yielded by Utils_Parser.iter_parse.
+        """
+
+        plan = Plan()
+        self._crypto_commands.plan = plan
+        if cmds.get('manifest') is not None:
+            manifest = BuildManifest(cmds.get('manifest'))
+            manifest.load()
+            self._crypto_commands.manifest = manifest
+        timings = None
+        if cmds.get('timings') is not None:
+            timings = Config().read_config(cmds.get('timings'))
+            if timings is None:
+                raise Exception(
+                    'Unable to read the timings at {0}.'.format(cmds.get('timings')))
+        try:
+            if self._generate(cmds, batches, None) == 0:
+                print('No data found in configuration file.')
+                return
+        finally:
+            self._crypto_commands.plan = None
+        if cmds.get('plan') == '-':
+            print(plan.report(timings, cmds.get('jobs')))
+        else:
+            plan.write(cmds.get('plan'), timings, cmds.get('jobs'))
+            print(plan.report(timings, cmds.get('jobs')).splitlines()[-1])
+
+    def _serve(self, cmds, data_parser):
+        """
+        Runs the daemon listening on the socket given by --daemon, until it
+        receives a stop request, SIGTERM or SIGINT.
+
+        Args:
+            cmds (dictionary) : The parsed command line arguments
+            data_parser (certautomator.Utils_Parser) : parses the config file.
+        """
+
+        key_pool = self._start_key_pool(cmds)
+        daemon = Daemon(self._crypto_commands,
+                        cmds.get('config'),
+                        cmds,
+                        parser=data_parser,
+                        key_pool=key_pool)
+        try:
+            if daemon.load() is False:
+                raise Exception(
+                    'Unable to load the configuration file {0}.'.format(cmds.get('config')))
+            if daemon.listen(cmds.get('daemon')) is False:
+                raise Exception('Unable to listen on {0}.'.format(cmds.get('daemon')))
+            # -- stop waits for serve to return, it can't run in the handler. --
+            signal.signal(signal.SIGTERM,
+                          lambda signum, frame: threading.Thread(target=daemon.stop).start())
+            try:
+                daemon.serve()
+            except KeyboardInterrupt:
+                pass
+        finally:
+            self._logger.info("Stopping daemon.")
+            daemon.close()
+            if key_pool is not None:
+                key_pool.stop()
+            if self._crypto_commands.metrics is not None:
+                self._crypto_commands.metrics.log_summary()
+                if cmds.get('metrics') is not None:
+                    self._crypto_commands.metrics.write(cmds.get('metrics'))
+
+    def _watch(self, cmds, parse, key_pool):
+        """
+        Generates the files of the config file, then polls it and, each time
+        it changes, generates only the users and cas added or changed since,
+        see ConfigWatcher. The steps whose values changed overwrite their
+        files, according to the manifest given by --manifest or, without
+        one, a manifest kept in memory. Runs until SIGTERM or SIGINT.
+
+        Args:
+            cmds (dictionary) : The parsed command line arguments
+            parse (callable) : returns the batches of the config file, as Utils_Parser.iter_parse.
+            key_pool (certautomator.KeyPool) : pool to add the sizes of the keys to, if any.
+        """
+
+        watcher = ConfigWatcher(cmds.get('config'), interval=cmds.get('watch'))
+        if self._crypto_commands.manifest is None:
+            self._crypto_commands.manifest = BuildManifest(None)
+        signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+        # -- The files that exist when the watch starts are taken as generated --
+        # -- from the current values, changes are reissued from then on. --
+        baseline = dict(cmds, adopt_existing=True)
+        parameters = dict(cmds, reissue_changed=True, overwrite=False)
+        first = True
+        try:
+            while watcher.wait():
+                # -- The files may have changed since the previous scan. --
+                self._crypto_commands.filehandler = SnapshotFileHandler()
+                try:
+                    self._generate(baseline if first else parameters, watcher.filter(parse()), key_pool)
+                except (OSError, JSONDecodeError) as e:
+                    self._logger.warning("Unable to read %s, waiting for it to change: %s",
+                                         cmds.get('config'), e)
+                    continue
+                watcher.report(first)
+                first = False
+                if cmds.get('manifest') is not None:
+                    self._crypto_commands.manifest.save()
+        except KeyboardInterrupt:
+            pass
+        self._logger.info("Stopped watching %s.", cmds.get('config'))
+
+    @staticmethod
+    def _parse_cpus(cpus):
+        """
+        Parses a list of cpus, e.g. 0-3,8, checking that the process may
+        run on them.
+
+        Args:
+            cpus (str) : cpus and ranges of cpus, separated by ','.
+
+        Returns:
+            (set) : the cpus.
+        """
+
+        if not hasattr(os, 'sched_setaffinity'):
+            raise Exception('--key-cpus is not supported on this platform.')
+        parsed = set()
+        try:
+            for part in cpus.split(','):
+                first, _, last = part.strip().partition('-')
+                parsed.update(range(int(first), int(last or first) + 1))
+        except ValueError:
+            raise Exception('Invalid --key-cpus {0}, expected e.g. 0-3,8.'.format(cpus))
+        unavailable = parsed - os.sched_getaffinity(0)
+        if not parsed or unavailable:
+            raise Exception('Invalid --key-cpus {0}, cpus {1} are not available.'.format(
+                cpus, ','.join(str(cpu) for cpu in sorted(unavailable))))
+        return parsed
+
+    def _run(self, scheduler, loop=None):
+        """
+        Runs the tasks of the scheduler, in the event loop if there is one.
+
+        Returns:
+            results (dictionary) : state of each task, by key.
+        """
+
+        if loop is not None:
+            return loop.run_until_complete(scheduler.run_async())
+        return scheduler.run()
+
     def main(self):
         try:
             parser = ArgumentParser()
@@ -60,6 +347,15 @@ class Main():
                 default='/usr/bin/openssl',
                 required=False
             )
+            parser.add_argument(
+                '--backend',
+                type=str,
+                choices=['openssl', 'cryptography'],
+                help="Generate keys and certificates with the openssl binaries or in process " +
+                     "with the cryptography package, defaults to openssl.",
+                default='openssl',
+                required=False
+            )
             parser.add_argument(
                 '--overwrite',
                 help="Overwrite existing files.",
@@ -103,6 +399,151 @@ class Main():
                                 action='store',
                                 default=False,
                                 help="Enter the name of the users, separated by ','.")
+            parser.add_argument('--jobs',
+                                '-j',
+                                dest='jobs',
+                                type=int,
+                                action='store',
+                                default=1,
+                                help="Number of steps to execute in parallel, defaults to 1.")
+            parser.add_argument('--key-jobs',
+                                dest='key_jobs',
+                                type=int,
+                                action='store',
+                                default=None,
+                                help="Number of keys to generate in parallel, in addition to " +
+                                     "--jobs requests and certificates. Defaults to keys sharing --jobs.")
+            parser.add_argument('--key-cpus',
+                                dest='key_cpus',
+                                type=str,
+                                action='store',
+                                default=None,
+                                help="Cpus to generate the keys on, e.g. 0-3,8, defaults to any cpu.")
+            parser.add_argument('--backlog',
+                                dest='backlog',
+                                type=int,
+                                action='store',
+                                default=None,
+                                help="With --key-jobs, number of requests and certificates waiting " +
+                                     "for a job above which key generation pauses, defaults to twice --jobs.")
+            parser.add_argument('--asyncio',
+                                dest='asyncio',
+                                action='store_true',
+                                default=False,
+                                help="Execute the openssl commands from a single thread with asyncio " +
+                                     "instead of one thread per job.")
+            parser.add_argument('--batch-size',
+                                dest='batch_size',
+                                type=int,
+                                action='store',
+                                default=1000,
+                                help="Number of users read from the configuration file and " +
+                                     "generated at a time, defaults to 1000.")
+            parser.add_argument('--key-pool',
+                                dest='key_pool',
+                                type=str,
+                                action='store',
+                                default=None,
+                                help="Location of the pool of keys generated ahead of time. " +
+                                     "Keys are taken from the pool when available and the pool " +
+                                     "is refilled in the background.")
+            parser.add_argument('--key-pool-size',
+                                dest='key_pool_size',
+                                type=int,
+                                action='store',
+                                default=10,
+                                help="Number of keys kept in the pool for each key size, defaults to 10.")
+            parser.add_argument('--fill-key-pool',
+                                dest='fill_key_pool',
+                                action='store_true',
+                                default=False,
+                                help="Wait for the key pool to be full before exiting.")
+            parser.add_argument('--manifest',
+                                dest='manifest',
+                                type=str,
+                                action='store',
+                                default=None,
+                                help="Location of the build manifest. Users and CAs whose values " +
+                                     "did not change since their files were generated are skipped.")
+            parser.add_argument('--metrics',
+                                dest='metrics',
+                                type=str,
+                                action='store',
+                                default=None,
+                                help="Location of the file to write the metrics of the steps to, " +
+                                     "in the Prometheus text format if it ends with .prom, as JSON otherwise.")
+            parser.add_argument('--reissue-changed',
+                                dest='reissue_changed',
+                                action='store_true',
+                                default=False,
+                                help="Overwrite the keys, requests and certificates generated from " +
+                                     "values that changed since, according to the manifest.")
+            parser.add_argument('--plan',
+                                dest='plan',
+                                type=str,
+                                nargs='?',
+                                const='-',
+                                default=None,
+                                help="Print the operations that would be performed and an estimate of " +
+                                     "their duration without executing any openssl command or creating " +
+                                     "any directory. Writes them as JSON if a file is given.")
+            parser.add_argument('--timings',
+                                dest='timings',
+                                type=str,
+                                action='store',
+                                default=None,
+                                help="Metrics of a previous run, written by --metrics as JSON, used by " +
+                                     "--plan to estimate the duration of the operations.")
+            parser.add_argument('--serials',
+                                dest='serials',
+                                choices=['random', 'counter'],
+                                default='random',
+                                help="Serial numbers of the signed certificates: random 159 bit numbers " +
+                                     "(random) or consecutive numbers reserved from the CA's serial file " +
+                                     "(counter), defaults to random.")
+            parser.add_argument('--ca',
+                                dest='ca',
+                                type=str,
+                                action='store',
+                                default=None,
+                                help="Name of the CA signing the users that don't name one with their " +
+                                     "ca entry, instead of the last CA of their group.")
+            parser.add_argument('--journal',
+                                dest='journal',
+                                type=str,
+                                action='store',
+                                default=None,
+                                help="Location of the journal recording each completed step and a " +
+                                     "hash of the file it produced. Started over by each run, unless --resume.")
+            parser.add_argument('--resume',
+                                dest='resume',
+                                action='store_true',
+                                default=False,
+                                help="Continue the interrupted run recorded in the journal: completed " +
+                                     "steps are skipped, files it may not have completed are regenerated.")
+            parser.add_argument('--daemon',
+                                dest='daemon',
+                                type=str,
+                                action='store',
+                                default=None,
+                                help="Location of a UNIX socket to listen on for issuance requests, " +
+                                     "keeping the configuration and the CAs loaded.")
+            parser.add_argument('--watch',
+                                dest='watch',
+                                type=float,
+                                nargs='?',
+                                const=5.0,
+                                default=None,
+                                metavar='SECONDS',
+                                help="Keep running and check the configuration file every SECONDS, " +
+                                     "5 by default: once it changed, only the users and CAs added or " +
+                                     "changed since are generated, the removed ones are reported.")
+            parser.add_argument('--batch-sign',
+                                dest='batch_sign',
+                                action='store_true',
+                                default=False,
+                                help="Sign the requests of a group with a few openssl ca commands " +
+                                     "instead of one openssl x509 command per user.")
             cmds = vars(parser.parse_args())
             logfile = cmds.get('log')
             self._setupLogging(logfile=logfile)
@@ -114,35 +555,109 @@ class Main():
                 config = cmds.get('config')
             openssl = cmds.get('openssl')
             config = cmds.get('config')
-            if self._filehandler.file_exists(openssl) is False:
+            if cmds.get('jobs') < 1:
+                raise Exception(
+                    '--jobs must be a positive number, got {0}.'.format(cmds.get('jobs')))
+            for option in ('key_jobs', 'backlog'):
+                if cmds.get(option) is not None and cmds.get(option) < 1:
+                    raise Exception('--{0} must be a positive number, got {1}.'.format(
+                        option.replace('_', '-'), cmds.get(option)))
+            if cmds.get('key_cpus') is not None:
+                self._crypto_commands.key_cpus = Main._parse_cpus(cmds.get('key_cpus'))
+            if cmds.get('batch_size') < 1:
+                raise Exception(
+                    '--batch-size must be a positive number, got {0}.'.format(cmds.get('batch_size')))
+            if cmds.get('backend') == 'cryptography':
+                self._crypto_commands.backend = CryptographyBackend()
+            elif self._filehandler.file_exists(openssl) is False:
                 raise Exception(
                     'Cannot find the openssl binaries at {0}.'.format(openssl))
+            else:
+                self._crypto_commands.openssl_location = openssl
+            if cmds.get('serials') == 'counter' and cmds.get('plan') is None:
+                self._crypto_commands.serials = CounterSerials()
             if self._filehandler.file_exists(config) is False:
                 raise Exception(
                     '{0} configuration file does not exist.'.format(config))
-            if(cmds.get('all') is False and
+            if cmds.get('fill_key_pool') and cmds.get('key_pool') is None:
+                raise Exception('--fill-key-pool requires --key-pool.')
+            if cmds.get('reissue_changed') and cmds.get('manifest') is None:
+                raise Exception('--reissue-changed requires --manifest.')
+            if cmds.get('resume') and cmds.get('journal') is None:
+                raise Exception('--resume requires --journal.')
+            if cmds.get('daemon') is not None and any(
+                    cmds.get(option) is not None for option in ('plan', 'journal', 'manifest')):
+                raise Exception('--daemon cannot be used with --plan, --journal or --manifest.')
+            if (cmds.get('batch_sign') and cmds.get('serials') == 'counter' and
+                    cmds.get('backend') != 'cryptography'):
+                raise Exception('--batch-sign cannot be used with --serials counter, ' +
+                                'openssl ca allocates the serial numbers itself.')
+            if cmds.get('watch') is not None:
+                if cmds.get('watch') <= 0:
+                    raise Exception(
+                        '--watch must be a positive number, got {0}.'.format(cmds.get('watch')))
+                if any(cmds.get(option) is not None for option in ('plan', 'journal', 'daemon')):
+                    raise Exception('--watch cannot be used with --plan, --journal or --daemon.')
+            if(cmds.get('daemon') is None and
+               cmds.get('all') is False and
                (cmds.get('key') is False and
                 cmds.get('req') is False and
-                    cmds.get('sign') is False)):
-                print('--all or one of --key, --req and/or --sign is required.')
+                    cmds.get('sign') is False and
+                    cmds.get('fill_key_pool') is False)):
+                print('--all, --fill-key-pool or one of --key, --req and/or --sign is required.')
                 parser.print_help()
             else:
                 reader = Config()
-                data_parser = Utils_Parser()
-                file_content = reader.read_config(config)
-                data = data_parser.parse(
-                    data=file_content,
+                planning = cmds.get('plan') is not None
+                data_parser = Utils_Parser(create_directories=not planning)
+                watching = cmds.get('watch') is not None
+                parse = lambda: data_parser.iter_parse(
+                    reader.iter_config(config, strict=watching),
                     specified_groups=cmds.get('group').split(',') if cmds.get(
                         'group') is not False else None,
                     specified_users=cmds.get('users').split(',') if cmds.get(
-                        'users') is not False else None)
-                if data is not None:
-                    for group_key, group_value in data.items():
-                        self._logger.info(
-                            "Generating files for group: %s.", group_key)
-                        self._crypto_commands.generate(cmds, group_value)
-                else:
-                    print('No data found in configuration file.')
+                        'users') is not False else None,
+                    batch_size=cmds.get('batch_size'),
+                    wait_for_ca=bool(cmds.get('sign') or cmds.get('all')))
+                batches = parse()
+                metrics = Metrics()
+                self._crypto_commands.metrics = metrics
+                if cmds.get('daemon') is not None:
+                    # -- Files change between requests, they are not scanned once. --
+                    self._serve(cmds, data_parser)
+                    return
+                # -- Existing keys, requests and certificates are looked up
+                # in one scan of each directory. When planning, the files
+                # that would be written are added to the scan. --
+                self._crypto_commands.filehandler = SnapshotFileHandler()
+                if planning:
+                    self._plan(cmds, batches)
+                    return
+                key_pool = self._start_key_pool(cmds)
+                manifest = None
+                if cmds.get('manifest') is not None:
+                    manifest = BuildManifest(cmds.get('manifest'))
+                    manifest.load()
+                    self._crypto_commands.manifest = manifest
+                journal = self._open_journal(cmds)
+                completed = False
+                try:
+                    if watching:
+                        self._watch(cmds, parse, key_pool)
+                    elif self._generate(cmds, batches, key_pool) == 0:
+                        print('No data found in configuration file.')
+                    completed = True
+                finally:
+                    if journal is not None:
+                        journal.close(finished=completed)
+                    if manifest is not None:
+                        manifest.save()
+                    if key_pool is not None:
+                        self._logger.info("Stopping key pool.")
+                        key_pool.stop(wait_until_full=cmds.get('fill_key_pool'))
+                    metrics.log_summary()
+                    if cmds.get('metrics') is not None:
+                        metrics.write(cmds.get('metrics'))
         except IOError as ioe:
             print(ioe)
         except Exception as e:
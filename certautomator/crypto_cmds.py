@@ -1,70 +1,650 @@
 from certautomator.user import User
 from certautomator.utils import FileHandler
+from certautomator.manifest import BuildManifest
+from certautomator.scheduler import TaskScheduler
+from certautomator.serials import RandomSerials
+from collections import namedtuple
+import asyncio
 import logging
+import os
+import re
 import subprocess
+import threading
+import time
+
+# -- Decrypted key of the CA, None if openssl can read the CA's key file. --
+_OpenSSLSigningContext = namedtuple('_OpenSSLSigningContext', ['key'])
+
+# -- Openssl command of a step, the file descriptors it inherits, the key   --
+# -- of the lock it must hold, whether its output is captured, what to do  --
+# -- with its result, i.e. the output if captured, and once it is done,    --
+# -- and the cpus its process is pinned to, if any.                        --
+class _Command:
+
+    def __init__(self, args, pass_fds=(), lock=None, capture=False, finish=None, cleanup=None,
+                 cpus=None):
+        self.args = args
+        self.pass_fds = pass_fds
+        self.lock = lock
+        self.capture = capture
+        self.finish = finish
+        self.cleanup = cleanup
+        self.cpus = cpus
+
+
+# -- openssl ca configuration of the CAs signing requests in batches. The --
+# -- subject of the requests is kept as is, every field is optional.      --
+_BATCH_CONFIG = """[ ca ]
+default_ca = batch
+
+[ batch ]
+dir = {directory}
+database = $dir/index.txt
+new_certs_dir = $dir/certs
+rand_serial = yes
+unique_subject = no
+default_md = default
+preserve = yes
+copy_extensions = none
+policy = batch_policy
+
+[ batch_policy ]
+countryName = optional
+stateOrProvinceName = optional
+localityName = optional
+organizationName = optional
+organizationalUnitName = optional
+commonName = optional
+emailAddress = optional
+"""
+
+# -- Options of the openssl commands taking a pass phrase argument. --
+_PASSWORD_OPTIONS = ('-pass', '-passin', '-passout')
+
+# -- CA signing the users of a group, its session, the fingerprint of its --
+# -- certificate and the key of the task generating that certificate.     --
+Issuer = namedtuple('Issuer', ['ca', 'session', 'fingerprint', 'task'])
 
 
 class CryptoCommands:
 
+    # -- Maximum number of requests signed by a single openssl ca command. --
+    BATCH_SIGNING_SIZE = 500
+
     def __init__(self,
                  logger=logging.getLogger('certautomator.cryptocommands'),
                  openssl_location='/usr/bin/openssl',
-                 filehandler=FileHandler()):
+                 filehandler=FileHandler(),
+                 backend=None,
+                 key_pool=None,
+                 manifest=None,
+                 metrics=None,
+                 max_processes=32,
+                 serials=None,
+                 plan=None,
+                 journal=None,
+                 key_cpus=None):
         """
         Args:
             logger (logging.Logger) : Handles logging features.
             openssl_location (str) : Location of the openssl binaries
             filehandler (certautomator.FileHandler) : object responsible for file operations,
                            file exists, etc.
+            backend (certautomator.CryptographyBackend) : generates the keys, requests and certificates.
+                           Defaults to None, executing the openssl binaries.
+            key_pool (certautomator.KeyPool) : keys generated ahead of time, used
+                           before generating new keys. Defaults to None.
+            manifest (certautomator.BuildManifest) : records the completed steps, to skip
+                           unchanged users and cas. Defaults to None.
+            metrics (certautomator.Metrics) : records the duration of the steps and
+                           commands. Defaults to None.
+            max_processes (int) : maximum number of openssl processes executed at the
+                           same time by the asynchronous methods. Defaults to 32.
+            serials (certautomator.RandomSerials) : allocates the serial numbers of the
+                           signed certificates. Defaults to random serial numbers.
+            plan (certautomator.Plan) : if set, the openssl commands and backend calls are
+                           recorded in the plan instead of being executed. Defaults to None.
+            journal (certautomator.Journal) : records the completed steps, to resume an
+                           interrupted run. Defaults to None.
+            key_cpus (set) : cpus the openssl processes generating keys are pinned to,
+                           leaving the other cpus to the requests and certificates.
+                           Defaults to None, any cpu.
         """
 
         self._logger = logger
         self._openssl_location = openssl_location
         self._fh = filehandler
+        self._backend = backend
+        self._key_pool = key_pool
+        self._manifest = manifest
+        self._metrics = metrics
+        self._serials = serials if serials is not None else RandomSerials()
+        self._plan = plan
+        self._journal = journal
+        self._key_cpus = key_cpus
+        # -- Content of the password files read, by location. --
+        self._secrets = {}
+        self._lock = threading.Lock()
+        self._serial_locks = {}
+        self._max_processes = max_processes
+        self._async_loop = None
+        self._async_semaphore = None
+        self._async_locks = {}
+
+    @property
+    def openssl_location(self):
+        return self._openssl_location
+
+    @openssl_location.setter
+    def openssl_location(self, location):
+        self._openssl_location = location
+
+    @property
+    def filehandler(self):
+        return self._fh
+
+    @filehandler.setter
+    def filehandler(self, filehandler):
+        self._fh = filehandler
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    @property
+    def plan(self):
+        return self._plan
+
+    @plan.setter
+    def plan(self, plan):
+        self._plan = plan
+
+    @property
+    def journal(self):
+        return self._journal
+
+    @journal.setter
+    def journal(self, journal):
+        self._journal = journal
+
+    @property
+    def key_cpus(self):
+        return self._key_cpus
+
+    @key_cpus.setter
+    def key_cpus(self, key_cpus):
+        self._key_cpus = key_cpus
+
+    @property
+    def serials(self):
+        return self._serials
+
+    @serials.setter
+    def serials(self, serials):
+        self._serials = serials
+
+    @property
+    def key_pool(self):
+        return self._key_pool
+
+    @key_pool.setter
+    def key_pool(self, key_pool):
+        self._key_pool = key_pool
+
+    @property
+    def manifest(self):
+        return self._manifest
+
+    @manifest.setter
+    def manifest(self, manifest):
+        self._manifest = manifest
+
+    @property
+    def metrics(self):
+        return self._metrics
 
-    def generate(self, parameters, data):
+    @metrics.setter
+    def metrics(self, metrics):
+        self._metrics = metrics
+
+    def generate(self, parameters, data, group_key=None):
         """
         Generates keys, requests and signed certificates based
-        on the values in the parameters dictionary.
+        on the values in the parameters dictionary, using up to
+        parameters['jobs'] workers, and parameters['key_jobs'] more for the
+        keys if set, see scheduler.
+
+        Args:
+            parameters (dictionary) : The parsed command line arguments
+            data (dictionary) : Containing the groups of cas and users
+            group_key (str) : name of the group the data belongs to.
+
+        Returns:
+            results (dictionary) : state of each step, by (group, name, step).
+
+        """
+        scheduler = CryptoCommands.scheduler(parameters)
+        self.add_tasks(scheduler, parameters, data, group_key)
+        return scheduler.run()
+
+    async def generate_async(self, parameters, data, group_key=None):
+        """
+        Same as generate, running the steps in the current event loop
+        instead of threads. Up to parameters['jobs'] steps run at a time,
+        and up to max_processes openssl processes.
+
+        Args:
+            parameters (dictionary) : The parsed command line arguments
+            data (dictionary) : Containing the groups of cas and users
+            group_key (str) : name of the group the data belongs to.
+
+        Returns:
+            results (dictionary) : state of each step, by (group, name, step).
+
+        """
+        scheduler = CryptoCommands.scheduler(parameters)
+        self.add_tasks(scheduler, parameters, data, group_key, asynchronous=True)
+        return await scheduler.run_async()
+
+    @staticmethod
+    def scheduler(parameters):
+        """
+        Returns a scheduler running up to parameters['jobs'] steps at a time.
+        With parameters['key_jobs'], the cpu bound keys are generated by that
+        many workers of their own, while the requests and certificates share
+        the jobs workers, and the keys wait while parameters['backlog']
+        requests and certificates are ready, see TaskScheduler.
+
+        Args:
+            parameters (dictionary) : The parsed command line arguments
+
+        Returns:
+            (certautomator.TaskScheduler) : the scheduler.
+        """
+
+        return TaskScheduler(jobs=parameters.get('jobs') or 1,
+                             pools={'key': parameters['key_jobs']} if parameters.get('key_jobs') else None,
+                             backlog=parameters.get('backlog'))
+
+    def add_tasks(self, scheduler, parameters, data, group_key=None, asynchronous=False):
+        """
+        Adds the steps needed to generate the keys, requests and signed
+        certificates of a group to the scheduler. Each step is identified by
+        (group, name, step). A request depends on the key of the same user
+        or ca, a certificate on its request, and the users' certificates on
+        the certificate of the CA signing them. The users are signed through
+        a SigningSession of their CA, loading its key and certificate once.
+        If a manifest is set, the users and cas whose steps all completed with
+        the same values are skipped, unless overwrite is set.
 
         Args:
+            scheduler (certautomator.TaskScheduler) : the task graph to add to.
             parameters (dictionary) : The parsed command line arguments
             data (dictionary) : Containing the groups of cas and users
+            group_key (str) : name of the group the data belongs to.
+            asynchronous (bool) : True if the steps are run by TaskScheduler.run_async.
+
+        """
+        issuers = self.add_ca_tasks(scheduler, parameters, data.get('ca'), group_key, asynchronous)
+        self.add_user_tasks(scheduler, parameters, data.get('users'), group_key, issuers, asynchronous)
+
+    def add_ca_tasks(self, scheduler, parameters, cas, group_key=None, asynchronous=False):
+        """
+        Adds the steps needed to generate the keys, requests and certificates
+        of the cas of a group to the scheduler. Each ca gets a signing
+        session, shared by all the users it signs, see add_user_tasks.
+
+        Args:
+            scheduler (certautomator.TaskScheduler) : the task graph to add to.
+            parameters (dictionary) : The parsed command line arguments
+            cas (dictionary) : the cas of the group, by name.
+            group_key (str) : name of the group the cas belong to.
+            asynchronous (bool) : True if the steps are run by TaskScheduler.run_async.
+
+        Returns:
+            issuers (dictionary) : the certautomator.Issuer of each ca of the group,
+                                   by name, in the order of the config file.
+        """
+
+        issuers = {}
+        generate_key = self.generate_key_async if asynchronous else self.generate_key
+        generate_csr = self.generate_csr_async if asynchronous else self.generate_csr
+        generate_ca_certificate = (self.generate_ca_certificate_async if asynchronous
+                                   else self.generate_ca_certificate)
+        generate_keys = parameters.get('key') or parameters.get('all')
+        generate_requests = parameters.get('req') or parameters.get('all')
+        sign_requests = parameters.get('sign') or parameters.get('all')
+        for ca_key, ca_val in (cas or {}).items():
+            fingerprints = BuildManifest.fingerprints(
+                ca_val, ('ca_key', 'ca_csr', 'ca_crt')) if ca_val is not None else None
+            tasks = self._add_entity_tasks(
+                scheduler,
+                parameters,
+                BuildManifest.entity_id(group_key, 'ca', ca_key),
+                fingerprints,
+                [(generate_keys, (group_key, ca_key, 'ca_key'),
+                  "Generating key for Certificate Authority: %s.",
+                  generate_key, ca_val, (), []),
+                 (generate_requests, (group_key, ca_key, 'ca_csr'),
+                  "Generating certificate request for Certificate Authority: %s.",
+                  generate_csr, ca_val, (), []),
+                 (sign_requests, (group_key, ca_key, 'ca_crt'),
+                  "Generating certificate for Certificate Authority: %s.",
+                  generate_ca_certificate, ca_val, (), [])])
+            issuers[ca_key] = Issuer(ca_val,
+                                     self.open_signing_session(ca_val) if ca_val is not None else None,
+                                     fingerprints.get('ca_crt') if fingerprints is not None else None,
+                                     tasks.get('ca_crt'))
+        return issuers
+
+    def add_user_tasks(self, scheduler, parameters, users, group_key=None, issuers=None,
+                       asynchronous=False):
+        """
+        Adds the steps needed to generate the keys, requests and signed
+        certificates of users to the scheduler. The users can be added in
+        several batches. Each user is signed by the ca named by its ca
+        entry in the config file, by parameters['ca'] if it has none, or
+        else by the last ca of the group. The users are grouped by issuer,
+        so each ca signs its users through a single session, or batch.
+
+        Args:
+            scheduler (certautomator.TaskScheduler) : the task graph to add to.
+            parameters (dictionary) : The parsed command line arguments
+            users (dictionary) : the users, by name.
+            group_key (str) : name of the group the users belong to.
+            issuers (dictionary) : the certautomator.Issuer of each ca of the
+                    group, by name, as returned by add_ca_tasks. The task of
+                    an issuer is the key of the step generating the ca's
+                    certificate in the scheduler, None if it is not in the scheduler.
+            asynchronous (bool) : True if the steps are run by TaskScheduler.run_async.
+        """
+
+        issuers = issuers or {}
+        sign_requests = parameters.get('sign') or parameters.get('all')
+        default = parameters.get('ca') or (list(issuers)[-1] if issuers else None)
+        if sign_requests and parameters.get('ca') and parameters.get('ca') not in issuers:
+            self._logger.warning("CA %s given by --ca is not in group %s.",
+                                 parameters.get('ca'), group_key)
+        by_issuer = {}
+        for user_key, user_val in (users or {}).items():
+            name = (user_val.signing_ca if user_val is not None else None) or default
+            by_issuer.setdefault(name, {})[user_key] = user_val
+        for name, issuer_users in by_issuer.items():
+            issuer = issuers.get(name) if name is not None else None
+            if issuer is None:
+                if sign_requests and name != parameters.get('ca'):
+                    self._logger.warning("CA %s of users %s is not in group %s.",
+                                         name, ', '.join(issuer_users), group_key)
+                issuer = Issuer(None, None, None, None)
+            self._add_issuer_user_tasks(scheduler, parameters, issuer_users, group_key,
+                                        issuer, asynchronous)
+
+    def _add_issuer_user_tasks(self, scheduler, parameters, users, group_key, issuer,
+                               asynchronous):
+        """
+        Adds the steps of users signed by the same issuer, see add_user_tasks.
+        """
+
+        generate_key = self.generate_key_async if asynchronous else self.generate_key
+        generate_csr = self.generate_csr_async if asynchronous else self.generate_csr
+        sign_certificate = self.sign_certificate_async if asynchronous else self.sign_certificate
+        generate_keys = parameters.get('key') or parameters.get('all')
+        generate_requests = parameters.get('req') or parameters.get('all')
+        sign_requests = parameters.get('sign') or parameters.get('all')
+        sign_arguments = (issuer.ca, issuer.session)
+        if (sign_requests and
+                parameters.get('batch_sign') and
+                self._backend is None and
+                issuer.ca is not None and
+                users):
+            # -- The users' certificate steps only return the result of the --
+            # -- batch, which waits for all of their requests.              --
+            batch = SigningBatch(issuer.ca, issuer.session)
+            action = (lambda: self._sign_batch_async(batch)) if asynchronous else (lambda: self._sign_batch(batch))
+            if self._metrics is not None:
+                action = self._measured(action,
+                                        BuildManifest.entity_id(group_key, 'ca', issuer.ca.name),
+                                        'batch_crt',
+                                        None,
+                                        asynchronous)
+            batch.key = scheduler.add_task(
+                (group_key, issuer.ca.name, 'batch_crt', len(scheduler)),
+                action,
+                [issuer.task])
+            generate_csr = batch.watch(generate_csr)
+            sign_certificate = batch
+            sign_arguments = ()
+        for user_key, user_val in (users or {}).items():
+            self._add_entity_tasks(
+                scheduler,
+                parameters,
+                BuildManifest.entity_id(group_key, 'users', user_key),
+                BuildManifest.fingerprints(
+                    user_val, ('key', 'csr', 'crt'), issuer.fingerprint) if user_val is not None else None,
+                [(generate_keys, (group_key, user_key, 'key'),
+                  "Generating key for user: %s.",
+                  generate_key, user_val, (), []),
+                 (generate_requests, (group_key, user_key, 'csr'),
+                  "Generating certificate request for user: %s.",
+                  generate_csr, user_val, (), []),
+                 (sign_requests, (group_key, user_key, 'crt'),
+                  "Generating certificate user: %s.",
+                  sign_certificate, user_val, sign_arguments,
+                  [issuer.task])])
 
+    def _add_entity_tasks(self, scheduler, parameters, entity_id, fingerprints, steps):
+        """
+        Adds the selected steps of a user or ca to the scheduler, each step
+        depending on the previous selected one. Nothing is added if the
+        manifest shows that all the selected steps are up to date.
+        With parameters['reissue_changed'], the steps whose fingerprint
+        changed since they were recorded overwrite their existing file.
+        A fingerprint is only recorded when its step wrote the file, unless
+        parameters['adopt_existing'] and none was recorded for the step, in
+        which case an existing file is taken as generated from the current values.
+        When resuming from the journal, the steps it shows as done are
+        skipped, and a file the interrupted run may not have completed is
+        regenerated, along with the files of the following steps.
+
+        Args:
+            scheduler (certautomator.TaskScheduler) : the task graph to add to.
+            parameters (dictionary) : The parsed command line arguments
+            entity_id (str) : identifier of the user or ca in the manifest.
+            fingerprints (dictionary) : fingerprint of each step of the user or ca,
+                                        None if it is invalid.
+            steps (list) : (selected, task key, message, method, user or ca,
+                           arguments after overwrite, extra dependencies) of
+                           each step, in order.
+
+        Returns:
+            tasks (dictionary) : keys of the added tasks, by step.
+        """
+
+        overwrite = parameters.get('overwrite') is True
+        reissue_changed = parameters.get('reissue_changed') is True
+        adopt_existing = parameters.get('adopt_existing') is True
+        selected = [step for step in steps if step[0]]
+        manifest = self._manifest if fingerprints is not None else None
+        if (manifest is not None and
+                not overwrite and
+                manifest.is_up_to_date(entity_id,
+                                       {key[2]: fingerprints[key[2]] for _, key, *_ in selected})):
+            self._logger.debug("%s is up to date, skipping.", entity_id)
+            return {}
+        journal = self._journal
+        done = [False] * len(selected)
+        if journal is not None and journal.resuming:
+            for i, (_, key, message, method, entity, *_) in enumerate(selected):
+                if not journal.is_done(entity_id, key[2], self._output_file(entity, key[2])):
+                    break
+                done[i] = True
+            if all(done):
+                self._logger.debug("%s was completed by the interrupted run, skipping.", entity_id)
+                return {}
+        tasks = {}
+        previous = None
+        redo = False
+        for i, (_, key, message, method, entity, arguments, dependencies) in enumerate(selected):
+            step = key[2]
+            output = self._output_file(entity, step)
+            if done[i]:
+                self._logger.debug("%s of %s was completed by the interrupted run.", step, entity_id)
+                previous = scheduler.add_task(key, lambda: True, [previous] + dependencies)
+                tasks[step] = previous
+                continue
+            step_overwrite = overwrite
+            if journal is not None and (redo or journal.is_untrusted(output)):
+                self._logger.info("%s of %s may not have been completed by the interrupted run, "
+                                  "regenerating it.", step, entity_id)
+                step_overwrite = True
+                redo = True
+            if (manifest is not None and
+                    reissue_changed and
+                    manifest.is_stale(entity_id, step, fingerprints[step])):
+                self._logger.info("%s changed since its %s was generated, regenerating it.",
+                                  entity_id, step)
+                step_overwrite = True
+            asynchronous = asyncio.iscoroutinefunction(method)
+            if isinstance(method, SigningBatch):
+                method.add(entity, step_overwrite, previous is not None and not done[i - 1])
+                if previous is not None:
+                    scheduler.add_order(previous, method.key)
+                dependencies = dependencies + [method.key]
+                action = self._step(message, key[1], method.result, entity)
+            else:
+                action = self._step(message, key[1], method, entity,
+                                    step_overwrite, *arguments)
+            if manifest is not None:
+                action = self._recorded(action, entity_id, step, fingerprints[step], output,
+                                        adopt_existing, asynchronous)
+            if journal is not None:
+                action = self._journaled(action, entity_id, step, output, asynchronous)
+            if self._metrics is not None:
+                action = self._measured(action, entity_id, step, entity, asynchronous)
+            previous = scheduler.add_task(key, action, [previous] + dependencies)
+            tasks[step] = previous
+        return tasks
+
+    def _step(self, message, name, method, *args):
+        """
+        Wraps a generation step so it can be executed by the scheduler.
+
+        Args:
+            message (str) : logged when the step starts.
+            name (str) : name of the user or ca, as specified in the config file.
+            method (method) : the step to execute.
+            args : arguments passed to the method.
+
+        Returns:
+            method : executes the step, returns its result.
+        """
+
+        def action():
+            self._logger.info(message, name)
+            return method(*args)
+        return action
+
+    def _measured(self, action, entity_id, step, entity, asynchronous=False):
+        """
+        Wraps a step so that its duration, exit code and the number of bytes
+        it wrote are recorded in the metrics. If asynchronous, the step
+        returns a coroutine and so does the wrapper.
+        """
+
+        output = self._output_file(entity, step) if entity is not None else None
+
+        def measure(operation, result, before):
+            operation.succeeded = bool(result)
+            after = self._file_state(output)
+            if after is not None and after != before:
+                operation.bytes_written = after[1]
+            return result
+
+        def measured_action():
+            before = self._file_state(output)
+            with self._metrics.operation(step, entity_id) as operation:
+                return measure(operation, action(), before)
+
+        async def measured_coroutine():
+            before = self._file_state(output)
+            with self._metrics.operation(step, entity_id) as operation:
+                return measure(operation, await action(), before)
+        return measured_coroutine if asynchronous else measured_action
+
+    @staticmethod
+    def _output_file(entity, step):
+        """
+        Returns:
+            (str) : location of the file the step produces for the user or
+                    ca, None if the user or ca is invalid.
+        """
+
+        attribute = {'key': 'key_file',
+                     'csr': 'certificate_signing_request_file',
+                     'crt': 'certificate_file'}.get(step.split('_')[-1])
+        return getattr(entity, attribute, None) if attribute is not None else None
+
+    def _file_state(self, filename):
+        """
+        Returns:
+            (tuple) : modification time, size and inode of the file, None if it doesn't exist.
+        """
+
+        try:
+            stat_result = os.stat(filename)
+            return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+        except (OSError, TypeError):
+            return None
+
+    def _recorded(self, action, entity_id, step, fingerprint, output, adopt_existing=False,
+                  asynchronous=False):
+        """
+        Wraps a step so that the fingerprint is recorded in the manifest when
+        the step wrote its output file. A step that succeeded because the file
+        already existed keeps the fingerprint recorded before, as the file may
+        have been generated from other values, unless adopt_existing and there
+        is none. If asynchronous, the step returns a coroutine and so does the wrapper.
         """
-        ca = data.get('ca')
-        users = data.get('users')
-        selected_ca = None
-        overwrite = parameters.get('overwrite')
-        if ca is not None:
-            for ca_key, ca_val in ca.items():
-                selected_ca = ca_val
-                if parameters.get('key') or parameters.get('all'):
-                    self._logger.info(
-                        "Generating key for Certificate Authority: %s.", ca_key)
-                    self.generate_key(ca_val, overwrite)
-                if parameters.get('req') or parameters.get('all'):
-                    self._logger.info(
-                        "Generating certificate request for Certificate Authority: %s.", ca_key)
-                    self.generate_csr(ca_val, overwrite)
-                if parameters.get('sign') or parameters.get('all'):
-                    self._logger.info(
-                        "Generating certificate for Certificate Authority: %s.", ca_key)
-                    self.generate_ca_certificate(ca_val, overwrite)
-        if users is not None:
-            for user_key, user_val in users.items():
-                if parameters.get('key') or parameters.get('all'):
-                    self._logger.info("Generating key for user: %s.", user_key)
-                    self.generate_key(user_val, overwrite)
-                if parameters.get('req') or parameters.get('all'):
-                    self._logger.info(
-                        "Generating certificate request for user: %s.", user_key)
-                    self.generate_csr(user_val, overwrite)
-                if parameters.get('sign') or parameters.get('all'):
-                    self._logger.info(
-                        "Generating certificate user: %s.", user_key)
-                    self.sign_certificate(
-                        user_val, overwrite, selected_ca)
+
+        def record(result, before):
+            if result:
+                if self._file_state(output) != before:
+                    self._manifest.record(entity_id, step, fingerprint)
+                elif adopt_existing and not self._manifest.is_recorded(entity_id, step):
+                    self._manifest.record(entity_id, step, fingerprint)
+            return result
+
+        def recorded_action():
+            before = self._file_state(output)
+            return record(action(), before)
+
+        async def recorded_coroutine():
+            before = self._file_state(output)
+            return record(await action(), before)
+        return recorded_coroutine if asynchronous else recorded_action
+
+    def _journaled(self, action, entity_id, step, output, asynchronous=False):
+        """
+        Wraps a step so that its success and the file it produced are
+        recorded in the journal. If asynchronous, the step returns a
+        coroutine and so does the wrapper.
+        """
+
+        def record(result):
+            if result:
+                self._journal.record(entity_id, step, output)
+            return result
+
+        def journaled_action():
+            return record(action())
+
+        async def journaled_coroutine():
+            return record(await action())
+        return journaled_coroutine if asynchronous else journaled_action
 
     def generate_key(self, user, overwrite=False):
         """
@@ -83,6 +663,27 @@ class CryptoCommands:
             there was an error generating the key.
 
         """
+
+        result = self._run(self._plan_key(user, overwrite))
+        if result is True:
+            self._fh.mark_written(user.key_file)
+        return result
+
+    async def generate_key_async(self, user, overwrite=False):
+        """
+        Same as generate_key, without blocking the event loop.
+        """
+
+        result = await self._run_async(self._plan_key(user, overwrite))
+        if result is True:
+            self._fh.mark_written(user.key_file)
+        return result
+
+    def _plan_key(self, user, overwrite):
+        """
+        Returns the work needed to generate the key of the user, see _run.
+        """
+
         if user is None:
             self._logger.warning("User is empty.")
             return False
@@ -92,6 +693,17 @@ class CryptoCommands:
                 user.name,
                 user.key_file)
             return True
+        if self._key_pool is not None and user.key_type == 'rsa':
+            pooled_key = self._key_pool.take(user.bits)
+            if pooled_key is not None:
+                return self._plan_import_key(pooled_key, user)
+        if self._backend is not None:
+            password = self._access_password(user) if user.protected else None
+            if password is False:
+                return False
+            return lambda: self._backend.generate_key(user, password)
+        if user.key_type != 'rsa':
+            return self._plan_genpkey(user)
         command = [self._openssl_location, "genrsa"]
         command.append('-out')
         command.append(user.key_file)
@@ -105,7 +717,124 @@ class CryptoCommands:
                 return False
         # -- Bits must be the last parameter in the command --
         command.append(str(user.bits))
-        return self._execute_command(command)
+        return self._atomic(_Command(command, cpus=self._key_cpus), user.key_file)
+
+    def _plan_genpkey(self, user):
+        """
+        Returns the openssl genpkey command generating the ec or ed25519
+        key of the user, see _run.
+        """
+
+        command = [self._openssl_location, "genpkey"]
+        command.append('-out')
+        command.append(user.key_file)
+        if user.key_type == 'ec':
+            command.append('-algorithm')
+            command.append('EC')
+            command.append('-pkeyopt')
+            command.append('ec_paramgen_curve:{0}'.format(user.curve))
+            command.append('-pkeyopt')
+            command.append('ec_param_enc:named_curve')
+        elif user.key_type == 'ed25519':
+            command.append('-algorithm')
+            command.append('ED25519')
+        else:
+            self._logger.warning("Unknown key type %s for %s.", user.key_type, user.name)
+            return False
+        if user.protected:
+            password = self._access_password(user)
+            if password is False:
+                return False
+            command.append('-des3')
+            command.append('-pass')
+            command.append(password)
+        return self._atomic(_Command(command, cpus=self._key_cpus), user.key_file)
+
+    @staticmethod
+    def _digest(digest, signer):
+        """
+        Returns the openssl option selecting the message digest of a
+        signature, none for ed25519 keys, which have their own digest.
+
+        Args:
+            digest (str) : the message_digest, e.g. sha256.
+            signer (certautomator.User) : the user or ca whose key signs.
+
+        Returns:
+            (list) : the option, e.g. ['-sha256'], empty if there is none.
+        """
+
+        if digest is None or signer.key_type == 'ed25519':
+            return []
+        return ['-{0}'.format(digest)]
+
+    def generate_pool_key(self, filename, bits, password):
+        """
+        Generates a key for the key pool, encrypted with the pool's password.
+
+        Args:
+            filename (str) : location of the key.
+            bits (int) : size of the key.
+            password (str) : password of the pool, as an openssl pass phrase argument.
+
+        Returns:
+            True if the key was generated, False otherwise.
+        """
+
+        if self._backend is not None:
+            return self._backend.generate_pool_key(filename, bits, password)
+        return self._execute_command([self._openssl_location,
+                                      "genrsa",
+                                      "-out",
+                                      filename,
+                                      "-aes256",
+                                      "-passout",
+                                      password,
+                                      str(bits)],
+                                     cpus=self._key_cpus)
+
+    def _plan_import_key(self, pooled_key, user):
+        """
+        Returns the work needed to write a key taken from the key pool as the
+        user's key, encrypted with the user's password if the user is
+        protected. The pooled key is deleted once it is done.
+
+        Args:
+            pooled_key (str) : location of the key taken from the pool.
+            user (certautomator.User) : the user the key is for.
+
+        Returns:
+            The work to do, see _run.
+        """
+
+        self._logger.info("Using key from the key pool for %s.", user.name)
+        password = self._access_password(user) if user.protected else None
+        if password is False:
+            os.remove(pooled_key)
+            return False
+        if self._backend is not None:
+            def import_key():
+                try:
+                    return self._backend.import_key(pooled_key,
+                                                    self._key_pool.password,
+                                                    user,
+                                                    password)
+                finally:
+                    os.remove(pooled_key)
+            return import_key
+        command = [self._openssl_location, "pkey"]
+        command.append("-in")
+        command.append(pooled_key)
+        command.append("-passin")
+        command.append(self._key_pool.password)
+        command.append("-out")
+        command.append(user.key_file)
+        if password is not None:
+            command.append("-des3")
+            command.append("-passout")
+            command.append(password)
+        return self._atomic(_Command(command, cleanup=lambda: os.remove(pooled_key)),
+                            user.key_file)
 
     def generate_csr(self, user, overwrite=False):
         """
@@ -125,6 +854,26 @@ class CryptoCommands:
 
         """
 
+        result = self._run(self._plan_csr(user, overwrite))
+        if result is True:
+            self._fh.mark_written(user.certificate_signing_request_file)
+        return result
+
+    async def generate_csr_async(self, user, overwrite=False):
+        """
+        Same as generate_csr, without blocking the event loop.
+        """
+
+        result = await self._run_async(self._plan_csr(user, overwrite))
+        if result is True:
+            self._fh.mark_written(user.certificate_signing_request_file)
+        return result
+
+    def _plan_csr(self, user, overwrite):
+        """
+        Returns the work needed to generate the request of the user, see _run.
+        """
+
         if user is None:
             self._logger.warning("User is empty.")
             return False
@@ -139,6 +888,11 @@ class CryptoCommands:
                 user.name,
                 user.certificate_signing_request_file)
             return True
+        if self._backend is not None:
+            password = self._access_password(user) if user.protected else None
+            if password is False:
+                return False
+            return lambda: self._backend.generate_csr(user, password)
         command = [self._openssl_location, "req", "-new"]
         command.append('-out')
         command.append(user.certificate_signing_request_file)
@@ -146,6 +900,7 @@ class CryptoCommands:
         command.append(user.format_distinguished_names())
         command.append('-key')
         command.append(user.key_file)
+        command.extend(CryptoCommands._digest(user.message_digest, user))
         if user.protected:
             password = self._access_password(user)
             if password is not False:
@@ -153,7 +908,7 @@ class CryptoCommands:
                 command.append(password)
             else:
                 return False
-        return self._execute_command(command)
+        return self._atomic(_Command(command), user.certificate_signing_request_file)
 
     def generate_ca_certificate(self, user, overwrite=False):
         """
@@ -173,6 +928,26 @@ class CryptoCommands:
 
         """
 
+        result = self._run(self._plan_ca_certificate(user, overwrite))
+        if result is True:
+            self._fh.mark_written(user.certificate_file)
+        return result
+
+    async def generate_ca_certificate_async(self, user, overwrite=False):
+        """
+        Same as generate_ca_certificate, without blocking the event loop.
+        """
+
+        result = await self._run_async(self._plan_ca_certificate(user, overwrite))
+        if result is True:
+            self._fh.mark_written(user.certificate_file)
+        return result
+
+    def _plan_ca_certificate(self, user, overwrite):
+        """
+        Returns the work needed to generate the certificate of the CA, see _run.
+        """
+
         if user is None:
             self._logger.warning("CA is None.")
             return False
@@ -188,6 +963,11 @@ class CryptoCommands:
                 user.name,
                 user.certificate_file)
             return True
+        if self._backend is not None:
+            password = self._access_password(user) if user.protected else None
+            if password is False:
+                return False
+            return lambda: self._backend.generate_ca_certificate(user, password)
         command = [self._openssl_location,
                    "req",
                    "-new",
@@ -200,6 +980,7 @@ class CryptoCommands:
         command.append(str(user.certificate_expiration))
         command.append("-out")
         command.append(user.certificate_file)
+        command.extend(CryptoCommands._digest(user.message_digest, user))
         if user.protected:
             password = self._access_password(user)
             if password is not False:
@@ -207,9 +988,9 @@ class CryptoCommands:
                 command.append(password)
             else:
                 return False
-        return self._execute_command(command)
+        return self._atomic(_Command(command), user.certificate_file)
 
-    def sign_certificate(self, user, overwrite=False, ca=None):
+    def sign_certificate(self, user, overwrite=False, ca=None, session=None):
         """
         Generates a certificate for the user.
         Assumes that the user's certificate request file already exists, as
@@ -223,6 +1004,9 @@ class CryptoCommands:
                          False if it should not be overwritten.
             ca (certautomator.CA) : containing the necessary parameters to sign the
                   user's certificate request.
+            session (certautomator.SigningSession) : session of the CA to sign with,
+                  reusing the CA's loaded key and certificate. If None, the CA is
+                  loaded for this signature only.
 
         Returns:
             True if the certificate was generated or if the  overwrite parameter
@@ -232,6 +1016,35 @@ class CryptoCommands:
 
         """
 
+        result = self._check_signature(user, overwrite, ca)
+        if result is not None:
+            return result
+        if session is None:
+            session = self.open_signing_session(ca)
+        return session.sign(user)
+
+    async def sign_certificate_async(self, user, overwrite=False, ca=None, session=None):
+        """
+        Same as sign_certificate, without blocking the event loop. Loading
+        the CA is done once per session, in the loop's default executor.
+        """
+
+        result = self._check_signature(user, overwrite, ca)
+        if result is not None:
+            return result
+        if session is None:
+            session = self.open_signing_session(ca)
+        return await session.sign_async(user)
+
+    def _check_signature(self, user, overwrite, ca):
+        """
+        Checks that the request of the user can be signed by the CA.
+
+        Returns:
+            (bool) : the result of sign_certificate if the request should not
+                     be signed, None if it should.
+        """
+
         if user is None:
             self._logger.warning(
                 "No user specified."
@@ -253,50 +1066,499 @@ class CryptoCommands:
                 user.name,
                 user.certificate_signing_request_file)
             return False
+        return None
+
+    def open_signing_session(self, ca):
+        """
+        Returns a session signing certificate requests with the CA. The CA's
+        key and certificate are loaded when the first request is signed and
+        reused for the following ones.
+
+        Args:
+            ca (certautomator.CA) : the CA signing the requests.
+
+        Returns:
+            certautomator.SigningSession : the session of the CA.
+        """
+
+        return SigningSession(self, ca)
+
+    def _open_signing_context(self, ca):
+        """
+        Checks that the CA's key and certificate exist and loads them.
+        With the openssl binaries, a protected key is decrypted once and kept
+        in memory, it is then given to each openssl process through a pipe.
+
+        Args:
+            ca (certautomator.CA) : the CA signing the requests.
+
+        Returns:
+            The loaded CA, as expected by _sign, None if an error occurred.
+        """
+
         if self._fh.file_exists(ca.certificate_file) is False:
             self._logger.warning(
                 "Certificate Authority's Certificate for %s at location %s does not exist, aborting.",
                 ca.name,
                 ca.certificate_file)
-            return False
+            return None
         if self._fh.file_exists(ca.key_file) is False:
             self._logger.warning(
                 "Certificate Authority's Key for %s at location %s does not exist, aborting.",
                 ca.name,
                 ca.key_file)
+            return None
+        password = self._access_password(ca) if ca.protected else None
+        if password is False:
+            return None
+        if self._backend is not None:
+            if self._plan is not None:
+                # -- Nothing is signed, the CA's key isn't needed. --
+                return _OpenSSLSigningContext(None)
+            return self._backend.open_signing_context(ca, password)
+        if password is None:
+            return _OpenSSLSigningContext(None)
+        key = self._run(_Command([self._openssl_location,
+                                  "pkey",
+                                  "-in",
+                                  ca.key_file,
+                                  "-passin",
+                                  password],
+                                 capture=True))
+        if self._plan is not None:
+            # -- The decryption is only planned, the signatures are planned --
+            # -- with an empty key given through a pipe, as in a run. --
+            return _OpenSSLSigningContext(b'')
+        if key is None:
+            self._logger.warning(
+                "Unable to decrypt Certificate Authority's Key for %s.", ca.name)
+            return None
+        return _OpenSSLSigningContext(key)
+
+    def _sign(self, user, ca, context):
+        """
+        Signs the certificate request of the user with the loaded CA.
+
+        Args:
+            user (certautomator.User) : the user whose request is signed.
+            ca (certautomator.CA) : the CA signing the request.
+            context : the loaded CA returned by _open_signing_context.
+
+        Returns:
+            True if the certificate was generated, False otherwise.
+        """
+
+        result = self._run(self._plan_sign(user, ca, context))
+        if result is True:
+            self._fh.mark_written(user.certificate_file)
+        return result
+
+    async def _sign_async(self, user, ca, context):
+        result = await self._run_async(self._plan_sign(user, ca, context))
+        if result is True:
+            self._fh.mark_written(user.certificate_file)
+        return result
+
+    def _plan_sign(self, user, ca, context):
+        """
+        Returns the work needed to sign the request of the user, see _run.
+        The serial number is allocated up front, so signatures for the same
+        CA don't share any file and may run at the same time.
+        """
+
+        serial = self._serials.next(ca)
+        if serial is None:
+            self._logger.warning(
+                "No serial number available to sign the certificate of %s.", user.name)
             return False
-        command = [self._openssl_location, "x509", "-req", "-CAcreateserial"]
+        if self._backend is not None:
+            return lambda: self._backend.sign_with_context(user, context, serial=serial)
+        command = [self._openssl_location, "x509", "-req"]
+        command.append("-set_serial")
+        command.append("0x{0:X}".format(serial))
         command.append("-in")
         command.append(user.certificate_signing_request_file)
         command.append("-CA")
         command.append(ca.certificate_file)
         command.append("-CAkey")
-        command.append(ca.key_file)
-        if ca.protected:
-            password = self._access_password(ca)
-            if password is not False:
-                command.append('-passin')
-                command.append(password)
-            else:
-                return False
+        pass_fds = ()
+        if context.key is not None:
+            read_fd, write_fd = os.pipe()
+            os.write(write_fd, context.key)
+            os.close(write_fd)
+            pass_fds = (read_fd,)
+            command.append("/dev/fd/{0}".format(read_fd))
+        else:
+            command.append(ca.key_file)
         command.append("-out")
         command.append(user.certificate_file)
         command.append('-days')
         command.append(str(user.certificate_expiration))
-        return self._execute_command(command)
+        command.extend(CryptoCommands._digest(user.message_digest, ca))
+        return self._atomic(_Command(command,
+                                     pass_fds=pass_fds,
+                                     cleanup=lambda: [os.close(fd) for fd in pass_fds]),
+                            user.certificate_file)
+
+    def _sign_batch(self, batch):
+        """
+        Signs the requests of a SigningBatch with as few openssl ca commands
+        as possible, see _plan_batch. If a command fails, the requests it
+        should have signed are signed one at a time.
+
+        Args:
+            batch (certautomator.SigningBatch) : the requests to sign.
+
+        Returns:
+            (bool) : True, the result of each request is kept by the batch.
+        """
+
+        users = self._batch_requests(batch)
+        context = batch.session.load() if users else None
+        for chunk in self._batch_chunks(users):
+            if context is None:
+                result = False
+            else:
+                result = self._run(self._plan_batch(chunk, batch.ca, context))
+            if context is not None and result is not True:
+                self._logger.warning(
+                    "Unable to sign %d requests with %s at once, signing them one at a time.",
+                    len(chunk), batch.ca.name)
+            for user in chunk:
+                batch.set_result(user, result is True or (
+                    context is not None and self._sign(user, batch.ca, context)))
+        return True
+
+    async def _sign_batch_async(self, batch):
+        """
+        Same as _sign_batch, without blocking the event loop.
+        """
+
+        users = self._batch_requests(batch)
+        context = None
+        if users:
+            context = await asyncio.get_event_loop().run_in_executor(None, batch.session.load)
+        for chunk in self._batch_chunks(users):
+            if context is None:
+                result = False
+            else:
+                result = await self._run_async(self._plan_batch(chunk, batch.ca, context))
+            if context is not None and result is not True:
+                self._logger.warning(
+                    "Unable to sign %d requests with %s at once, signing them one at a time.",
+                    len(chunk), batch.ca.name)
+            for user in chunk:
+                batch.set_result(user, result is True or (
+                    context is not None and await self._sign_async(user, batch.ca, context)))
+        return True
+
+    def _batch_requests(self, batch):
+        """
+        Returns the users of the batch whose request must be signed. The
+        result of the others, e.g. whose certificate already exists, is set.
+        """
+
+        users = []
+        for user, overwrite in batch.pending():
+            result = self._check_signature(user, overwrite, batch.ca)
+            if result is None:
+                users.append(user)
+            else:
+                batch.set_result(user, result)
+        return users
+
+    def _batch_chunks(self, users):
+        """
+        Splits the users into lists signed by a single command: the users of
+        a list have the same expiration and digest and are at most
+        BATCH_SIGNING_SIZE.
+        """
+
+        by_days = {}
+        for user in users:
+            by_days.setdefault((user.certificate_expiration, user.message_digest), []).append(user)
+        for same_days in by_days.values():
+            for i in range(0, len(same_days), CryptoCommands.BATCH_SIGNING_SIZE):
+                yield same_days[i:i + CryptoCommands.BATCH_SIGNING_SIZE]
+
+    def _plan_batch(self, users, ca, context):
+        """
+        Returns the openssl ca command signing the requests of the users in
+        one process, see _run. The certificates are read from the output of
+        the command, in the order of the requests, and written to the users'
+        certificate files.
+
+        Args:
+            users (list) : the users whose requests are signed, with the same
+                           expiration and digest.
+            ca (certautomator.CA) : the CA signing the requests.
+            context : the loaded CA returned by _open_signing_context.
+
+        Returns:
+            The work to do.
+        """
+
+        config = self._batch_config(ca)
+        if config is None:
+            return False
+        command = [self._openssl_location, "ca", "-batch", "-notext"]
+        command.append("-config")
+        command.append(config)
+        command.append("-cert")
+        command.append(ca.certificate_file)
+        command.append("-keyfile")
+        pass_fds = ()
+        if context.key is not None:
+            read_fd, write_fd = os.pipe()
+            os.write(write_fd, context.key)
+            os.close(write_fd)
+            pass_fds = (read_fd,)
+            command.append("/dev/fd/{0}".format(read_fd))
+        else:
+            command.append(ca.key_file)
+        command.append("-days")
+        command.append(str(users[0].certificate_expiration))
+        if users[0].message_digest is not None and ca.key_type != 'ed25519':
+            command.append("-md")
+            command.append(users[0].message_digest)
+        # -- -infiles must be the last parameter in the command --
+        command.append("-infiles")
+        command.extend(user.certificate_signing_request_file for user in users)
+
+        # -- openssl ca updates the CA's database, only one command per CA
+        # may run at a time. -out is not used, openssl 3 rewrites it for
+        # each certificate. --
+        return _Command(command,
+                        pass_fds=pass_fds,
+                        lock=ca.certificate_file,
+                        capture=True,
+                        finish=lambda output: self._split_certificates(output, users),
+                        cleanup=lambda: [os.close(fd) for fd in pass_fds])
+
+    def _split_certificates(self, output, users):
+        """
+        Writes the certificates printed by openssl ca, in the order of the
+        requests, to the users' certificate files.
+
+        Args:
+            output (bytes) : output of openssl ca, None if it failed.
+            users (list) : the users whose requests were signed.
+
+        Returns:
+            (bool) : True if every certificate was written, False otherwise.
+        """
+
+        if output is None:
+            return False
+        certificates = re.findall(
+            rb'-----BEGIN CERTIFICATE-----.*?-----END CERTIFICATE-----\n?', output, re.S)
+        if len(certificates) != len(users):
+            self._logger.warning("Expected %d certificates from openssl ca, got %d.",
+                                 len(users), len(certificates))
+            return False
+        for user, certificate in zip(users, certificates):
+            if self._fh.write_bytes(user.certificate_file,
+                                    certificate,
+                                    permissions=0o644) is False:
+                return False
+        return True
+
+    def _batch_config(self, ca):
+        """
+        Returns the openssl ca configuration of the CA: its config_file, set
+        by ca_conf in the configuration file, or a configuration generated in
+        ca_dir/batch/<name>, holding the database of the signed certificates.
+
+        Args:
+            ca (certautomator.CA) : the CA signing the requests.
+
+        Returns:
+            (str) : location of the configuration, None if it could not be created.
+        """
+
+        if getattr(ca, 'config_file', None) is not None:
+            return ca.config_file
+        directory = os.path.join(ca.ca_dir, 'batch', ca.name)
+        config = os.path.join(directory, 'openssl.cnf')
+        database = os.path.join(directory, 'index.txt')
+        if self._plan is not None:
+            return config
+        with self._lock:
+            if self._fh.file_exists(config):
+                return config
+            if self._fh.create_directory(os.path.join(directory, 'certs')) is False:
+                return None
+            if (self._fh.file_exists(database) is False and
+                    self._fh.write_bytes(database, b'') is False):
+                return None
+            content = _BATCH_CONFIG.format(directory=directory)
+            if self._fh.write_bytes(config, content.encode(), permissions=0o644) is False:
+                return None
+        return config
+
+    def _atomic(self, plan, location):
+        """
+        Makes the command of a step write its output to a temporary file,
+        renamed to location once the command succeeded, so that location
+        never holds a partial file. The temporary file is removed if the
+        command fails. Work done in process writes atomically already, see
+        FileHandler.write_bytes.
+
+        Args:
+            plan : the work returned by one of the _plan methods.
+            location (str) : the output of the command.
+
+        Returns:
+            The work to do, see _run.
+        """
+
+        if self._plan is not None or not isinstance(plan, _Command):
+            return plan
+        temporary = self._fh.temporary_name(location)
+        plan.args = [temporary if argument == location else argument for argument in plan.args]
+        finish = plan.finish
+        cleanup = plan.cleanup
+
+        def rename(result):
+            result = finish(result) if finish is not None else result
+            if result is not True:
+                return result
+            return self._fh.replace(temporary, location)
+
+        def remove():
+            if cleanup is not None:
+                cleanup()
+            self._fh.remove(temporary)
+        plan.finish = rename
+        plan.cleanup = remove
+        return plan
+
+    def _run(self, plan):
+        """
+        Does the work returned by one of the _plan methods.
+
+        Args:
+            plan : a bool if there is nothing to do, the result of the step,
+                   a method doing the work in process, or the _Command to execute.
+
+        Returns:
+            (bool) : the result of the step.
+        """
+
+        if self._plan is not None:
+            return self._record_plan(plan)
+        if isinstance(plan, _Command):
+            execute = self._capture_command if plan.capture else self._execute_command
+            try:
+                if plan.lock is None:
+                    result = execute(plan.args, pass_fds=plan.pass_fds, cpus=plan.cpus)
+                else:
+                    with self._serial_lock(plan.lock):
+                        result = execute(plan.args, pass_fds=plan.pass_fds, cpus=plan.cpus)
+                return plan.finish(result) if plan.finish is not None else result
+            finally:
+                if plan.cleanup is not None:
+                    plan.cleanup()
+        if callable(plan):
+            return plan()
+        return plan
+
+    async def _run_async(self, plan):
+        """
+        Same as _run, without blocking the event loop. Commands are executed
+        as asyncio subprocesses, work done in process runs in the loop's
+        default executor.
+        """
+
+        if self._plan is not None:
+            return self._record_plan(plan)
+        if isinstance(plan, _Command):
+            execute = self._capture_command_async if plan.capture else self._execute_command_async
+            try:
+                if plan.lock is None:
+                    result = await execute(plan.args, pass_fds=plan.pass_fds, cpus=plan.cpus)
+                else:
+                    async with self._async_lock(plan.lock):
+                        result = await execute(plan.args, pass_fds=plan.pass_fds, cpus=plan.cpus)
+                return plan.finish(result) if plan.finish is not None else result
+            finally:
+                if plan.cleanup is not None:
+                    plan.cleanup()
+        if callable(plan):
+            return await asyncio.get_event_loop().run_in_executor(None, plan)
+        return plan
+
+    def _record_plan(self, plan):
+        """
+        Records the work of a step in the plan instead of doing it. The step
+        is assumed to succeed, so the steps depending on it are planned too.
+
+        Returns:
+            (bool) : the result of the step, True if there was work to do.
+        """
+
+        if not isinstance(plan, _Command) and not callable(plan):
+            return plan
+        operation = self._metrics.current() if self._metrics is not None else None
+        self._plan.add(operation.step if operation is not None else None,
+                       operation.entity if operation is not None else None,
+                       plan.args if isinstance(plan, _Command) else None)
+        if isinstance(plan, _Command) and plan.cleanup is not None:
+            plan.cleanup()
+        return True
+
+    def _serial_lock(self, key):
+        """
+        Returns the lock serializing the commands that update a shared file,
+        e.g. the database of a CA signing in batches.
+
+        Args:
+            key (str) : location of the CA's certificate.
+
+        Returns:
+            threading.Lock : lock shared by all commands of the CA.
+        """
+
+        with self._lock:
+            return self._serial_locks.setdefault(key, threading.Lock())
+
+    def _async_lock(self, key):
+        """
+        Same as _serial_lock, for the signatures run by the event loop.
+        """
+
+        self._semaphore()
+        with self._lock:
+            return self._async_locks.setdefault(key, asyncio.Lock())
+
+    def _semaphore(self):
+        """
+        Returns the semaphore bounding the number of commands executed at the
+        same time by the event loop, created for the running loop.
+        """
+
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            if self._async_loop is not loop:
+                self._async_loop = loop
+                self._async_semaphore = asyncio.BoundedSemaphore(self._max_processes)
+                self._async_locks = {}
+            return self._async_semaphore
 
     def _access_password(self, user):
         """
         Formats the password, either passphrase or file as specified in the
         configuration file, and returns it.
         Returns False if there is an issue with the passphrase or file not being
-        set or if the file doesn't exist.
+        set or if the file doesn't exist. A password file is read once, see
+        _read_password_file, and its password passed like a passphrase, i.e.
+        through a pipe to the openssl commands, see _pipe_passwords.
 
         Args:
             user (user.User) : User object containing either the passphrase or password file.
 
         Returns:
-            str : Containing the passphrase or file to use, False if an error occurred.
+            str : Containing the passphrase to use, False if an error occurred.
         """
 
         self._logger.info(
@@ -308,7 +1570,12 @@ class CryptoCommands:
             if self._fh.file_exists(user.password_file):
                 self._logger.debug(
                     "Using password file for user %s.", user.name)
-                return 'file:{0}'.format(user.password_file)
+                password = self._read_password_file(user.password_file)
+                if password is None:
+                    self._logger.warning(
+                        "Unable to read password file %s of %s.", user.password_file, user.name)
+                    return False
+                return 'pass:{0}'.format(password)
             else:
                 self._logger.warning(
                     "%s specified password protected key using password " +
@@ -322,13 +1589,161 @@ class CryptoCommands:
                 "password file was specified in configuration file.", user.name)
             return False
 
-    def _execute_command(self, command):
+    def _read_password_file(self, filename):
+        """
+        Returns the password in the file, its first line as with openssl
+        file:. The passwords are kept for the run, so each file is read once
+        however many users, cas and steps share it.
+
+        Args:
+            filename (str) : location of the password file.
+
+        Returns:
+            (str) : the password, None if the file can't be read.
+        """
+
+        with self._lock:
+            password = self._secrets.get(filename)
+        if password is not None:
+            return password
+        content = self._fh.read(filename)
+        if content is None:
+            return None
+        password = content.splitlines()[0] if content else ''
+        with self._lock:
+            self._secrets[filename] = password
+        return password
+
+    def _pipe_passwords(self, command, pass_fds):
+        """
+        Replaces the pass:<password> arguments of the command with fd:<fd>,
+        the read end of a pipe holding the password, so the passwords are
+        not in the arguments of the process, readable by every user of the
+        host in /proc. Each process gets pipes of its own.
+
+        Args:
+            command (list) : the command to execute.
+            pass_fds (tuple) : file descriptors inherited by the process.
+
+        Returns:
+            (tuple) : the command, the file descriptors inherited by the
+                      process and the pipes to close once it is started.
+        """
+
+        command = list(command)
+        pipes = []
+        for i in range(1, len(command)):
+            if command[i - 1] in _PASSWORD_OPTIONS and command[i].startswith('pass:'):
+                read_fd, write_fd = os.pipe()
+                try:
+                    os.write(write_fd, command[i][len('pass:'):].encode() + b'\n')
+                finally:
+                    os.close(write_fd)
+                command[i] = 'fd:{0}'.format(read_fd)
+                pipes.append(read_fd)
+        return command, tuple(pass_fds) + tuple(pipes), pipes
+
+    def _record_command(self, command, duration, return_code):
+        """
+        Records the duration and return code of an executed openssl command,
+        by name of the openssl command, e.g. genrsa, req or x509.
+        """
+
+        if self._metrics is not None:
+            self._metrics.command(command[1] if len(command) > 1 else command[0],
+                                  duration,
+                                  return_code)
+
+    def _pin(self, pid, cpus):
+        """
+        Pins the process to the cpus, once it is started rather than before
+        exec, as forking threads must not run python code in the child.
+        A process that already exited is left alone.
+
+        Args:
+            pid (int) : the process.
+            cpus (set) : the cpus, None to leave the process on any cpu.
+        """
+
+        if not cpus:
+            return
+        try:
+            os.sched_setaffinity(pid, cpus)
+        except (AttributeError, OSError) as e:
+            self._logger.debug("Unable to pin process %d to cpus %s: %s", pid, cpus, e)
+
+    def _capture_command(self, command, pass_fds=(), cpus=None):
+        """
+        Executes the command and returns its output. The output is not
+        logged, as it may contain a decrypted key.
+
+        Args:
+            command (list) : all commands to be executed.
+            pass_fds (tuple) : file descriptors inherited by the process.
+            cpus (set) : cpus the process is pinned to, None for any cpu.
+
+        Returns:
+            (bytes) : the output of the command, None if the return code isn't 0.
+        """
+
+        self._logger.debug("Executing command : [%s]", ','.join(
+            list(map(lambda x: x if "pass:" not in x else "pass:*********", command)))
+        )
+        start = time.perf_counter()
+        args, pass_fds, pipes = self._pipe_passwords(command, pass_fds)
+        try:
+            process = subprocess.Popen(args,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       pass_fds=pass_fds)
+        finally:
+            for fd in pipes:
+                os.close(fd)
+        self._pin(process.pid, cpus)
+        stdout, stderr = process.communicate()
+        self._record_command(command, time.perf_counter() - start, process.returncode)
+        if process.returncode != 0:
+            self._logger.warning(stderr)
+            return None
+        return stdout
+
+    async def _capture_command_async(self, command, pass_fds=(), cpus=None):
+        """
+        Same as _capture_command, executing the command as an asyncio
+        subprocess.
+        """
+
+        async with self._semaphore():
+            self._logger.debug("Executing command : [%s]", ','.join(
+                list(map(lambda x: x if "pass:" not in x else "pass:*********", command)))
+            )
+            start = time.perf_counter()
+            args, pass_fds, pipes = self._pipe_passwords(command, pass_fds)
+            try:
+                process = await asyncio.create_subprocess_exec(*args,
+                                                               stdout=subprocess.PIPE,
+                                                               stderr=subprocess.PIPE,
+                                                               pass_fds=pass_fds)
+            finally:
+                for fd in pipes:
+                    os.close(fd)
+            self._pin(process.pid, cpus)
+            stdout, stderr = await process.communicate()
+            self._record_command(command, time.perf_counter() - start, process.returncode)
+        if process.returncode != 0:
+            self._logger.warning(stderr)
+            return None
+        return stdout
+
+    def _execute_command(self, command, pass_fds=(), cpus=None):
         """
         Passes the parameters in command to the a process that
         executes the command.
 
         Args:
             command (list) : all commands to be executed.
+            pass_fds (tuple) : file descriptors inherited by the process.
+            cpus (set) : cpus the process is pinned to, None for any cpu.
 
         Returns:
             True if the return code is 0,
@@ -339,12 +1754,218 @@ class CryptoCommands:
         self._logger.debug("Executing command : [%s]", ','.join(
             list(map(lambda x: x if "pass:" not in x else "pass:*********", command)))
         )
-        process = subprocess.Popen(command,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT)
+        start = time.perf_counter()
+        args, pass_fds, pipes = self._pipe_passwords(command, pass_fds)
+        try:
+            process = subprocess.Popen(args,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       pass_fds=pass_fds)
+        finally:
+            for fd in pipes:
+                os.close(fd)
+        self._pin(process.pid, cpus)
         stdout, stderr = process.communicate()
         return_code = process.returncode
+        self._record_command(command, time.perf_counter() - start, return_code)
         self._logger.debug(stdout)
         if return_code != 0:
             self._logger.warning(stdout)
         return return_code == 0
+
+    async def _execute_command_async(self, command, pass_fds=(), cpus=None):
+        """
+        Same as _execute_command, executing the command as an asyncio
+        subprocess. At most max_processes commands are executed at a time.
+
+        Args:
+            command (list) : all commands to be executed.
+            pass_fds (tuple) : file descriptors inherited by the process.
+            cpus (set) : cpus the process is pinned to, None for any cpu.
+
+        Returns:
+            True if the return code is 0,
+            False otherwise.
+        """
+
+        async with self._semaphore():
+            self._logger.debug("Executing command : [%s]", ','.join(
+                list(map(lambda x: x if "pass:" not in x else "pass:*********", command)))
+            )
+            start = time.perf_counter()
+            args, pass_fds, pipes = self._pipe_passwords(command, pass_fds)
+            try:
+                process = await asyncio.create_subprocess_exec(*args,
+                                                               stdout=subprocess.PIPE,
+                                                               stderr=subprocess.STDOUT,
+                                                               pass_fds=pass_fds)
+            finally:
+                for fd in pipes:
+                    os.close(fd)
+            self._pin(process.pid, cpus)
+            stdout, stderr = await process.communicate()
+            return_code = process.returncode
+            self._record_command(command, time.perf_counter() - start, return_code)
+        self._logger.debug(stdout)
+        if return_code != 0:
+            self._logger.warning(stdout)
+        return return_code == 0
+
+
+class SigningSession:
+
+    def __init__(self, crypto_commands, ca):
+        """
+        Signs certificate requests with a single CA. The CA is loaded by the
+        first signature and reused by the following ones, a CA that fails to
+        load is not loaded again.
+
+        Args:
+            crypto_commands (certautomator.CryptoCommands) : signs the requests.
+            ca (certautomator.CA) : the CA signing the requests.
+        """
+
+        self._crypto_commands = crypto_commands
+        self._ca = ca
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._context = None
+
+    @property
+    def ca(self):
+        return self._ca
+
+    def sign(self, user):
+        """
+        Signs the certificate request of the user.
+
+        Args:
+            user (certautomator.User) : the user whose request is signed.
+
+        Returns:
+            True if the certificate was generated, False otherwise.
+        """
+
+        self.load()
+        if self._context is None:
+            return False
+        return self._crypto_commands._sign(user, self._ca, self._context)
+
+    async def sign_async(self, user):
+        """
+        Same as sign, without blocking the event loop.
+        """
+
+        if not self._loaded:
+            await asyncio.get_event_loop().run_in_executor(None, self.load)
+        if self._context is None:
+            return False
+        return await self._crypto_commands._sign_async(user, self._ca, self._context)
+
+    def load(self):
+        """
+        Loads the CA, if it isn't loaded yet.
+
+        Returns:
+            The loaded CA, as expected by CryptoCommands._sign, None if it failed to load.
+        """
+
+        with self._lock:
+            if not self._loaded:
+                self._context = self._crypto_commands._open_signing_context(
+                    self._ca)
+                self._loaded = True
+            return self._context
+
+    def close(self):
+        """
+        Releases the loaded CA, the next signature loads it again.
+        """
+
+        with self._lock:
+            self._context = None
+            self._loaded = False
+
+
+class SigningBatch:
+
+    def __init__(self, ca, session):
+        """
+        Requests of users signed together by a CA. Each user is added when
+        its certificate step is added to the scheduler, the batch is then
+        signed once every request step is done, and the users' certificate
+        steps return the result of their request.
+
+        Args:
+            ca (certautomator.CA) : the CA signing the requests.
+            session (certautomator.SigningSession) : the session of the CA.
+        """
+
+        self.ca = ca
+        self.session = session
+        self.key = None
+        self._lock = threading.Lock()
+        self._users = []
+        self._ready = set()
+        self._results = {}
+
+    def add(self, user, overwrite, requires_request):
+        """
+        Args:
+            user (certautomator.User) : the user whose request is signed.
+            overwrite (bool) : True if an existing certificate should be overwritten.
+            requires_request (bool) : True if the user's request is generated
+                                      in the same run, and must succeed first.
+        """
+
+        self._users.append((user, overwrite, requires_request))
+
+    def watch(self, method):
+        """
+        Wraps the method generating a request so that the users whose
+        request was generated are signed.
+
+        Args:
+            method (method) : generates the request, called with (user, overwrite).
+
+        Returns:
+            method : calls method and records its result.
+        """
+
+        if asyncio.iscoroutinefunction(method):
+            async def watched_coroutine(user, overwrite=False):
+                return self._watched(user, await method(user, overwrite))
+            return watched_coroutine
+
+        def watched(user, overwrite=False):
+            return self._watched(user, method(user, overwrite))
+        return watched
+
+    def _watched(self, user, result):
+        if result:
+            with self._lock:
+                self._ready.add(id(user))
+        return result
+
+    def pending(self):
+        """
+        Returns:
+            (list) : (user, overwrite) of the users whose request can be signed.
+        """
+
+        with self._lock:
+            return [(user, overwrite) for user, overwrite, requires_request in self._users
+                    if not requires_request or id(user) in self._ready]
+
+    def set_result(self, user, result):
+        with self._lock:
+            self._results[id(user)] = bool(result)
+
+    def result(self, user):
+        """
+        Returns:
+            (bool) : True if the certificate of the user was generated.
+        """
+
+        with self._lock:
+            return self._results.get(id(user), False)
@@ -0,0 +1,332 @@
+from certautomator.crypto_cmds import CryptoCommands
+from certautomator.crypto_cmds import Issuer
+from certautomator.scheduler import Task
+from certautomator.utils import Config
+from certautomator.utils import FileHandler
+from certautomator.utils_parser import Utils_Parser
+from json.decoder import JSONDecodeError
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+
+class Daemon:
+
+    def __init__(self,
+                 crypto_commands,
+                 config,
+                 parameters,
+                 parser=None,
+                 key_pool=None,
+                 filehandler=FileHandler(),
+                 logger=logging.getLogger('certautomator.daemon')):
+        """
+        Issues certificates on request, keeping the parsed groups, the loaded
+        CAs and the key pool of the process in memory, so an issuance only
+        costs the steps of the user: no interpreter startup, config parsing,
+        directory setup or CA decryption. Requests are JSON lines sent over
+        a UNIX socket, see handle, and are answered with a JSON line each.
+
+        Args:
+            crypto_commands (certautomator.CryptoCommands) : generates the files.
+            config (str) : location of the config file.
+            parameters (dictionary) : The parsed command line arguments, e.g. jobs or ca.
+            parser (certautomator.Utils_Parser) : parses the config file.
+            key_pool (certautomator.KeyPool) : pool to add the sizes of the keys to, if any.
+            filehandler (certautomator.FileHandler) : object responsible for file operations.
+            logger (logging.Logger) : Handles logging features.
+        """
+
+        self._crypto_commands = crypto_commands
+        self._config = config
+        self._parameters = parameters
+        self._parser = parser if parser is not None else Utils_Parser()
+        self._key_pool = key_pool
+        self._fh = filehandler
+        self._logger = logger
+        self._lock = threading.Lock()
+        # -- Content of the config file, groups and issuers, by group. --
+        self._content = {}
+        self._groups = {}
+        self._issuers = {}
+        self._issued = 0
+        self._server = None
+        self._socket = None
+
+    def load(self):
+        """
+        Reads and parses the config file, then generates the missing files of
+        the cas and loads them. The cas loaded before are released. The
+        users are only generated when requested.
+
+        Returns:
+            (bool) : True if the config was loaded, False otherwise.
+        """
+
+        start = time.perf_counter()
+        content = Config().read_config(self._config)
+        if content is None:
+            self._logger.warning("Unable to read the config file %s.", self._config)
+            return False
+        groups = self._parser.parse(content)
+        parameters = dict(self._parameters, all=True, overwrite=False)
+        issuers = {}
+        for group_key, group_value in groups.items():
+            scheduler = CryptoCommands.scheduler(parameters)
+            group_issuers = self._crypto_commands.add_ca_tasks(
+                scheduler, parameters, group_value.get('ca'), group_key)
+            results = scheduler.run()
+            for name, issuer in group_issuers.items():
+                if issuer.task is not None and results.get(issuer.task) != Task.SUCCEEDED:
+                    self._logger.warning(
+                        "Certificate Authority %s of group %s failed, its users will not be signed.",
+                        name, group_key)
+                    issuer = Issuer(None, None, issuer.fingerprint, None)
+                elif issuer.session is not None:
+                    issuer.session.load()
+                group_issuers[name] = issuer._replace(task=None)
+            issuers[group_key] = group_issuers
+        with self._lock:
+            previous = self._issuers
+            self._content = content
+            self._groups = groups
+            self._issuers = issuers
+        for group_issuers in previous.values():
+            for issuer in group_issuers.values():
+                if issuer.session is not None:
+                    issuer.session.close()
+        self._add_bits([user for group_value in groups.values()
+                        for entities in group_value.values()
+                        for user in (entities or {}).values()])
+        self._logger.info("Loaded %d groups from %s in %.3fs.",
+                          len(groups), self._config, time.perf_counter() - start)
+        return True
+
+    def issue(self, group_key, user_key, values=None, overwrite=False):
+        """
+        Generates the key, request and certificate of a user, unless they
+        already exist and overwrite is False.
+
+        Args:
+            group_key (str) : name of the group of the user.
+            user_key (str) : name of the user.
+            values (dictionary) : entries of the user, as in the config file,
+                                  replacing those of the config file, if any.
+            overwrite (bool) : True if the existing files should be overwritten.
+
+        Returns:
+            (dictionary) : the response, see handle.
+        """
+
+        with self._lock:
+            content = self._content.get(group_key)
+            group = self._groups.get(group_key)
+            issuers = self._issuers.get(group_key)
+        if group is None:
+            return {'status': 'error', 'error': 'Unknown group {0}.'.format(group_key)}
+        if values is not None:
+            # -- Only the user is parsed, with the group's defaults, --
+            # -- creating its directories. --
+            user = self._parser.parse_user(content, user_key, values)
+            self._add_bits([user])
+        else:
+            user = group.get('users', {}).get(user_key)
+        if user is None:
+            return {'status': 'error',
+                    'error': 'Unknown or invalid user {0} in group {1}.'.format(user_key, group_key)}
+        start = time.perf_counter()
+        parameters = dict(self._parameters, all=True, overwrite=overwrite is True)
+        scheduler = CryptoCommands.scheduler(parameters)
+        self._crypto_commands.add_user_tasks(scheduler, parameters, {user_key: user}, group_key, issuers)
+        results = scheduler.run()
+        failed = [key[-1] for key, state in results.items() if state != Task.SUCCEEDED]
+        if failed or not self._fh.file_exists(user.certificate_file):
+            return {'status': 'error',
+                    'error': 'Unable to issue the certificate of {0}, failed steps: {1}.'.format(
+                        user_key, ', '.join(failed) or 'crt')}
+        certificate = self._fh.read(user.certificate_file)
+        if certificate is None:
+            return {'status': 'error',
+                    'error': 'Unable to read the certificate of {0}.'.format(user_key)}
+        with self._lock:
+            self._issued += 1
+        return {'status': 'ok',
+                'certificate': certificate,
+                'certificate_file': user.certificate_file,
+                'key_file': user.key_file,
+                'seconds': time.perf_counter() - start}
+
+    def handle(self, request):
+        """
+        Answers a request:
+            {"command": "issue", "group": <name>, "user": <name>,
+             "values": <entries of the user, optional>, "overwrite": <bool, optional>}
+                the certificate, see issue.
+            {"command": "reload"} reads the config file again, see load.
+            {"command": "status"} the number of groups, users and certificates issued.
+            {"command": "stop"} stops the daemon once the requests in progress are answered.
+
+        Args:
+            request (dictionary) : the request.
+
+        Returns:
+            (dictionary) : the response, with status ok or error.
+        """
+
+        command = request.get('command') if isinstance(request, dict) else None
+        if command == 'issue':
+            if not isinstance(request.get('group'), str) or not isinstance(request.get('user'), str):
+                return {'status': 'error', 'error': 'issue requires a group and a user.'}
+            if request.get('values') is not None and not isinstance(request.get('values'), dict):
+                return {'status': 'error', 'error': 'values must be an object.'}
+            return self.issue(request['group'],
+                              request['user'],
+                              request.get('values'),
+                              request.get('overwrite') is True)
+        if command == 'reload':
+            if self.load():
+                return {'status': 'ok'}
+            return {'status': 'error', 'error': 'Unable to load {0}.'.format(self._config)}
+        if command == 'status':
+            with self._lock:
+                return {'status': 'ok',
+                        'groups': len(self._groups),
+                        'users': sum(len(group.get('users', {})) for group in self._groups.values()),
+                        'issued': self._issued}
+        if command == 'stop':
+            threading.Thread(target=self.stop).start()
+            return {'status': 'ok'}
+        return {'status': 'error', 'error': 'Unknown command {0}.'.format(command)}
+
+    def listen(self, socket_path):
+        """
+        Creates the UNIX socket, only accessible by the user running the
+        daemon, replacing a socket left by a daemon that didn't stop.
+
+        Args:
+            socket_path (str) : location of the socket.
+
+        Returns:
+            (bool) : True if the socket was created, False otherwise.
+        """
+
+        try:
+            if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.remove(socket_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self._logger.warning("Unable to replace socket %s: %s", socket_path, e)
+            return False
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(socket_path, self)
+        except OSError as e:
+            self._logger.warning("Unable to listen on %s: %s", socket_path, e)
+            return False
+        finally:
+            os.umask(umask)
+        self._socket = socket_path
+        self._logger.info("Listening on %s.", socket_path)
+        return True
+
+    def serve(self):
+        """
+        Answers the requests until stop is called, each connection in a
+        thread of its own.
+        """
+
+        self._server.serve_forever()
+
+    def stop(self):
+        """
+        Makes serve return. Must not be called from the thread serving.
+        """
+
+        if self._server is not None:
+            self._server.shutdown()
+
+    def close(self):
+        """
+        Removes the socket and releases the loaded cas.
+        """
+
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+            try:
+                os.remove(self._socket)
+            except OSError:
+                pass
+        with self._lock:
+            issuers = self._issuers
+            self._issuers = {}
+        for group_issuers in issuers.values():
+            for issuer in group_issuers.values():
+                if issuer.session is not None:
+                    issuer.session.close()
+
+    @staticmethod
+    def send(socket_path, request, timeout=60.0):
+        """
+        Sends a request to a daemon and returns its response.
+
+        Args:
+            socket_path (str) : location of the daemon's socket.
+            request (dictionary) : the request, see handle.
+            timeout (float) : maximum number of seconds to wait for the response.
+
+        Returns:
+            (dictionary) : the response.
+        """
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_path)
+            with client.makefile('rwb') as stream:
+                stream.write(json.dumps(request).encode() + b'\n')
+                stream.flush()
+                return json.loads(stream.readline().decode())
+
+    def _add_bits(self, users):
+        if self._key_pool is not None:
+            self._key_pool.add_bits([user.bits for user in users
+                                     if user is not None and user.key_type == 'rsa'])
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, daemon):
+        self.certautomator_daemon = daemon
+        socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads JSON requests, one per line, and writes a JSON response line
+    for each, until the client closes the connection.
+    """
+
+    def handle(self):
+        daemon = self.server.certautomator_daemon
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode())
+            except (JSONDecodeError, UnicodeDecodeError):
+                response = {'status': 'error', 'error': 'Invalid JSON request.'}
+            else:
+                try:
+                    response = daemon.handle(request)
+                except Exception as e:
+                    # -- The request isn't logged, its values may hold a password. --
+                    daemon._logger.warning("Request failed: %s", e)
+                    response = {'status': 'error', 'error': str(e)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
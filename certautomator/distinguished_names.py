@@ -1,5 +1,12 @@
 
-class DistinguishedNames:
+class DistinguishedNamesBase:
+    """
+    Properties of the distinguished names. The attributes are declared by
+    the classes using it, see DistinguishedNames, so that User can hold
+    them in __slots__ along with its file properties.
+    """
+
+    __slots__ = ()
 
     def __init__(self,
                  country=None,
@@ -123,3 +130,14 @@ class DistinguishedNames:
             values['emailAddress'] = self.email
         names = '/'+ ''.join("{0}={1}/".format(k, v) for (k, v) in values.items()) if len(values.items()) > 0 else '//'
         return names
+
+
+class DistinguishedNames(DistinguishedNamesBase):
+
+    __slots__ = ('_country',
+                 '_state',
+                 '_locality',
+                 '_organization_name',
+                 '_organizational_unit_name',
+                 '_common_name',
+                 '_email')
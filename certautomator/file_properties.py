@@ -1,5 +1,12 @@
 
-class FileProperties:
+class FilePropertiesBase:
+    """
+    Properties of the key, certificate and request files. The attributes
+    are declared by the classes using it, see FileProperties, so that User
+    can hold them in __slots__ along with its distinguished names.
+    """
+
+    __slots__ = ()
 
     def __init__(self,
                  key_file=None,
@@ -25,3 +32,10 @@ class FileProperties:
         return (isinstance(self._key_file, str) and self._key_file.strip() is not "" and
                 isinstance(self._certificate_file, str) and self._certificate_file.strip() is not "" and
                 isinstance(self.certificate_signing_request_file, str) and self.certificate_signing_request_file.strip() is not "")
+
+
+class FileProperties(FilePropertiesBase):
+
+    __slots__ = ('_key_file',
+                 '_certificate_file',
+                 '_certificate_signing_request_file')
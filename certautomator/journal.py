@@ -0,0 +1,209 @@
+from certautomator.utils import FileHandler
+from json.decoder import JSONDecodeError
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Journal:
+
+    def __init__(self,
+                 filename,
+                 sync_interval=1.0,
+                 filehandler=FileHandler(),
+                 logger=logging.getLogger('certautomator.journal')):
+        """
+        Append-only record of the completed steps: one JSON line per step,
+        with the user or ca, the step, the file it produced and the sha256
+        of that file. Each run adds a started line, and a finished line if
+        it was not interrupted. Lines are written as soon as a step
+        completes, so they survive the process being killed, and synced to
+        disk at most every sync_interval seconds, as a lost line only means
+        that the step is done again.
+
+        A resumed run skips the steps recorded with a file still holding
+        the same content, and regenerates the files written since the
+        interrupted run started that were not recorded, as they may be
+        incomplete, e.g. truncated by a host crash before being synced.
+
+        Args:
+            filename (str) : location of the journal file.
+            sync_interval (float) : maximum number of seconds between syncs.
+            filehandler (certautomator.FileHandler) : object responsible for file operations.
+            logger (logging.Logger) : Handles logging features.
+        """
+
+        self._filename = filename
+        self._sync_interval = sync_interval
+        self._fh = filehandler
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._fd = None
+        self._synced = 0.0
+        # -- (file, sha256) of each recorded step, by (entity, step). --
+        self._steps = {}
+        # -- Start of the oldest interrupted run, None if not resuming. --
+        self._since = None
+
+    @property
+    def resuming(self):
+        return self._since is not None
+
+    @staticmethod
+    def digest(filename):
+        """
+        Returns:
+            (str) : hexadecimal sha256 of the content of the file, None if
+                    it can't be read.
+        """
+
+        try:
+            with open(filename, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except (OSError, TypeError):
+            return None
+
+    def load(self):
+        """
+        Reads the steps recorded by the previous runs and finds when the
+        oldest run that didn't finish started. A line cut short by the
+        interruption is ignored.
+
+        Returns:
+            (bool) : True if the journal was read, False otherwise.
+        """
+
+        self._steps = {}
+        self._since = None
+        if self._fh.file_exists(self._filename) is False:
+            self._logger.info(
+                "No journal found at %s, nothing to resume.", self._filename)
+            return False
+        try:
+            with open(self._filename, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except JSONDecodeError:
+                        self._logger.debug("Ignoring incomplete line in %s.", self._filename)
+                        continue
+                    if 'started' in record:
+                        if self._since is None:
+                            self._since = record['started']
+                    elif 'finished' in record:
+                        self._since = None
+                    elif 'step' in record:
+                        self._steps[(record['entity'], record['step'])] = (record['file'],
+                                                                           record['sha256'])
+        except (OSError, KeyError, TypeError) as e:
+            self._logger.warning(
+                "Unable to read journal %s, ignoring it: %s", self._filename, e)
+            self._steps = {}
+            self._since = None
+            return False
+        self._logger.info("Read %d completed steps from %s.", len(self._steps), self._filename)
+        return True
+
+    def open(self, resume=False):
+        """
+        Opens the journal for this run. Unless resuming, the steps of the
+        previous runs are forgotten and the journal starts over.
+
+        Args:
+            resume (bool) : True to continue the interrupted run, see load.
+
+        Returns:
+            (bool) : True if the journal was opened, False otherwise.
+        """
+
+        started = time.time()
+        if resume and self._since is None:
+            self._since = started
+        if not resume:
+            self._steps = {}
+            self._since = None
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | (0 if resume else os.O_TRUNC)
+        try:
+            self._fd = os.open(self._filename, flags, 0o644)
+        except OSError as e:
+            self._logger.warning("Unable to open journal %s: %s", self._filename, e)
+            return False
+        self._append({'started': started}, sync=True)
+        return True
+
+    def close(self, finished=True):
+        """
+        Closes the journal, marking the run finished unless it was interrupted.
+
+        Args:
+            finished (bool) : True if the run went through all the users and cas.
+        """
+
+        if self._fd is None:
+            return
+        if finished:
+            self._append({'finished': time.time()}, sync=True)
+        with self._lock:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def record(self, entity_id, step, filename):
+        """
+        Records that the step completed and produced filename.
+
+        Args:
+            entity_id (str) : identifier of the user or ca.
+            step (str) : the completed step.
+            filename (str) : the file produced by the step.
+        """
+
+        digest = Journal.digest(filename)
+        if digest is None:
+            return
+        with self._lock:
+            self._steps[(entity_id, step)] = (filename, digest)
+        self._append({'entity': entity_id, 'step': step, 'file': filename, 'sha256': digest})
+
+    def is_done(self, entity_id, step, filename):
+        """
+        Returns:
+            (bool) : True if the step was recorded and filename still holds
+                     what the step produced.
+        """
+
+        with self._lock:
+            recorded = self._steps.get((entity_id, step))
+        return (recorded is not None and
+                recorded[0] == filename and
+                Journal.digest(filename) == recorded[1])
+
+    def is_untrusted(self, filename):
+        """
+        Returns:
+            (bool) : True if resuming and filename was written since the
+                     interrupted run started, without being recorded.
+        """
+
+        if self._since is None:
+            return False
+        try:
+            return os.stat(filename).st_mtime >= self._since
+        except (OSError, TypeError):
+            return False
+
+    def _append(self, record, sync=False):
+        line = (json.dumps(record, sort_keys=True) + '\n').encode()
+        with self._lock:
+            if self._fd is None:
+                return
+            # -- A single write to a file opened for appending, lines of --
+            # -- concurrent steps are not interleaved.                    --
+            os.write(self._fd, line)
+            now = time.monotonic()
+            if sync or now - self._synced >= self._sync_interval:
+                os.fsync(self._fd)
+                self._synced = now
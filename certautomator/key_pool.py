@@ -0,0 +1,250 @@
+from certautomator.utils import FileHandler
+import logging
+import os
+import secrets
+import stat
+import threading
+import uuid
+
+
+class KeyPool:
+
+    def __init__(self,
+                 directory,
+                 generator,
+                 size=10,
+                 jobs=1,
+                 filehandler=FileHandler(),
+                 logger=logging.getLogger('certautomator.keypool')):
+        """
+        Keeps keys generated ahead of time in directory, one sub directory
+        per number of bits. The keys are encrypted with the pool's password,
+        stored in directory/pool.pass and only readable by the user running
+        the script. Keys are written under a temporary name and renamed once
+        complete, and taken by renaming them, so several runs can share a pool.
+
+        Args:
+            directory (str) : location of the pool.
+            generator (method) : generates an encrypted key, called with
+                                 (filename, bits, password), returns True on success.
+            size (int) : number of keys kept for each number of bits.
+            jobs (int) : number of keys generated in the background at the same time.
+            filehandler (certautomator.FileHandler) : object responsible for file operations.
+            logger (logging.Logger) : Handles logging features.
+        """
+
+        self._directory = directory
+        self._generator = generator
+        self._size = size
+        self._jobs = jobs if jobs is not None and jobs > 0 else 1
+        self._fh = filehandler
+        self._logger = logger
+        self._condition = threading.Condition()
+        self._bits = []
+        self._workers = []
+        self._generating = {}
+        self._stopping = False
+        self._password_file = os.path.join(directory, 'pool.pass')
+
+    @property
+    def password(self):
+        """
+        Returns:
+            (str) : the pool's password as an openssl pass phrase argument.
+        """
+        return 'file:{0}'.format(self._password_file)
+
+    def setup(self):
+        """
+        Creates the pool's directory and password if they don't exist yet.
+
+        Returns:
+            (bool) : True if the pool can be used, False otherwise.
+        """
+
+        if self._fh.create_directory(self._directory) is False:
+            return False
+        if self._fh.file_exists(self._password_file):
+            return True
+        self._logger.info("Generating password for key pool %s.", self._directory)
+        return self._fh.write_bytes(self._password_file,
+                                    secrets.token_hex(32).encode(),
+                                    permissions=stat.S_IRUSR | stat.S_IWUSR)
+
+    def available(self, bits):
+        """
+        Args:
+            bits (int) : size of the keys.
+
+        Returns:
+            (int) : number of keys of that size in the pool.
+        """
+
+        return len(self._keys(bits))
+
+    def take(self, bits):
+        """
+        Removes a key of the given size from the pool and returns its location.
+        The key is encrypted with the pool's password, the caller is
+        responsible for deleting it once it has been used.
+
+        Args:
+            bits (int) : size of the key.
+
+        Returns:
+            (str) : location of the key, None if the pool has no key of that size.
+        """
+
+        for key in self._keys(bits):
+            claimed = '{0}.{1}.claimed'.format(key, uuid.uuid4().hex)
+            try:
+                os.rename(key, claimed)
+            except OSError:
+                # -- Taken by another worker or run. --
+                continue
+            self._logger.debug("Took key %s from the pool.", claimed)
+            with self._condition:
+                self._condition.notify_all()
+            return claimed
+        self._logger.info("Key pool has no %s bits key available.", str(bits))
+        return None
+
+    def fill(self, bits):
+        """
+        Generates keys of the given size until the pool holds size keys.
+
+        Args:
+            bits (int) : size of the keys.
+
+        Returns:
+            (bool) : True if the pool is full, False if a key failed to generate.
+        """
+
+        while not self._stopping and self.available(bits) < self._size:
+            if self._generate(bits) is False:
+                return False
+        return True
+
+    def start(self, bits):
+        """
+        Starts refilling the pool in the background for every size in bits.
+        The workers generate a key whenever a size has less than size keys.
+
+        Args:
+            bits (list) : sizes of the keys to keep in the pool.
+        """
+
+        with self._condition:
+            self._bits = sorted(set(b for b in bits if b is not None))
+            self._stopping = False
+        for i in range(self._jobs):
+            worker = threading.Thread(target=self._refill,
+                                      name='keypool-{0}'.format(i),
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def add_bits(self, bits):
+        """
+        Adds sizes of keys to keep in the pool once it is started, for
+        users that were not known when it started.
+
+        Args:
+            bits (list) : sizes of the keys to keep in the pool.
+        """
+
+        with self._condition:
+            added = set(b for b in bits if b is not None) - set(self._bits)
+            if added:
+                self._bits = sorted(set(self._bits) | added)
+                self._condition.notify_all()
+
+    def stop(self, wait_until_full=False):
+        """
+        Stops the background workers once the keys being generated are done.
+
+        Args:
+            wait_until_full (bool) : if True, wait for the workers to fill the
+                                     pool before stopping them.
+        """
+
+        if wait_until_full:
+            with self._condition:
+                while (any(w.is_alive() for w in self._workers) and
+                       self._next_bits() is not None):
+                    self._condition.wait(1)
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _refill(self):
+        """
+        Background worker, generates keys until the pool is stopped.
+        """
+
+        while True:
+            with self._condition:
+                bits = self._next_bits()
+                while bits is None and not self._stopping:
+                    self._condition.wait()
+                    bits = self._next_bits()
+                if self._stopping:
+                    return
+                self._generating[bits] = self._generating.get(bits, 0) + 1
+            try:
+                failed = self._generate(bits) is False
+            finally:
+                with self._condition:
+                    self._generating[bits] -= 1
+                    self._condition.notify_all()
+            if failed:
+                self._logger.warning(
+                    "Unable to refill the key pool with %s bits keys, stopping.", str(bits))
+                return
+
+    def _next_bits(self):
+        """
+        Returns the size with the fewest keys that is below the pool's size,
+        counting the keys being generated. Must hold the condition.
+        """
+
+        missing = [(self.available(b) + self._generating.get(b, 0), b)
+                   for b in self._bits]
+        missing = [m for m in missing if m[0] < self._size]
+        return min(missing)[1] if missing else None
+
+    def _generate(self, bits):
+        """
+        Generates one key of the given size and adds it to the pool.
+
+        Returns:
+            (bool) : True if the key was added, False otherwise.
+        """
+
+        directory = os.path.join(self._directory, str(bits))
+        if self._fh.create_directory(directory) is False:
+            return False
+        key = os.path.join(directory, '{0}.key'.format(uuid.uuid4().hex))
+        temporary = '{0}.tmp'.format(key)
+        if self._generator(temporary, bits, self.password):
+            os.rename(temporary, key)
+            self._logger.debug("Added key %s to the pool.", key)
+            return True
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        return False
+
+    def _keys(self, bits):
+        """
+        Returns the locations of the available keys of the given size.
+        """
+
+        directory = os.path.join(self._directory, str(bits))
+        try:
+            return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+                    if f.endswith('.key')]
+        except OSError:
+            return []
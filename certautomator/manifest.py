@@ -0,0 +1,192 @@
+from certautomator.utils import FileHandler
+from json.decoder import JSONDecodeError
+import hashlib
+import json
+import logging
+import threading
+
+
+class BuildManifest:
+
+    VERSION = 2
+
+    def __init__(self,
+                 filename,
+                 filehandler=FileHandler(),
+                 logger=logging.getLogger('certautomator.manifest')):
+        """
+        Records, for each step of each user and ca, a fingerprint of the
+        parsed values the file was generated from. A rerun can then skip the
+        users and cas whose values did not change without checking their
+        files, and find the files generated from values that changed since.
+
+        Args:
+            filename (str) : location of the manifest file.
+            filehandler (certautomator.FileHandler) : object responsible for file operations.
+            logger (logging.Logger) : Handles logging features.
+        """
+
+        self._filename = filename
+        self._fh = filehandler
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._entities = {}
+
+    @staticmethod
+    def entity_id(group_key, kind, name):
+        """
+        Args:
+            group_key (str) : name of the group.
+            kind (str) : 'ca' or 'users'.
+            name (str) : name of the user or ca, as specified in the config file.
+
+        Returns:
+            (str) : identifier of the user or ca in the manifest.
+        """
+
+        return '{0}/{1}/{2}'.format(group_key, kind, name)
+
+    @staticmethod
+    def fingerprints(entity, steps, issuer=None):
+        """
+        Returns a hash of the values each file of the user or ca is generated
+        from. The key depends on bits, protection, location and, unless rsa,
+        the algorithm and curve, the request on the key, distinguished names,
+        digest and location, and the certificate on the request, days,
+        digest, location and the issuer.
+        A change in a file therefore also changes the files generated from it.
+        Passwords are not part of the fingerprints.
+
+        Args:
+            entity (certautomator.User) : the user or ca.
+            steps (tuple) : names of the key, request and certificate steps.
+            issuer (str) : fingerprint of the certificate of the CA signing
+                           the user, if any.
+
+        Returns:
+            fingerprints (dictionary) : hexadecimal sha256 of the values, by step.
+        """
+
+        key_values = [entity.bits, entity.protected, entity.key_file]
+        # -- Only other algorithms are added, rsa keys keep the fingerprints --
+        # -- recorded before the algorithm was configurable.                 --
+        if entity.key_type != 'rsa':
+            key_values.extend([entity.key_type, entity.curve])
+        key = BuildManifest._hash(key_values)
+        request = BuildManifest._hash([key,
+                                       entity.format_distinguished_names(),
+                                       entity.message_digest,
+                                       entity.certificate_signing_request_file])
+        certificate = BuildManifest._hash([request,
+                                           entity.certificate_expiration,
+                                           entity.message_digest,
+                                           entity.certificate_file,
+                                           issuer])
+        return dict(zip(steps, [key, request, certificate]))
+
+    @staticmethod
+    def _hash(values):
+        return hashlib.sha256(json.dumps(values).encode()).hexdigest()
+
+    def load(self):
+        """
+        Reads the manifest file. A missing or unreadable manifest is
+        treated as empty, i.e. every user and ca is generated.
+
+        Returns:
+            (bool) : True if the manifest was read, False otherwise.
+        """
+
+        self._entities = {}
+        if self._fh.file_exists(self._filename) is False:
+            self._logger.info(
+                "No manifest found at %s, all users will be checked.", self._filename)
+            return False
+        try:
+            content = json.loads(self._fh.read(self._filename))
+            if content.get('version') != BuildManifest.VERSION:
+                self._logger.warning(
+                    "Manifest %s has an unknown version, ignoring it.", self._filename)
+                return False
+            self._entities = content.get('entities', {})
+            return True
+        except (TypeError, AttributeError, JSONDecodeError) as e:
+            self._logger.warning(
+                "Unable to read manifest %s, ignoring it: %s", self._filename, e)
+        return False
+
+    def save(self):
+        """
+        Writes the manifest file. The manifest is written to a temporary file
+        first, so an interrupted write never leaves a truncated manifest.
+
+        Returns:
+            (bool) : True if the manifest was written, False otherwise.
+        """
+
+        with self._lock:
+            content = json.dumps({'version': BuildManifest.VERSION,
+                                  'entities': self._entities},
+                                 sort_keys=True)
+        if self._fh.write_bytes(self._filename, content.encode()) is False:
+            return False
+        self._logger.info("Saved manifest to %s.", self._filename)
+        return True
+
+    def is_up_to_date(self, entity_id, fingerprints):
+        """
+        Args:
+            entity_id (str) : identifier of the user or ca.
+            fingerprints (dictionary) : current fingerprint of each step that
+                                        should be done.
+
+        Returns:
+            (bool) : True if every step completed with the same fingerprint.
+        """
+
+        with self._lock:
+            steps = self._entities.get(entity_id, {})
+            return all(steps.get(step) == fingerprint
+                       for step, fingerprint in fingerprints.items())
+
+    def is_stale(self, entity_id, step, fingerprint):
+        """
+        Args:
+            entity_id (str) : identifier of the user or ca.
+            step (str) : the step to check.
+            fingerprint (str) : current fingerprint of the step.
+
+        Returns:
+            (bool) : True if the step completed with a different fingerprint,
+                     False if it completed with the same one or was never recorded.
+        """
+
+        with self._lock:
+            recorded = self._entities.get(entity_id, {}).get(step)
+            return recorded is not None and recorded != fingerprint
+
+    def is_recorded(self, entity_id, step):
+        """
+        Args:
+            entity_id (str) : identifier of the user or ca.
+            step (str) : the step to check.
+
+        Returns:
+            (bool) : True if a fingerprint was recorded for the step.
+        """
+
+        with self._lock:
+            return self._entities.get(entity_id, {}).get(step) is not None
+
+    def record(self, entity_id, step, fingerprint):
+        """
+        Records that the step completed for the user or ca.
+
+        Args:
+            entity_id (str) : identifier of the user or ca.
+            step (str) : the completed step.
+            fingerprint (str) : fingerprint the step completed with.
+        """
+
+        with self._lock:
+            self._entities.setdefault(entity_id, {})[step] = fingerprint
@@ -0,0 +1,365 @@
+from certautomator.utils import FileHandler
+import heapq
+import json
+import logging
+import threading
+import time
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+
+class Histogram:
+
+    # -- Upper bounds of the buckets, in seconds. --
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        """
+        Aggregated durations of one step or command. Only the aggregates
+        are kept, so memory does not grow with the number of operations.
+        """
+
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.buckets = [0] * len(Histogram.BUCKETS)
+
+    def observe(self, duration):
+        self.count += 1
+        self.total += duration
+        self.minimum = duration if self.minimum is None else min(self.minimum, duration)
+        self.maximum = duration if self.maximum is None else max(self.maximum, duration)
+        for i, bound in enumerate(Histogram.BUCKETS):
+            if duration <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        """
+        Estimates a quantile from the buckets, as the upper bound of the
+        bucket holding it, capped by the maximum.
+
+        Args:
+            q (float) : the quantile, between 0 and 1.
+
+        Returns:
+            (float) : the estimated duration, None if nothing was observed.
+        """
+
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(Histogram.BUCKETS, self.buckets):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        return {'count': self.count,
+                'total_seconds': self.total,
+                'mean_seconds': self.total / self.count if self.count else None,
+                'min_seconds': self.minimum,
+                'max_seconds': self.maximum,
+                'p50_seconds': self.quantile(0.5),
+                'p90_seconds': self.quantile(0.9),
+                'p99_seconds': self.quantile(0.99),
+                'buckets': dict(zip([str(b) for b in Histogram.BUCKETS], self.buckets))}
+
+
+class Operation:
+
+    def __init__(self, step, entity):
+        """
+        A key, request or certificate being generated. The commands executed
+        for it set its exit code, the step sets whether it succeeded and how
+        many bytes it wrote.
+
+        Args:
+            step (str) : name of the step.
+            entity (str) : identifier of the user or ca.
+        """
+
+        self.step = step
+        self.entity = entity
+        self.exit_code = None
+        self.succeeded = False
+        self.bytes_written = 0
+        self.duration = None
+
+
+class Metrics:
+
+    def __init__(self,
+                 slowest=10,
+                 filehandler=FileHandler(),
+                 logger=logging.getLogger('certautomator.metrics')):
+        """
+        Records the duration, exit code, bytes written and entity of each
+        key, request and certificate step, the duration and exit code of each
+        openssl command, and the time spent in other stages such as reading
+        the config. Steps and commands are aggregated in histograms, only the
+        slowest operations of each step are kept with their entity.
+
+        Args:
+            slowest (int) : number of slowest operations kept for each step.
+            filehandler (certautomator.FileHandler) : object responsible for file operations.
+            logger (logging.Logger) : Handles logging features.
+        """
+
+        self._slowest_count = slowest
+        self._fh = filehandler
+        self._logger = logger
+        self._lock = threading.Lock()
+        # -- Operation of the running step, per thread and per asyncio task. --
+        self._current = (contextvars.ContextVar('certautomator_operation', default=None)
+                         if contextvars is not None else _ThreadLocalVariable())
+        self._steps = {}
+        self._commands = {}
+        self._stages = {}
+        self._slowest = {}
+
+    def operation(self, step, entity):
+        """
+        Returns a context manager measuring one step. Commands executed by
+        the same thread, or asyncio task, while it is open are attributed
+        to the operation.
+
+        Args:
+            step (str) : name of the step.
+            entity (str) : identifier of the user or ca.
+
+        Returns:
+            context manager : yields the certautomator.Operation being measured.
+        """
+
+        return _OperationContext(self, Operation(step, entity))
+
+    def current(self):
+        """
+        Returns:
+            (certautomator.Operation) : the operation measured by the calling
+                                        thread, or asyncio task, None if there is none.
+        """
+
+        return self._current.get()
+
+    def command(self, name, duration, exit_code):
+        """
+        Records an executed command and sets the exit code of the operation
+        executing it, if any.
+
+        Args:
+            name (str) : name of the command, e.g. genrsa, req or x509.
+            duration (float) : duration of the command, in seconds.
+            exit_code (int) : exit code of the command.
+        """
+
+        operation = self._current.get()
+        if operation is not None and (operation.exit_code is None or exit_code != 0):
+            operation.exit_code = exit_code
+        with self._lock:
+            histogram, exit_codes = self._commands.setdefault(name, (Histogram(), {}))
+            histogram.observe(duration)
+            exit_codes[exit_code] = exit_codes.get(exit_code, 0) + 1
+
+    def stage(self, name, duration):
+        """
+        Adds duration to the time spent in a stage that isn't a step.
+
+        Args:
+            name (str) : name of the stage.
+            duration (float) : duration to add, in seconds.
+        """
+
+        with self._lock:
+            self._stages[name] = self._stages.get(name, 0.0) + duration
+
+    def _complete(self, operation):
+        self._logger.debug("%s of %s took %.3fs, exit code %s, wrote %d bytes.",
+                           operation.step,
+                           operation.entity,
+                           operation.duration,
+                           operation.exit_code,
+                           operation.bytes_written)
+        with self._lock:
+            step = self._steps.setdefault(operation.step, {'histogram': Histogram(),
+                                                           'failed': 0,
+                                                           'bytes_written': 0,
+                                                           'exit_codes': {}})
+            step['histogram'].observe(operation.duration)
+            step['failed'] += 0 if operation.succeeded else 1
+            step['bytes_written'] += operation.bytes_written
+            if operation.exit_code is not None:
+                step['exit_codes'][operation.exit_code] = step['exit_codes'].get(
+                    operation.exit_code, 0) + 1
+            slowest = self._slowest.setdefault(operation.step, [])
+            entry = (operation.duration, operation.entity, operation.exit_code)
+            if len(slowest) < self._slowest_count:
+                heapq.heappush(slowest, entry)
+            elif self._slowest_count > 0 and entry > slowest[0]:
+                heapq.heapreplace(slowest, entry)
+
+    def summary(self):
+        """
+        Returns:
+            (dictionary) : the recorded steps, commands and stages.
+        """
+
+        with self._lock:
+            return {
+                'steps': {name: dict(step['histogram'].to_dict(),
+                                     failed=step['failed'],
+                                     bytes_written=step['bytes_written'],
+                                     exit_codes={str(c): n for c, n in step['exit_codes'].items()},
+                                     slowest=[{'entity': entity,
+                                               'seconds': duration,
+                                               'exit_code': exit_code}
+                                              for duration, entity, exit_code
+                                              in sorted(self._slowest.get(name, []), reverse=True)])
+                          for name, step in self._steps.items()},
+                'commands': {name: dict(histogram.to_dict(),
+                                        exit_codes={str(c): n for c, n in exit_codes.items()})
+                             for name, (histogram, exit_codes) in self._commands.items()},
+                'stages': dict(self._stages)}
+
+    def log_summary(self):
+        """
+        Logs the number, failures and durations of each step and command.
+        """
+
+        summary = self.summary()
+        for kind in ('steps', 'commands'):
+            for name, values in sorted(summary[kind].items()):
+                self._logger.info(
+                    "%s %s: %d executed, %s failed, total %.3fs, mean %.3fs, p90 <= %.3fs, max %.3fs.",
+                    kind[:-1].capitalize(),
+                    name,
+                    values['count'],
+                    values.get('failed', sum(n for c, n in values['exit_codes'].items() if c != '0')),
+                    values['total_seconds'],
+                    values['mean_seconds'],
+                    values['p90_seconds'],
+                    values['max_seconds'])
+        for name, duration in sorted(summary['stages'].items()):
+            self._logger.info("Stage %s: total %.3fs.", name, duration)
+
+    def write(self, filename):
+        """
+        Writes the metrics to filename, in the Prometheus text format if it
+        ends with .prom, as JSON otherwise.
+
+        Args:
+            filename (str) : location of the metrics file.
+
+        Returns:
+            (bool) : True if the metrics were written, False otherwise.
+        """
+
+        if filename.endswith('.prom'):
+            content = self.prometheus()
+        else:
+            content = json.dumps(self.summary(), indent=2, sort_keys=True)
+        self._logger.info("Writing metrics to %s.", filename)
+        return self._fh.write_bytes(filename, content.encode(), permissions=0o644)
+
+    def prometheus(self):
+        """
+        Returns:
+            (str) : the metrics in the Prometheus text exposition format.
+        """
+
+        summary = self.summary()
+        lines = []
+        self._prometheus_histograms(lines,
+                                    'certautomator_step_duration_seconds',
+                                    'Duration of the key, request and certificate steps.',
+                                    'step',
+                                    summary['steps'])
+        lines.append('# HELP certautomator_step_failures_total Steps that failed.')
+        lines.append('# TYPE certautomator_step_failures_total counter')
+        for name, values in sorted(summary['steps'].items()):
+            lines.append('certautomator_step_failures_total{{step="{0}"}} {1}'.format(
+                name, values['failed']))
+        lines.append('# HELP certautomator_step_bytes_written_total Bytes written by the steps.')
+        lines.append('# TYPE certautomator_step_bytes_written_total counter')
+        for name, values in sorted(summary['steps'].items()):
+            lines.append('certautomator_step_bytes_written_total{{step="{0}"}} {1}'.format(
+                name, values['bytes_written']))
+        self._prometheus_histograms(lines,
+                                    'certautomator_command_duration_seconds',
+                                    'Duration of the openssl commands.',
+                                    'command',
+                                    summary['commands'])
+        lines.append('# HELP certautomator_command_exit_codes_total Exit codes of the openssl commands.')
+        lines.append('# TYPE certautomator_command_exit_codes_total counter')
+        for name, values in sorted(summary['commands'].items()):
+            for code, count in sorted(values['exit_codes'].items()):
+                lines.append('certautomator_command_exit_codes_total{{command="{0}",code="{1}"}} {2}'.format(
+                    name, code, count))
+        lines.append('# HELP certautomator_stage_seconds_total Time spent in the other stages.')
+        lines.append('# TYPE certautomator_stage_seconds_total counter')
+        for name, duration in sorted(summary['stages'].items()):
+            lines.append('certautomator_stage_seconds_total{{stage="{0}"}} {1}'.format(
+                name, duration))
+        return '\n'.join(lines) + '\n'
+
+    def _prometheus_histograms(self, lines, metric, description, label, histograms):
+        lines.append('# HELP {0} {1}'.format(metric, description))
+        lines.append('# TYPE {0} histogram'.format(metric))
+        for name, values in sorted(histograms.items()):
+            cumulative = 0
+            for bound in Histogram.BUCKETS:
+                cumulative += values['buckets'][str(bound)]
+                lines.append('{0}_bucket{{{1}="{2}",le="{3}"}} {4}'.format(
+                    metric, label, name, bound, cumulative))
+            lines.append('{0}_bucket{{{1}="{2}",le="+Inf"}} {3}'.format(
+                metric, label, name, values['count']))
+            lines.append('{0}_sum{{{1}="{2}"}} {3}'.format(
+                metric, label, name, values['total_seconds']))
+            lines.append('{0}_count{{{1}="{2}"}} {3}'.format(
+                metric, label, name, values['count']))
+
+
+class _OperationContext:
+
+    def __init__(self, metrics, operation):
+        self._metrics = metrics
+        self._operation = operation
+        self._start = None
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = self._metrics._current.get()
+        self._metrics._current.set(self._operation)
+        self._start = time.perf_counter()
+        return self._operation
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._operation.duration = time.perf_counter() - self._start
+        self._metrics._current.set(self._previous)
+        if exc_type is not None:
+            self._operation.succeeded = False
+        self._metrics._complete(self._operation)
+        return False
+
+
+class _ThreadLocalVariable:
+    """
+    Per thread variable, used when contextvars is not available.
+    Operations of asyncio tasks are then not told apart.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self):
+        return getattr(self._local, 'value', None)
+
+    def set(self, value):
+        self._local.value = value
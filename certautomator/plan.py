@@ -0,0 +1,124 @@
+from certautomator.utils import FileHandler
+import json
+import logging
+import threading
+
+
+class Plan:
+
+    def __init__(self,
+                 filehandler=FileHandler(),
+                 logger=logging.getLogger('certautomator.plan')):
+        """
+        Records the operations CryptoCommands would perform instead of
+        performing them, see CryptoCommands.plan. Each operation is the step
+        and entity it belongs to and the openssl command it would execute,
+        None if it would be done in process by the backend.
+
+        Args:
+            filehandler (certautomator.FileHandler) : object responsible for file operations.
+            logger (logging.Logger) : Handles logging features.
+        """
+
+        self._fh = filehandler
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._operations = []
+
+    @property
+    def operations(self):
+        """
+        Returns:
+            (list) : (step, entity, command) of each planned operation, in order.
+        """
+
+        with self._lock:
+            return list(self._operations)
+
+    def add(self, step, entity, command):
+        """
+        Args:
+            step (str) : name of the step, None if unknown.
+            entity (str) : identifier of the user or ca, None if unknown.
+            command (list) : the openssl command, None if done in process.
+        """
+
+        if command is not None:
+            command = [argument if "pass:" not in argument else "pass:*********"
+                       for argument in command]
+        with self._lock:
+            self._operations.append((step, entity, command))
+
+    def estimate(self, timings=None, jobs=1):
+        """
+        Counts the planned operations of each step and estimates how long
+        they would take from the mean duration of the steps in timings.
+
+        Args:
+            timings (dictionary) : metrics of a previous run, as written by
+                                   Metrics.write in JSON.
+            jobs (int) : number of steps executed in parallel.
+
+        Returns:
+            (dictionary) : count and estimated seconds of each step, the
+                           estimated total and the estimated duration with
+                           jobs, None when a step has no timing.
+        """
+
+        steps = {}
+        for step, entity, command in self.operations:
+            steps.setdefault(step or 'unknown', {'count': 0, 'seconds': None})['count'] += 1
+        recorded = (timings or {}).get('steps', {})
+        for name, step in steps.items():
+            mean = recorded.get(name, {}).get('mean_seconds')
+            if mean is not None:
+                step['seconds'] = mean * step['count']
+        total = None
+        if all(step['seconds'] is not None for step in steps.values()):
+            total = sum(step['seconds'] for step in steps.values())
+        return {'steps': steps,
+                'operations': sum(step['count'] for step in steps.values()),
+                'total_seconds': total,
+                'wall_seconds': total / max(jobs or 1, 1) if total is not None else None}
+
+    def report(self, timings=None, jobs=1):
+        """
+        Returns:
+            (str) : the planned operations followed by the estimate, one line each.
+        """
+
+        lines = []
+        for step, entity, command in self.operations:
+            lines.append('{0} {1}: {2}'.format(step, entity,
+                                               ' '.join(command) if command is not None
+                                               else '(in process)'))
+        estimate = self.estimate(timings, jobs)
+        for name, step in sorted(estimate['steps'].items()):
+            lines.append('{0}: {1} operations, estimated {2}.'.format(
+                name, step['count'], Plan._seconds(step['seconds'])))
+        lines.append('Total: {0} operations, estimated {1}, {2} with {3} jobs.'.format(
+            estimate['operations'],
+            Plan._seconds(estimate['total_seconds']),
+            Plan._seconds(estimate['wall_seconds']),
+            jobs))
+        return '\n'.join(lines)
+
+    def write(self, filename, timings=None, jobs=1):
+        """
+        Writes the planned operations and the estimate to filename as JSON.
+
+        Returns:
+            (bool) : True if the plan was written, False otherwise.
+        """
+
+        content = json.dumps({'operations': [{'step': step, 'entity': entity, 'command': command}
+                                             for step, entity, command in self.operations],
+                              'estimate': self.estimate(timings, jobs)},
+                             indent=2,
+                             sort_keys=True)
+        self._logger.info("Writing plan to %s.", filename)
+        return self._fh.write_bytes(filename, content.encode(), permissions=0o644)
+
+    @staticmethod
+    def _seconds(seconds):
+        return '{0:.1f}s'.format(seconds) if seconds is not None else 'unknown (no timing)'
@@ -0,0 +1,350 @@
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import asyncio
+import heapq
+import logging
+
+
+class Task:
+
+    PENDING = 'pending'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, key, action, dependencies, index):
+        """
+        Args:
+            key (tuple) : unique identifier of the task, (entity, step).
+            action (method) : executes the task, returns True on success.
+            dependencies (list) : keys of the tasks that must succeed
+                                  before this task can be executed.
+            index (int) : order in which the task was added, ready tasks
+                          are executed in that order.
+        """
+
+        self.key = key
+        self.action = action
+        self.dependencies = dependencies
+        self.dependents = []
+        # -- Tasks that must be done, whatever their result, before this one. --
+        self.predecessors = []
+        self.followers = []
+        self.index = index
+        self.state = Task.PENDING
+
+
+class TaskScheduler:
+
+    def __init__(self,
+                 jobs=1,
+                 pools=None,
+                 backlog=None,
+                 logger=logging.getLogger('certautomator.scheduler')):
+        """
+        Tasks of the steps given in pools run on workers of their own, e.g.
+        the cpu bound key generation, the other tasks share jobs workers.
+        The tasks of the pools are started only while fewer than backlog
+        tasks are ready and waiting for one of the shared workers, so the
+        steps of the pools don't run ahead of the steps depending on them.
+
+        Args:
+            jobs (int) : maximum number of tasks executed at the same time,
+                         outside of the pools.
+            pools (dictionary) : number of workers of the steps run on their
+                                 own, by step, i.e. last item of the task keys.
+            backlog (int) : maximum number of ready shared tasks for the tasks
+                            of the pools to start, defaults to twice jobs.
+            logger (logging.Logger) : Handles logging features.
+        """
+
+        self._jobs = jobs if jobs is not None and jobs > 0 else 1
+        self._pools = dict((step, max(1, workers)) for step, workers in (pools or {}).items())
+        self._backlog = backlog if backlog is not None and backlog > 0 else 2 * self._jobs
+        self._logger = logger
+        self._tasks = {}
+
+    def add_task(self, key, action, dependencies=None):
+        """
+        Adds a task to the graph. Dependencies must have been added
+        before the task depending on them, keys that are None are ignored.
+
+        Args:
+            key (tuple) : unique identifier of the task, (entity, step).
+            action (method) : executes the task, returns True on success.
+            dependencies (list) : keys of the tasks that must succeed first.
+
+        Returns:
+            key (tuple) : the key of the added task.
+
+        """
+
+        if key in self._tasks:
+            raise Exception('Task {0} was already added.'.format(key))
+        dependencies = [d for d in dependencies or [] if d is not None]
+        for dependency in dependencies:
+            if dependency not in self._tasks:
+                raise Exception('Task {0} depends on unknown task {1}.'.format(
+                    key, dependency))
+        task = Task(key, action, dependencies, len(self._tasks))
+        for dependency in dependencies:
+            self._tasks[dependency].dependents.append(task)
+        self._tasks[key] = task
+        return key
+
+    def add_order(self, before, after):
+        """
+        Makes the task after wait for the task before to be done, whether
+        it succeeds, fails or is skipped. Unlike a dependency, the task after
+        is not skipped if the task before fails.
+
+        Args:
+            before (tuple) : key of the task to wait for.
+            after (tuple) : key of the waiting task.
+        """
+
+        for key in (before, after):
+            if key not in self._tasks:
+                raise Exception('Unknown task {0}.'.format(key))
+        if self._reaches(before, after):
+            raise Exception('Task {0} cannot wait for {1}, {1} waits for it.'.format(
+                after, before))
+        self._tasks[after].predecessors.append(before)
+        self._tasks[before].followers.append(self._tasks[after])
+
+    def _reaches(self, start, target):
+        """
+        Returns True if the task start waits, directly or not, for target.
+        """
+
+        pending = [start]
+        seen = set()
+        while pending:
+            key = pending.pop()
+            if key == target:
+                return True
+            if key not in seen:
+                seen.add(key)
+                task = self._tasks[key]
+                pending.extend(task.dependencies)
+                pending.extend(task.predecessors)
+        return False
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def run(self):
+        """
+        Executes every task once all of its dependencies have succeeded.
+        When a task fails, every task depending on it, directly or not,
+        is skipped. Ready tasks are started in the order they were added,
+        so with a single job the tasks run in the order of the graph.
+        The scheduler is emptied once all the tasks are done.
+
+        Returns:
+            results (dictionary) : state of each task, by key.
+
+        """
+
+        tasks = self._tasks
+        self._tasks = {}
+        waiting = {key: len(task.dependencies) + len(task.predecessors)
+                   for key, task in tasks.items()}
+        ready = self._ready(tasks, waiting)
+        if self._jobs == 1 and not self._pools:
+            while ready[None]:
+                task = tasks[heapq.heappop(ready[None])[1]]
+                self._complete(task, self._execute(task), waiting, ready)
+        else:
+            with ThreadPoolExecutor(max_workers=self._jobs + sum(self._pools.values())) as executor:
+                running = {}
+                while running or any(ready.values()):
+                    for task in self._startable(tasks, ready, running):
+                        running[executor.submit(self._execute, task)] = task
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._complete(running.pop(future),
+                                       future.result(),
+                                       waiting,
+                                       ready)
+        results = {key: task.state for key, task in tasks.items()}
+        self._logger.info("Executed %d tasks, %d failed, %d skipped.",
+                          len(results),
+                          list(results.values()).count(Task.FAILED),
+                          list(results.values()).count(Task.SKIPPED))
+        return results
+
+    async def run_async(self):
+        """
+        Same as run, in the current event loop. The actions may return
+        coroutines, which are awaited, up to jobs at the same time.
+
+        Returns:
+            results (dictionary) : state of each task, by key.
+
+        """
+
+        tasks = self._tasks
+        self._tasks = {}
+        waiting = {key: len(task.dependencies) + len(task.predecessors)
+                   for key, task in tasks.items()}
+        ready = self._ready(tasks, waiting)
+        running = {}
+        while running or any(ready.values()):
+            for task in self._startable(tasks, ready, running):
+                running[asyncio.ensure_future(self._execute_async(task))] = task
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                self._complete(running.pop(future),
+                               future.result(),
+                               waiting,
+                               ready)
+        results = {key: task.state for key, task in tasks.items()}
+        self._logger.info("Executed %d tasks, %d failed, %d skipped.",
+                          len(results),
+                          list(results.values()).count(Task.FAILED),
+                          list(results.values()).count(Task.SKIPPED))
+        return results
+
+    def _pool(self, key):
+        """
+        Returns:
+            (str) : the step of the pool running the task, None if it runs
+                    on the shared workers.
+        """
+
+        step = key[-1] if isinstance(key, tuple) and key else None
+        return step if step in self._pools else None
+
+    def _ready(self, tasks, waiting):
+        """
+        Returns:
+            ready (dictionary) : heap of the tasks ready to be executed, by
+                                 pool, None for the shared workers.
+        """
+
+        ready = {None: []}
+        for key, task in tasks.items():
+            if waiting[key] == 0:
+                ready.setdefault(self._pool(key), []).append((task.index, key))
+        for heap in ready.values():
+            heapq.heapify(heap)
+        return ready
+
+    def _startable(self, tasks, ready, running):
+        """
+        Takes the ready tasks that can be started, in the order they were
+        added, up to the workers of each pool. The shared tasks are taken
+        first, so the tasks of the pools only start if fewer than backlog
+        shared tasks are left waiting.
+
+        Args:
+            tasks (dictionary) : the tasks, by key.
+            ready (dictionary) : heap of the ready tasks, by pool.
+            running (dictionary) : the running tasks.
+
+        Returns:
+            (list) : the tasks to start.
+        """
+
+        busy = {}
+        for task in running.values():
+            pool = self._pool(task.key)
+            busy[pool] = busy.get(pool, 0) + 1
+        started = []
+        for pool in sorted(ready, key=lambda p: p is not None):
+            heap = ready[pool]
+            workers = self._jobs if pool is None else self._pools[pool]
+            while heap and busy.get(pool, 0) < workers:
+                if pool is not None and len(ready[None]) >= self._backlog:
+                    break
+                started.append(tasks[heapq.heappop(heap)[1]])
+                busy[pool] = busy.get(pool, 0) + 1
+        return started
+
+    async def _execute_async(self, task):
+        """
+        Executes the action of the task, awaiting its result if it is a coroutine.
+
+        Args:
+            task (Task) : task to execute.
+
+        Returns:
+            (bool) : True if the action succeeded, False otherwise.
+        """
+
+        try:
+            result = task.action()
+            if asyncio.iscoroutine(result):
+                result = await result
+            return bool(result)
+        except Exception as e:
+            self._logger.warning("Task %s raised an exception: %s", task.key, e)
+        return False
+
+    def _execute(self, task):
+        """
+        Executes the action of the task.
+
+        Args:
+            task (Task) : task to execute.
+
+        Returns:
+            (bool) : True if the action succeeded, False otherwise.
+        """
+
+        try:
+            return bool(task.action())
+        except Exception as e:
+            self._logger.warning("Task %s raised an exception: %s", task.key, e)
+        return False
+
+    def _complete(self, task, success, waiting, ready):
+        """
+        Records the result of the task and queues the dependents that are
+        now ready, or skips them if the task failed.
+
+        Args:
+            task (Task) : the completed task.
+            success (bool) : result of the task.
+            waiting (dictionary) : number of unfinished dependencies, by key.
+            ready (dictionary) : heap of the tasks ready to be executed, by pool.
+        """
+
+        if success:
+            task.state = Task.SUCCEEDED
+            self._release(task.dependents + task.followers, waiting, ready)
+            return
+        task.state = Task.FAILED
+        self._logger.warning("Task %s failed.", task.key)
+        done = [task]
+        pending = list(task.dependents)
+        while pending:
+            dependent = pending.pop()
+            if dependent.state == Task.PENDING:
+                dependent.state = Task.SKIPPED
+                self._logger.warning("Skipping task %s, %s failed.",
+                                     dependent.key, task.key)
+                pending.extend(dependent.dependents)
+                done.append(dependent)
+        for finished in done:
+            self._release(finished.followers, waiting, ready)
+
+    def _release(self, tasks, waiting, ready):
+        """
+        Queues the tasks that no longer wait for anything.
+
+        Args:
+            tasks (list) : tasks waiting for a task that is done.
+            waiting (dictionary) : number of unfinished dependencies, by key.
+            ready (dictionary) : heap of the tasks ready to be executed, by pool.
+        """
+
+        for task in tasks:
+            waiting[task.key] -= 1
+            if waiting[task.key] == 0 and task.state == Task.PENDING:
+                heapq.heappush(ready.setdefault(self._pool(task.key), []), (task.index, task.key))
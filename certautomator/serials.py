@@ -0,0 +1,112 @@
+from certautomator.utils import FileHandler
+import fcntl
+import logging
+import os
+import secrets
+import threading
+
+
+class RandomSerials:
+    """
+    Allocates random 159 bit serial numbers. Nothing is shared between
+    signers, so any number of them may sign for the same CA at the same
+    time, and a collision is as unlikely as guessing a 159 bit secret.
+    """
+
+    # -- Serials are positive and at most 20 bytes long (RFC 5280). --
+    BITS = 159
+
+    def next(self, ca):
+        """
+        Args:
+            ca (certautomator.CA) : the CA signing the certificate.
+
+        Returns:
+            (int) : the serial number of the certificate, None if none is available.
+        """
+
+        return secrets.randbits(RandomSerials.BITS) | 1 << (RandomSerials.BITS - 1)
+
+
+class CounterSerials:
+
+    def __init__(self,
+                 block=100,
+                 filehandler=FileHandler(),
+                 logger=logging.getLogger('certautomator.serials')):
+        """
+        Allocates consecutive serial numbers from the CA's serial file, the
+        file openssl x509 -CAcreateserial uses, next to the CA certificate.
+        Serials are reserved by blocks: the file is locked, advanced by block
+        and unlocked, and the reserved serials are then handed out from
+        memory. Runs sharing the CA never reuse a serial, serials reserved
+        but not used by a run are skipped.
+
+        Args:
+            block (int) : number of serials reserved at a time.
+            filehandler (certautomator.FileHandler) : object responsible for file operations.
+            logger (logging.Logger) : Handles logging features.
+        """
+
+        self._block = block if block is not None and block > 0 else 1
+        self._fh = filehandler
+        self._logger = logger
+        self._lock = threading.Lock()
+        # -- [next, last] serials reserved for each serial file. --
+        self._reserved = {}
+
+    @staticmethod
+    def serial_file(ca):
+        """
+        Returns:
+            (str) : location of the serial file of the CA, named as openssl does.
+        """
+
+        return '{0}.srl'.format(os.path.splitext(ca.certificate_file)[0])
+
+    def next(self, ca):
+        filename = CounterSerials.serial_file(ca)
+        with self._lock:
+            reserved = self._reserved.get(filename)
+            if reserved is None or reserved[0] > reserved[1]:
+                reserved = self._reserve(filename)
+                if reserved is None:
+                    return None
+                self._reserved[filename] = reserved
+            serial = reserved[0]
+            reserved[0] += 1
+            return serial
+
+    def _reserve(self, filename):
+        """
+        Advances the serial file by a block, under an exclusive lock of
+        filename.lock.
+
+        Returns:
+            (list) : the first and last reserved serials, None if an error occurred.
+        """
+
+        try:
+            with open('{0}.lock'.format(filename), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    last = 0
+                    if self._fh.file_exists(filename):
+                        content = self._fh.read(filename)
+                        last = int(content.strip(), 16) if content and content.strip() else 0
+                    # -- openssl expects an even number of hexadecimal digits. --
+                    content = '{0:X}'.format(last + self._block)
+                    content = '0' * (len(content) % 2) + content
+                    if self._fh.write_bytes(filename,
+                                            '{0}\n'.format(content).encode(),
+                                            permissions=0o644) is False:
+                        return None
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        except (OSError, ValueError) as e:
+            self._logger.warning(
+                "Unable to reserve serial numbers in %s: %s", filename, e)
+            return None
+        self._logger.debug("Reserved serial numbers %X to %X in %s.",
+                           last + 1, last + self._block, filename)
+        return [last + 1, last + self._block]
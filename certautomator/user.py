@@ -1,10 +1,31 @@
 from certautomator.distinguished_names import DistinguishedNames
+from certautomator.distinguished_names import DistinguishedNamesBase
 from certautomator.file_properties import FileProperties
+from certautomator.file_properties import FilePropertiesBase
 
 import logging
 
+# -- Key algorithms supported for the keys of the users and cas. --
+KEY_TYPES = ('rsa', 'ec', 'ed25519')
 
-class User(DistinguishedNames, FileProperties):
+
+class User(DistinguishedNamesBase, FilePropertiesBase):
+
+    # -- No per instance __dict__, six figure user counts are common. --
+    __slots__ = (DistinguishedNames.__slots__ +
+                 FileProperties.__slots__ +
+                 ('_logger',
+                  '_name',
+                  '_dir',
+                  '_bits',
+                  '_protected',
+                  '_message_digest',
+                  '_certificate_expiration',
+                  '_password',
+                  '_password_file',
+                  '_signing_ca',
+                  '_key_type',
+                  '_curve'))
 
     def __init__(self,
                  name,
@@ -25,6 +46,9 @@ class User(DistinguishedNames, FileProperties):
                  cert_name=None,
                  password=None,
                  password_file=None,
+                 signing_ca=None,
+                 key_type='rsa',
+                 curve='P-256',
                  logger=logging.getLogger('certautomator.user')):
         self._logger = logger
         self._name = name
@@ -35,7 +59,7 @@ class User(DistinguishedNames, FileProperties):
                 "Certificate Signing Request file for {0} is None.".format(name))
         if cert_name is None:
             raise Exception("Certificate file for {0} is None.".format(name))
-        DistinguishedNames.__init__(self,
+        DistinguishedNamesBase.__init__(self,
                                     country,
                                     state,
                                     locality,
@@ -43,7 +67,7 @@ class User(DistinguishedNames, FileProperties):
                                     organizational_unit_name,
                                     common_name,
                                     email)
-        FileProperties.__init__(self,
+        FilePropertiesBase.__init__(self,
                                 "{0}/keys/{1}".format(
                                     dir,
                                     key_name if key_name is not None else "{0}.key".format(name)),
@@ -60,6 +84,14 @@ class User(DistinguishedNames, FileProperties):
         self.certificate_expiration = certificate_expiration
         self.password = password
         self.password_file = password_file
+        self.signing_ca = signing_ca
+        self.key_type = key_type
+        self.curve = curve
+        if self.key_type is None:
+            raise Exception("Key type {0} of {1} is not one of {2}.".format(
+                key_type, name, ', '.join(KEY_TYPES)))
+        if self.key_type == 'ec' and self.curve is None:
+            raise Exception("Curve of the ec key of {0} is None.".format(name))
 
     @property
     def bits(self):
@@ -67,7 +99,7 @@ class User(DistinguishedNames, FileProperties):
 
     @bits.setter
     def bits(self, b):
-        self._logger.debug('Setting bits %s for %s.', str(b), self.name)
+        self._logger.debug('Setting bits %s for %s.', b, self._name)
         if isinstance(b, int):
             self._bits = b
         else:
@@ -79,7 +111,7 @@ class User(DistinguishedNames, FileProperties):
 
     @protected.setter
     def protected(self, p):
-        self._logger.debug('Setting protected %s for %s.', str(p), self.name)
+        self._logger.debug('Setting protected %s for %s.', p, self._name)
         if isinstance(p, bool):
             self._protected = p
         else:
@@ -92,7 +124,7 @@ class User(DistinguishedNames, FileProperties):
     @message_digest.setter
     def message_digest(self, md):
         self._logger.debug(
-            'Setting message_digest %s for %s.', str(md), self.name)
+            'Setting message_digest %s for %s.', md, self._name)
         if isinstance(md, str):
             self._message_digest = md
         else:
@@ -105,7 +137,7 @@ class User(DistinguishedNames, FileProperties):
     @certificate_expiration.setter
     def certificate_expiration(self, ce):
         self._logger.debug(
-            'Setting certificate expiration %s for %s.', str(ce), self.name)
+            'Setting certificate expiration %s for %s.', ce, self._name)
         if isinstance(ce, bool):
             self._certificate_expiration = None
         elif isinstance(ce, int):
@@ -137,16 +169,65 @@ class User(DistinguishedNames, FileProperties):
     def password_file(self, pwd_file):
         self._password_file = pwd_file
 
+    @property
+    def key_type(self):
+        """
+        Algorithm of the key, one of KEY_TYPES: rsa keys have bits, ec keys
+        are on curve, ed25519 keys have neither.
+        """
+
+        return self._key_type
+
+    @key_type.setter
+    def key_type(self, kt):
+        self._logger.debug('Setting key type %s for %s.', kt, self._name)
+        if isinstance(kt, str) and kt.lower() in KEY_TYPES:
+            self._key_type = kt.lower()
+        else:
+            self._key_type = None
+
+    @property
+    def curve(self):
+        return self._curve
+
+    @curve.setter
+    def curve(self, c):
+        if isinstance(c, str) and c.strip() != '':
+            self._curve = c
+        else:
+            self._curve = None
+
+    @property
+    def signing_ca(self):
+        """
+        Name of the CA of the group signing the user's certificate, None
+        for the default CA of the group.
+        """
+
+        return self._signing_ca
+
+    @signing_ca.setter
+    def signing_ca(self, ca):
+        if isinstance(ca, str) and ca.strip() != '':
+            self._signing_ca = ca
+        else:
+            self._signing_ca = None
+
     def is_valid(self):
-        valid = (FileProperties.is_valid(self) and
+        valid = (FilePropertiesBase.is_valid(self) and
                  self.bits is not None and
                  self.protected is not None and
                  self.message_digest is not None and
-                 self.certificate_expiration is not None)
+                 self.certificate_expiration is not None and
+                 self.key_type is not None and
+                 (self.key_type != 'ec' or self.curve is not None))
         return valid
 
 
 class CA(User):
+
+    __slots__ = ('_config_file', '_ca_dir')
+
     def __init__(self,
                  name=None,
                  bits=2048,
@@ -167,6 +248,8 @@ class CA(User):
                  cert_name=None,
                  password=None,
                  password_file=None,
+                 key_type='rsa',
+                 curve='P-256',
                  logger=logging.getLogger('certautomator.ca')):
         self._logger = logger
         User.__init__(self,
@@ -187,10 +270,11 @@ class CA(User):
                       request_name,
                       cert_name,
                       password,
-                      password_file)
-        # unused. This is for creating conf file to setup a complete
-        # CA with certificate revocation lists etc.
-        # May be implemented on a later date.
+                      password_file,
+                      key_type=key_type,
+                      curve=curve)
+        # -- openssl ca configuration used by --batch-sign, one is --
+        # -- generated in <ca_dir>/batch/<name> if not given. --
         self.config_file = ca_conf
         self._ca_dir = ca_dir
 
@@ -205,7 +289,7 @@ class CA(User):
     @config_file.setter
     def config_file(self, cf):
         self._logger.debug(
-            'Setting configuration file %s for CA %s.', str(cf), super().name)
+            'Setting configuration file %s for CA %s.', cf, self._name)
         if isinstance(cf, str) and cf.strip() is not '':
             self._config_file = cf
         else:
@@ -6,7 +6,12 @@ from json.decoder import JSONDecodeError
 import json
 import logging
 import os
+import re
+import secrets
 import stat
+import threading
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
 
 
 class FileHandler:
@@ -49,6 +54,89 @@ class FileHandler:
             self._logger.exception('Unknown Exception, aborting.')
         return False
 
+    def write_bytes(self, filename, data, permissions=None):
+        """
+        Writes the binary data to filename. The data is written to a
+        temporary file renamed to filename, so filename is either left as
+        it was or holds all of the data. The data itself is not logged,
+        as it may contain private keys.
+
+        Args:
+            filename (str) : path and filename to write content to
+            data (bytes) : data to write to the file.
+            permissions (int) : permissions of the file,
+                                defaults to Read Write for user running the script.
+
+        Returns:
+            (bool) : True if data was written to, False otherwise.
+        """
+
+        temporary = self.temporary_name(filename)
+        try:
+            self._logger.debug(
+                "Attempting to write %d bytes to file %s.", len(data), filename)
+            fd = os.open(temporary,
+                         os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         permissions if permissions is not None else stat.S_IRUSR | stat.S_IWUSR)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, filename)
+            self._logger.debug(
+                "Successfully wrote data to file %s.", filename)
+            return True
+        except PermissionError as pe:
+            self._logger.exception(pe)
+        except OSError as oe:
+            self._logger.exception(oe)
+        except:
+            self._logger.exception('Unknown Exception, aborting.')
+        self.remove(temporary)
+        return False
+
+    @staticmethod
+    def temporary_name(filename):
+        """
+        Returns:
+            (str) : a unique name, in the directory of filename, for a file
+                    renamed to filename once it is complete.
+        """
+
+        return '{0}.{1}.tmp'.format(filename, secrets.token_hex(4))
+
+    def replace(self, source, destination):
+        """
+        Renames source to destination, replacing destination if it exists.
+
+        Args:
+            source (str) : location of the complete file, e.g. a temporary file.
+            destination (str) : location it is renamed to.
+
+        Returns:
+            (bool) : True if the file was renamed, False otherwise.
+        """
+
+        try:
+            os.replace(source, destination)
+            return True
+        except OSError as oe:
+            self._logger.warning("Unable to rename %s to %s: %s", source, destination, oe)
+        return False
+
+    def remove(self, location):
+        """
+        Removes the file at location, if it exists.
+
+        Args:
+            location (str) : location of the file.
+        """
+
+        try:
+            os.remove(location)
+        except FileNotFoundError:
+            pass
+        except OSError as oe:
+            self._logger.warning("Unable to remove %s: %s", location, oe)
+
     def directory_exists(self, location):
         """
         Checks to see if the path exists and that it is a directory.
@@ -77,6 +165,18 @@ class FileHandler:
         self._logger.debug("Check if file at %s exists.", location)
         return os.path.exists(location) and os.path.isfile(location)
 
+    def mark_written(self, location):
+        """
+        Tells the file handler that a file was written at location by
+        another process, e.g. openssl. Nothing to do for this file handler,
+        see SnapshotFileHandler.
+
+        Args:
+            location (str) : location of the written file.
+        """
+
+        pass
+
     def create_directory(self, full_path, permissions=None):
         """
         Creates the directory if it doesn't already exist. 
@@ -156,6 +256,77 @@ class FileHandler:
         return replaced_data
 
 
+class SnapshotFileHandler(FileHandler):
+    def __init__(self,
+                 logger=logging.getLogger('opensstoolslib.filehandler'),
+                 default_mode=stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR):
+        """
+        File handler answering file_exists from a snapshot of each directory,
+        taken with a single os.scandir the first time a file of the directory
+        is checked, instead of two stats per check. The snapshot is updated
+        by write, write_bytes, replace and mark_written, files created or removed by
+        others after the snapshot are not seen.
+
+        Args:
+            logger (logging.Logger) : Handles logging features.
+            default_mode (stat) : permissions of the created directories.
+        """
+
+        FileHandler.__init__(self, logger=logger, default_mode=default_mode)
+        self._lock = threading.Lock()
+        # -- Names of the files in each scanned directory. --
+        self._snapshots = {}
+
+    def file_exists(self, location):
+        directory, name = os.path.split(location)
+        with self._lock:
+            return name in self._snapshot(directory)
+
+    def write(self, filename, data, format=''):
+        result = FileHandler.write(self, filename, data, format=format)
+        if result:
+            self.mark_written(filename)
+        return result
+
+    def write_bytes(self, filename, data, permissions=None):
+        result = FileHandler.write_bytes(self, filename, data, permissions=permissions)
+        if result:
+            self.mark_written(filename)
+        return result
+
+    def replace(self, source, destination):
+        result = FileHandler.replace(self, source, destination)
+        if result:
+            self.mark_written(destination)
+        return result
+
+    def mark_written(self, location):
+        directory, name = os.path.split(location)
+        with self._lock:
+            self._snapshot(directory).add(name)
+
+    def _snapshot(self, directory):
+        """
+        Returns the names of the files in directory, scanning it if it
+        wasn't yet. Must be called with the lock held.
+        """
+
+        directory = os.path.normpath(directory) if directory else os.curdir
+        names = self._snapshots.get(directory)
+        if names is None:
+            names = set()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            names.add(entry.name)
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            self._logger.debug("Found %d files in %s.", len(names), directory)
+            self._snapshots[directory] = names
+        return names
+
+
 class Config:
 
     def __init__(self,
@@ -186,3 +357,189 @@ class Config:
         except JSONDecodeError as jde:
             self._logger.warning(jde)
         return None
+
+    def iter_config(self, filename, chunk_size=65536, strict=False):
+        """
+        Reads the config file one group at a time instead of loading it whole.
+        For each group, yields its name and a JSONStream positioned on its
+        value. The caller must read the value from the stream, with value,
+        members or skip, before getting the next group.
+
+        Args:
+            filename (str) : path and filename of the config file.
+            chunk_size (int) : number of characters read from the file at once.
+            strict (bool) : True to raise the errors reading the file instead of
+                            logging them and ending the iteration.
+
+        Yields:
+            (str, certautomator.JSONStream) : name of the group and the stream to read it from.
+        """
+
+        try:
+            self._logger.debug(
+                "Attempting to stream configuration data from file %s.", filename)
+            with open(filename, 'r') as f:
+                stream = JSONStream(f, chunk_size)
+                for group_key in stream.members():
+                    yield group_key, stream
+                stream.end()
+        except OSError as oe:
+            if strict:
+                raise
+            self._logger.warning(oe)
+        except JSONDecodeError as jde:
+            if strict:
+                raise
+            self._logger.warning(jde)
+
+
+class JSONStream:
+
+    def __init__(self, f, chunk_size=65536):
+        """
+        Reads a JSON document from a file incrementally, keeping only the
+        value being read in memory. Objects can be iterated member by member
+        with members, any other value is read whole with value.
+
+        Args:
+            f (file) : the file to read the document from.
+            chunk_size (int) : number of characters read from the file at once.
+        """
+
+        self._file = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+
+    def value(self):
+        """
+        Reads the next value of the document.
+
+        Returns:
+            the decoded value.
+        """
+
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+                # -- A number ending with the buffer may continue in the file. --
+                if end < len(self._buffer) or not self._read(len(self._buffer)):
+                    self._position = end
+                    return value
+            except JSONDecodeError:
+                # -- Read as much again as is buffered, so a large value is --
+                # -- decoded a logarithmic number of times.                 --
+                if not self._read(len(self._buffer)):
+                    raise
+
+    def members(self):
+        """
+        Reads the next value of the document, which must be an object, one
+        member at a time. Yields the name of each member, the caller must
+        read the member's value from the stream before getting the next name.
+
+        Yields:
+            (str) : name of the member.
+        """
+
+        self._expect('{')
+        if self._peek() == '}':
+            self._position += 1
+            return
+        while True:
+            name = self.value()
+            if not isinstance(name, str):
+                self._error('Expecting property name enclosed in double quotes')
+            self._expect(':')
+            yield name
+            if self._expect(',}') == '}':
+                return
+
+    def elements(self):
+        """
+        Reads the next value of the document, which must be an array, one
+        element at a time. The caller must read each element from the stream
+        before getting the next one.
+
+        Yields:
+            (int) : index of the element.
+        """
+
+        self._expect('[')
+        if self._peek() == ']':
+            self._position += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self._expect(',]') == ']':
+                return
+
+    def skip(self):
+        """
+        Reads the next value of the document and discards it, without
+        decoding objects and arrays whole.
+        """
+
+        character = self._peek()
+        if character == '{':
+            for _ in self.members():
+                self.skip()
+        elif character == '[':
+            for _ in self.elements():
+                self.skip()
+        else:
+            self.value()
+
+    def end(self):
+        """
+        Checks that nothing but whitespace is left in the document.
+        """
+
+        if self._peek() != '':
+            self._error('Extra data')
+
+    def _peek(self):
+        """
+        Skips whitespace and returns the next character, '' at the end of the document.
+        """
+
+        while True:
+            self._position = _WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                return ''
+
+    def _expect(self, characters):
+        character = self._peek()
+        if character == '' or character not in characters:
+            self._error("Expecting one of '{0}'".format(characters))
+        self._position += 1
+        return character
+
+    def _read(self, size=None):
+        """
+        Appends the next characters of the file to the buffer, dropping
+        the characters already read.
+
+        Returns:
+            (bool) : False if the end of the file was reached.
+        """
+
+        if self._eof:
+            return False
+        data = self._file.read(max(size or 0, self._chunk_size))
+        if data == '':
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._position:] + data
+        self._position = 0
+        return True
+
+    def _error(self, message):
+        raise JSONDecodeError(message, self._buffer, self._position)
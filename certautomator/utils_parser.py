@@ -8,6 +8,42 @@ from certautomator.user import CA
 import re
 import logging
 
+# -- Argument of User for each entry of a user in the config file. --
+_USER_FIELDS = {'bits': 'bits',
+                'protected': 'protected',
+                'message_digest': 'message_digest',
+                'days': 'certificate_expiration',
+                'country': 'country',
+                'state': 'state',
+                'locality': 'locality',
+                'organization_name': 'organization_name',
+                'organizational_unit_name': 'organizational_unit_name',
+                'common_name': 'common_name',
+                'email': 'email',
+                'user_dir': 'dir',
+                'key_name': 'key_name',
+                'cert_request_name': 'request_name',
+                'cert_name': 'cert_name',
+                'password': 'password',
+                'password_file': 'password_file',
+                'ca': 'signing_ca',
+                'key_type': 'key_type',
+                'curve': 'curve'}
+
+# -- Argument of CA for each entry of a ca in the config file. --
+_CA_FIELDS = dict([(entry, argument) for entry, argument in _USER_FIELDS.items()
+                   if entry not in ('user_dir', 'ca')],
+                  ca_dir='ca_dir',
+                  ca_conf='ca_conf')
+
+# -- Entries defaulting to the group's ssl_defaults and name_defaults. --
+_SSL_DEFAULTS = ('bits', 'protected', 'days')
+# -- Entries defaulting to the group's ssl_defaults if set there, else to --
+# -- the defaults of User.                                               --
+_KEY_DEFAULTS = ('message_digest', 'key_type', 'curve')
+_NAME_DEFAULTS = ('country', 'state', 'locality', 'organization_name',
+                  'organizational_unit_name', 'email')
+
 
 class UserParser:
 
@@ -63,7 +99,8 @@ class Utils_Parser:
                  filehandler=FileHandler(),
                  logger=logging.getLogger('certautomator.utils_parser'),
                  ca_parser=CAParser(),
-                 user_parser=UserParser()):
+                 user_parser=UserParser(),
+                 create_directories=True):
         self._ssl_defaults = ssl_defaults
         self._name_defaults = name_defaults
         self._ca_key = ca_key
@@ -73,6 +110,9 @@ class Utils_Parser:
         self._logger = logger
         self._ca_parser = ca_parser
         self._user_parser = user_parser
+        self._create_directories = create_directories
+        # -- Result of setup_directories for each directory prepared. --
+        self._prepared_directories = {}
 
     def parse(self, data, specified_groups=None, specified_users=None):
         """
@@ -92,8 +132,7 @@ class Utils_Parser:
 
         all_groups = {}
         try:
-            self._logger.debug("Parsing data :")
-            self._logger.debug(data)
+            self._logger.debug("Parsing data.")
             for group_key, group_value in data.items() if data is not None else []:
                 if specified_groups is None or group_key in specified_groups:
                     self._logger.debug("Parsing data for group %s.", group_key)
@@ -112,6 +151,7 @@ class Utils_Parser:
                         self._logger.warning(
                             "Name_defaults entry for group %s was not found, aborting.", group_key)
                         break
+                    defaults = self._compile_defaults(ssl_defaults_value, name_defaults_value)
                     cas = group_value.get(self._ca_key)
                     if cas is not None:
                         self._logger.debug(
@@ -120,8 +160,7 @@ class Utils_Parser:
                             cas.items(),
                             specified_users,
                             self._create_CA,
-                            ssl_defaults_value,
-                            name_defaults_value)
+                            defaults)
                     users = group_value.get(self._user_key)
                     if users is not None:
                         self._logger.debug(
@@ -130,8 +169,7 @@ class Utils_Parser:
                             users.items(),
                             specified_users,
                             self._create_user,
-                            ssl_defaults_value,
-                            name_defaults_value)
+                            defaults)
                     all_groups[group_key] = group_users
                 else:
                     self._logger.debug(
@@ -140,7 +178,149 @@ class Utils_Parser:
             self._logger.warning(ae)
         return all_groups
 
-    def _add_users(self, all_users, specified_users, factory, ssl_defaults_value, name_defaults_value):
+    def iter_parse(self, groups, specified_groups=None, specified_users=None,
+                   batch_size=1000, wait_for_ca=False):
+        """
+        Parses the groups streamed by Config.iter_config and yields the cas
+        and users of each group in batches, so that only one batch of users
+        is in memory at a time. For each group, the cas are yielded first,
+        in a batch of their own, then the users.
+
+        The users are created once the ssl_defaults and name_defaults of
+        their group have been read, and, with wait_for_ca, once its ca has
+        been read. Users listed before those entries are kept until they are
+        read, so they should come first in the group to keep memory bounded.
+
+        Args:
+            groups (iterator) : (group name, certautomator.JSONStream) of each group.
+            specified_groups (list) : groups to be generated.
+            specified_users (list) : users to be generated
+            batch_size (int) : maximum number of users in a batch.
+            wait_for_ca (bool) : True if the users must be yielded after the
+                                 ca of their group, i.e. the users are signed.
+
+        Yields:
+            (str, dictionary) : name of the group and a batch of its cas
+                                or users, as returned by parse.
+        """
+
+        try:
+            for group_key, stream in groups:
+                if specified_groups is not None and group_key not in specified_groups:
+                    self._logger.debug(
+                        "Group key %s is not in the list of specified groups.", group_key)
+                    stream.skip()
+                    continue
+                self._logger.debug("Parsing data for group %s.", group_key)
+                ssl_defaults_value = None
+                name_defaults_value = None
+                cas = None
+                pending = []
+                for section in stream.members():
+                    if section == self._ssl_defaults:
+                        ssl_defaults_value = stream.value()
+                        user_dir = ssl_defaults_value.get('user_dir')
+                        if self.setup_directories(user_dir) is False:
+                            self._logger.warning(
+                                "Unable to create directory for group %s at %s.", group_key, user_dir)
+                    elif section == self._name_defaults:
+                        name_defaults_value = stream.value()
+                    elif section == self._ca_key:
+                        cas = stream.value()
+                    elif section == self._user_key:
+                        for user_key in stream.members():
+                            if specified_users is None or user_key in specified_users:
+                                pending.append((user_key, stream.value()))
+                            else:
+                                self._logger.debug(
+                                    "User %s is not in the list of users to generate.", user_key)
+                                stream.skip()
+                            if (len(pending) >= batch_size and
+                                    ssl_defaults_value is not None and
+                                    name_defaults_value is not None and
+                                    (cas is not None or not wait_for_ca)):
+                                for batch in self._create_batches(cas, pending, batch_size, specified_users,
+                                                                  ssl_defaults_value, name_defaults_value):
+                                    yield group_key, batch
+                                cas = {}
+                                pending = []
+                    else:
+                        stream.skip()
+                if ssl_defaults_value is None:
+                    self._logger.warning(
+                        "ssl_defaults entry for group %s was not found, aborting.", group_key)
+                    return
+                if name_defaults_value is None:
+                    self._logger.warning(
+                        "Name_defaults entry for group %s was not found, aborting.", group_key)
+                    return
+                for batch in self._create_batches(cas, pending, batch_size, specified_users,
+                                                  ssl_defaults_value, name_defaults_value):
+                    yield group_key, batch
+        except AttributeError as ae:
+            self._logger.warning(ae)
+
+    def _create_batches(self, cas, users, batch_size, specified_users,
+                        ssl_defaults_value, name_defaults_value):
+        """
+        Creates the cas, if any, in a batch of their own, then the users
+        in batches of at most batch_size.
+
+        Args:
+            cas (dictionary) : values of the cas from the config file, by name.
+                               None or empty if there are no cas to create.
+            users (list) : (name, values) of the users from the config file.
+            batch_size (int) : maximum number of users in a batch.
+            specified_users (list) : users to include, skip any that are not in the list.
+            ssl_defaults_value (dictionary) : default ssl related values.
+            name_defaults_value (dictionary) : distinguished name default values.
+
+        Yields:
+            (dictionary) : the cas or users of the batch.
+        """
+
+        defaults = self._compile_defaults(ssl_defaults_value, name_defaults_value)
+        if cas:
+            self._logger.debug("Generating CAs.")
+            yield {'ca': self._add_users(cas.items(),
+                                         specified_users,
+                                         self._create_CA,
+                                         defaults)}
+        for i in range(0, len(users), batch_size):
+            self._logger.debug("Generating %d users.", len(users[i:i + batch_size]))
+            yield {'users': self._add_users(users[i:i + batch_size],
+                                            None,
+                                            self._create_user,
+                                            defaults)}
+
+    def parse_user(self, group_value, user_key, user_value):
+        """
+        Parses a single user with the defaults of its group, without parsing
+        the other users and cas of the group.
+
+        Args:
+            group_value (dictionary) : the group in the config file, only its defaults are read.
+            user_key (str) : name of the user.
+            user_value (dictionary) : values of the user.
+
+        Returns:
+            user : User object or None if the user is invalid or its group has no defaults.
+        """
+
+        try:
+            ssl_defaults_value = group_value.get(self._ssl_defaults)
+            name_defaults_value = group_value.get(self._name_defaults)
+        except AttributeError as ae:
+            self._logger.warning(ae)
+            return None
+        if ssl_defaults_value is None or name_defaults_value is None:
+            self._logger.warning(
+                "Defaults of the group of user %s were not found.", user_key)
+            return None
+        return self._create_user(self._compile_defaults(ssl_defaults_value, name_defaults_value),
+                                 user_key, user_value)
+
+    def _add_users(self, all_users, specified_users, factory, defaults):
         """
         Loops through the lists of users from the all_users parameter and creates user and cas.
 
@@ -148,8 +328,7 @@ class Utils_Parser:
             all_users (list) : all the users and ca
             specified_users (list) : users to include, skip any that are not in the list.
             factory (method) : method to create the user
-            ssl_defaults_value (dictionary) : default ssl related values.
-            name_defaults_value (dictionary) : distinguished name default values.
+            defaults (dictionary) : the group's defaults, see _compile_defaults.
         Returns:
             dictionary of all the users and cas.
 
@@ -159,25 +338,69 @@ class Utils_Parser:
         for user_key, user_value in all_users:
             if specified_users is None or user_key in specified_users:
                 self._logger.debug("Generating new user %s.", user_key)
-                new_user_values = self._user_parser.parse(
-                    user_value)
-                new_user = factory(
-                    ssl_defaults_value, name_defaults_value, user_key, user_value)
-                users[user_key] = new_user
+                users[user_key] = factory(defaults, user_key, user_value)
             else:
                 self._logger.debug(
                     "User %s is not in the list of users to generate.", user_key)
         return users
 
-    def _create_user(self, ssl_defaults_value, name_defaults_value, user_key, user_value):
+    def _compile_defaults(self, ssl_defaults_value, name_defaults_value):
+        """
+        Merges the defaults of a group once, into the arguments of User and
+        CA used when a user or ca doesn't specify a value. Each user or ca
+        then only overlays the values it specifies, see _create.
+
+        Args:
+            ssl_defaults_value (dictionary) : default ssl related values.
+            name_defaults_value (dictionary) : distinguished name default values.
+
+        Returns:
+            (dictionary) : the arguments of User, under 'users', and of CA, under 'ca'.
+        """
+
+        common = {}
+        for entry in _SSL_DEFAULTS:
+            common[_USER_FIELDS[entry]] = ssl_defaults_value.get(entry)
+        for entry in _KEY_DEFAULTS:
+            if ssl_defaults_value.get(entry) is not None:
+                common[_USER_FIELDS[entry]] = ssl_defaults_value.get(entry)
+        for entry in _NAME_DEFAULTS:
+            common[_USER_FIELDS[entry]] = name_defaults_value.get(entry)
+        return {'users': dict(common, dir=ssl_defaults_value.get('user_dir')),
+                'ca': dict(common, ca_dir=ssl_defaults_value.get('ca_dir'))}
+
+    def _create(self, factory, fields, defaults, key, value):
+        """
+        Creates a user or ca from the group's defaults and the values
+        specified in the config file, which take precedence over the
+        defaults unless they are null.
+
+        Args:
+            factory (class) : User or CA.
+            fields (dictionary) : argument of factory for each entry in the config file.
+            defaults (dictionary) : arguments of factory from the group's defaults.
+            key (str) : name of the user or ca as specified in the config file.
+            value (dictionary) : values of the user or ca in the config file.
+
+        Returns:
+            The created user or ca.
+        """
+
+        arguments = dict(defaults)
+        for entry, entry_value in value.items():
+            argument = fields.get(entry)
+            if argument is not None and entry_value is not None:
+                arguments[argument] = entry_value
+        return factory(name=key, **arguments)
+
+    def _create_user(self, defaults, user_key, user_value):
         """
         Creates a new user object based on the parsed values and returns it. All values
         in the config file that is specified at the user or ca level will take precedent over the
         default values. If none exists on the user level, defaults will be used.
 
         Args:
-            ssl_defaults_value (dictionary) : default ssl related values.
-            name_defaults_value (dictionary) : distinguished name default values.
+            defaults (dictionary) : the group's defaults, see _compile_defaults.
             user_key (str) : name of the user as specified in the config file.
             user_value (str) : values from the user_key in the config file.
 
@@ -186,36 +409,7 @@ class Utils_Parser:
                    creating the directory structure failed.
         """
         try:
-            user = User(name=user_key,
-                        bits=user_value.get('bits') if user_value.get(
-                            'bits') is not None else ssl_defaults_value.get('bits'),
-                        protected=user_value.get('protected') if user_value.get(
-                            'protected') is not None else ssl_defaults_value.get('protected'),
-                        message_digest=user_value.get('message_digest') if user_value.get(
-                            'message_digest') is not None else ssl_defaults_value.get('message_digest'),
-                        certificate_expiration=user_value.get('days') if user_value.get(
-                            'days') is not None else ssl_defaults_value.get('days'),
-                        country=user_value.get('country') if user_value.get(
-                            'country') is not None else name_defaults_value.get('country'),
-                        state=user_value.get('state') if user_value.get(
-                            'state') is not None else name_defaults_value.get('state'),
-                        locality=user_value.get('locality') if user_value.get(
-                            'locality') is not None else name_defaults_value.get('locality'),
-                        organization_name=user_value.get('organization_name') if user_value.get(
-                            'organization_name') is not None else name_defaults_value.get('organization_name'),
-                        organizational_unit_name=user_value.get('organizational_unit_name') if user_value.get(
-                            'organizational_unit_name') is not None else name_defaults_value.get('organizational_unit_name'),
-                        common_name=user_value.get('common_name'),
-                        email=user_value.get('email') if user_value.get(
-                            'email') is not None else name_defaults_value.get('email'),
-                        dir=user_value.get("user_dir") if user_value.get(
-                            'user_dir') is not None else ssl_defaults_value.get("user_dir"),
-                        key_name=user_value.get("key_name"),
-                        request_name=user_value.get("cert_request_name"),
-                        cert_name=user_value.get("cert_name"),
-                        password=user_value.get('password'),
-                        password_file=user_value.get('password_file')
-                        )
+            user = self._create(User, _USER_FIELDS, defaults['users'], user_key, user_value)
             if self.setup_directories(user.dir):
                 self._logger.debug(
                     "Successfully generated new user %s.", user.name)
@@ -228,15 +422,14 @@ class Utils_Parser:
             self._logger.warning(e)
         return None
 
-    def _create_CA(self, ssl_defaults_value, name_defaults_value, ca_key, ca_value):
+    def _create_CA(self, defaults, ca_key, ca_value):
         """
         Creates a new CA object based on the parsed values and returns it. All values
         in the config file that is specified on the user or ca will take precedent over the
         default values. If none exists on the user level, defaults will be used.
 
         Args:
-            ssl_defaults_value (dictionary) : all the default ssl related values.
-            name_defaults_value (dictionary) : all distinguished name default values.
+            defaults (dictionary) : the group's defaults, see _compile_defaults.
             ca_key (str) : name of the ca as specified in the config file.
             ca_value (str) : values from the ca_key in the config file.
 
@@ -245,37 +438,7 @@ class Utils_Parser:
                  creating the directory structure failed.
         """
         try:
-            ca = CA(name=ca_key,
-                    bits=ca_value.get('bits') if ca_value.get(
-                        'bits') is not None else ssl_defaults_value.get('bits'),
-                    protected=ca_value.get('protected') if ca_value.get(
-                        'protected') is not None else ssl_defaults_value.get('protected'),
-                    message_digest=ca_value.get('message_digest') if ca_value.get(
-                        'message_digest') is not None else ssl_defaults_value.get('message_digest'),
-                    certificate_expiration=ca_value.get('days') if ca_value.get(
-                        'days') is not None else ssl_defaults_value.get('days'),
-                    country=ca_value.get('country') if ca_value.get(
-                        'country') is not None else name_defaults_value.get('country'),
-                    state=ca_value.get('state') if ca_value.get(
-                        'state') is not None else name_defaults_value.get('state'),
-                    locality=ca_value.get('locality') if ca_value.get(
-                        'locality') is not None else name_defaults_value.get('locality'),
-                    organization_name=ca_value.get('organization_name') if ca_value.get(
-                        'organization_name') is not None else name_defaults_value.get('organization_name'),
-                    organizational_unit_name=ca_value.get('organizational_unit_name') if ca_value.get(
-                        'organizational_unit_name') is not None else name_defaults_value.get('organizational_unit_name'),
-                    common_name=ca_value.get('common_name'),
-                    email=ca_value.get('email') if ca_value.get(
-                        'email') is not None else name_defaults_value.get('email'),
-                    # ca_conf=ca_value.get('ca_conf'),
-                    ca_dir=ca_value.get('ca_dir') if ca_value.get(
-                        'ca_dir') is not None else ssl_defaults_value.get('ca_dir'),
-                    key_name=ca_value.get("key_name"),
-                    request_name=ca_value.get("cert_request_name"),
-                    cert_name=ca_value.get("cert_name"),
-                    password=ca_value.get('password'),
-                    password_file=ca_value.get('password_file')
-                    )
+            ca = self._create(CA, _CA_FIELDS, defaults['ca'], ca_key, ca_value)
             if self.setup_directories(ca.ca_dir):
                 self._logger.debug(
                     "Successfully generated new CA %s.", ca.name)
@@ -291,7 +454,10 @@ class Utils_Parser:
     def setup_directories(self, path):
         """
         Recursively creates the necessary directories to hold
-        the keys, requests and certificates.
+        the keys, requests and certificates. Each directory is
+        only prepared once, users sharing it reuse the result.
+        Nothing is created if create_directories is False, e.g.
+        when planning a run.
 
         Args:
             path (str) : location of the folder to create the
@@ -303,6 +469,11 @@ class Utils_Parser:
 
         """
 
+        if not self._create_directories:
+            return True
+        result = self._prepared_directories.get(path)
+        if result is not None:
+            return result
         self._logger.debug("Generating directory structure at %s.", path)
         all_paths = ["{0}/keys".format(path),
                      "{0}/csrs".format(path),
@@ -310,4 +481,5 @@ class Utils_Parser:
         result = True
         for p in all_paths:
             result &= self._fh.create_directory(p)
+        self._prepared_directories[path] = result
         return result
@@ -0,0 +1,169 @@
+from certautomator.manifest import BuildManifest
+import logging
+import os
+import threading
+
+
+class ConfigWatcher:
+
+    # -- Steps whose fingerprints tell whether a user or ca changed. --
+    STEPS = ('key', 'csr', 'crt')
+
+    def __init__(self,
+                 config,
+                 interval=5.0,
+                 logger=logging.getLogger('certautomator.watcher')):
+        """
+        Polls the modification time of the config file and, once it changed,
+        tells which users and cas were added, changed or removed since the
+        previous parse. Only a fingerprint of each user and ca is kept
+        between parses, see BuildManifest.fingerprints, not the parsed
+        config, so memory doesn't depend on the size of the values.
+
+        Args:
+            config (str) : location of the config file.
+            interval (float) : number of seconds between two polls.
+            logger (logging.Logger) : Handles logging features.
+        """
+
+        self._config = config
+        self._interval = interval
+        self._logger = logger
+        self._stop = threading.Event()
+        self._signature = None
+        # -- Fingerprint of each user and ca of the previous parse, by id. --
+        self._fingerprints = {}
+        self._changes = None
+
+    def changed(self):
+        """
+        Returns:
+            (bool) : True if the config file was modified, or replaced, since
+                     the previous call, always True for the first call.
+        """
+
+        try:
+            status = os.stat(self._config)
+            signature = (status.st_mtime_ns, status.st_size, status.st_ino)
+        except OSError as e:
+            self._logger.warning("Unable to check config file %s: %s", self._config, e)
+            return False
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        return True
+
+    def wait(self):
+        """
+        Waits for the config file to change, the first call returns at once.
+
+        Returns:
+            (bool) : True if the file changed, False if stop was called.
+        """
+
+        timeout = 0 if self._signature is None else self._interval
+        while not self._stop.wait(timeout):
+            if self.changed():
+                return True
+            timeout = self._interval
+        return False
+
+    def stop(self):
+        """
+        Makes wait return False, may be called from any thread or a signal handler.
+        """
+
+        self._stop.set()
+
+    def filter(self, batches):
+        """
+        Passes on the users and cas that were added or changed since the
+        previous parse, in the batches yielded by Utils_Parser.iter_parse.
+        The cas of a group are always passed on, as the users need them to
+        be signed, and when one of them changed, all the users of the group
+        are, as their certificates may have to be signed again. Once the
+        batches are exhausted, the users and cas that weren't seen are
+        reported as removed, see report.
+
+        Args:
+            batches (iterator) : (group name, batch) as yielded by Utils_Parser.iter_parse.
+
+        Yields:
+            (str, dictionary) : name of the group and a batch of its cas or
+                                of its added or changed users.
+        """
+
+        previous = self._fingerprints
+        fingerprints = {}
+        changes = {'added': [], 'changed': [], 'removed': []}
+        renewed = set()
+        for group_key, batch in batches:
+            kind = 'ca' if 'ca' in batch else 'users'
+            selected = {}
+            for name, entity in batch[kind].items():
+                entity_id = BuildManifest.entity_id(group_key, kind, name)
+                fingerprint = ConfigWatcher._fingerprint(entity)
+                fingerprints[entity_id] = fingerprint
+                if entity_id not in previous:
+                    changes['added'].append(entity_id)
+                elif previous[entity_id] != fingerprint:
+                    changes['changed'].append(entity_id)
+                elif kind == 'ca' or group_key not in renewed:
+                    continue
+                if kind == 'ca':
+                    renewed.add(group_key)
+                selected[name] = entity
+            if kind == 'ca':
+                selected = batch['ca']
+            if selected:
+                yield group_key, {kind: selected}
+        changes['removed'] = sorted(set(previous) - set(fingerprints))
+        self._fingerprints = fingerprints
+        self._changes = changes
+
+    def report(self, first=False):
+        """
+        Logs the users and cas added, changed and removed by the last parse.
+        Removed users and cas are only reported, their files are kept.
+
+        Args:
+            first (bool) : True for the first parse, only counting the users and cas.
+
+        Returns:
+            (dictionary) : ids of the added, changed and removed users and cas,
+                           None if the last parse didn't complete.
+        """
+
+        changes = self._changes
+        self._changes = None
+        if changes is None:
+            return None
+        if first:
+            self._logger.info("Watching %s, %d users and cas.",
+                              self._config, len(self._fingerprints))
+            return changes
+        self._logger.info("%s changed: %d users and cas added, %d changed, %d removed.",
+                          self._config,
+                          len(changes['added']),
+                          len(changes['changed']),
+                          len(changes['removed']))
+        for kind in ('added', 'changed'):
+            for entity_id in changes[kind]:
+                self._logger.info("%s was %s.", entity_id, kind)
+        for entity_id in changes['removed']:
+            self._logger.info("%s was removed from the config, its files are kept.", entity_id)
+        return changes
+
+    @staticmethod
+    def _fingerprint(entity):
+        """
+        Returns:
+            (list) : the fingerprint of the values the files of the user or
+                     ca are generated from and the name of its signing ca,
+                     None if it is invalid.
+        """
+
+        if entity is None:
+            return None
+        return [BuildManifest.fingerprints(entity, ConfigWatcher.STEPS)['crt'],
+                getattr(entity, 'signing_ca', None)]
@@ -0,0 +1,111 @@
+from certautomator.backends import CryptographyBackend
+from certautomator.backends import x509
+from certautomator.user import CA, User
+import tempfile
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+@unittest.skipIf(x509 is None, 'cryptography is not installed.')
+class Test_CryptographyBackend(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        for name in ['keys', 'csrs', 'crts']:
+            os.makedirs(os.path.join(self._dir.name, name))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_generate_and_sign(self):
+        backend = CryptographyBackend()
+        ca = CA(name='ca',
+                bits=1024,
+                certificate_expiration=10,
+                country='US',
+                common_name='CA1',
+                ca_dir=self._dir.name,
+                key_name='ca.key',
+                request_name='ca.csr',
+                cert_name='ca.crt')
+        user = User(name='user',
+                    bits=1024,
+                    certificate_expiration=5,
+                    country='US',
+                    organization_name='Company',
+                    common_name='USER1',
+                    email='user@_unknown_.com',
+                    dir=self._dir.name,
+                    key_name='a.key',
+                    request_name='a.csr',
+                    cert_name='a.crt')
+        self.assertTrue(backend.generate_key(ca, 'pass:secret'))
+        self.assertTrue(backend.generate_ca_certificate(ca, 'pass:secret'))
+        self.assertFalse(backend.generate_ca_certificate(ca, 'pass:wrong'))
+        self.assertTrue(backend.generate_key(user))
+        self.assertTrue(backend.generate_csr(user))
+        self.assertTrue(backend.sign_with_context(
+            user, backend.open_signing_context(ca, 'pass:secret')))
+        with open(ca.certificate_file, 'rb') as f:
+            ca_certificate = x509.load_pem_x509_certificate(f.read())
+        with open(user.certificate_file, 'rb') as f:
+            certificate = x509.load_pem_x509_certificate(f.read())
+        self.assertEqual(certificate.issuer, ca_certificate.subject)
+        self.assertEqual(certificate.subject.rfc4514_string(),
+                         '1.2.840.113549.1.9.1=user@_unknown_.com,CN=USER1,O=Company,C=US')
+        certificate.verify_directly_issued_by(ca_certificate)
+        self.assertEqual(oct(os.stat(user.key_file).st_mode & 0o777), '0o600')
+
+    def test_key_types(self):
+        backend = CryptographyBackend()
+        ca = CA(name='ca',
+                key_type='ed25519',
+                certificate_expiration=10,
+                common_name='CA1',
+                ca_dir=self._dir.name,
+                key_name='ca.key',
+                request_name='ca.csr',
+                cert_name='ca.crt')
+        user = User(name='user',
+                    key_type='ec',
+                    curve='P-384',
+                    message_digest='sha384',
+                    certificate_expiration=5,
+                    common_name='USER1',
+                    dir=self._dir.name,
+                    key_name='a.key',
+                    request_name='a.csr',
+                    cert_name='a.crt')
+        self.assertTrue(backend.generate_key(ca, 'pass:secret'))
+        self.assertTrue(backend.generate_ca_certificate(ca, 'pass:secret'))
+        self.assertTrue(backend.generate_key(user))
+        self.assertTrue(backend.generate_csr(user))
+        self.assertTrue(backend.sign_with_context(
+            user, backend.open_signing_context(ca, 'pass:secret')))
+        with open(user.certificate_signing_request_file, 'rb') as f:
+            request = x509.load_pem_x509_csr(f.read())
+        self.assertEqual(request.public_key().curve.name, 'secp384r1')
+        self.assertEqual(request.signature_hash_algorithm.name, 'sha384')
+        with open(ca.certificate_file, 'rb') as f:
+            ca_certificate = x509.load_pem_x509_certificate(f.read())
+        with open(user.certificate_file, 'rb') as f:
+            certificate = x509.load_pem_x509_certificate(f.read())
+        self.assertIsNone(certificate.signature_hash_algorithm)
+        certificate.verify_directly_issued_by(ca_certificate)
+        user.key_type = 'dsa'
+        self.assertFalse(backend.generate_key(user))
+
+    def test_password_file(self):
+        backend = CryptographyBackend()
+        password_file = os.path.join(self._dir.name, 'password.txt')
+        with open(password_file, 'w') as f:
+            f.write('secret\nignored\n')
+        self.assertEqual(backend._passphrase('file:' + password_file), b'secret')
+        self.assertEqual(backend._passphrase('pass:secret'), b'secret')
+
+
+if __name__ == '__main__':
+    unittest.main()
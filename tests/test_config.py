@@ -1,5 +1,10 @@
 from certautomator.utils import Config
 from certautomator.utils import FileHandler
+from certautomator.utils import JSONStream
+from json.decoder import JSONDecodeError
+import io
+import json
+import tempfile
 import unittest
 from unittest.mock import MagicMock
 import os
@@ -31,3 +36,51 @@ class Test_TestConfig(unittest.TestCase):
         config = Config(filehandler=filehandler)
         result = config.read_config('ignore_file.json')
         self.assertEqual(result,None)
+
+
+class Test_JSONStream(unittest.TestCase):
+    def test_members_and_values(self):
+        data = '{"a": {"x": 1, "y": [1, 2]}, "b" : 12345, "c": {}, "d": "\\u00e9}"}'
+        stream = JSONStream(io.StringIO(data), chunk_size=3)
+        result = {}
+        for key in stream.members():
+            if key == 'a':
+                result[key] = {k: stream.value() for k in stream.members()}
+            else:
+                result[key] = stream.value()
+        stream.end()
+        self.assertEqual(result, json.loads(data))
+
+    def test_skip(self):
+        stream = JSONStream(io.StringIO('{"a": {"x": [1, {"y": null}]}, "b": true}'),
+                            chunk_size=2)
+        keys = []
+        for key in stream.members():
+            keys.append(key)
+            stream.skip()
+        self.assertEqual(keys, ['a', 'b'])
+
+    def test_truncated(self):
+        stream = JSONStream(io.StringIO('{"a": {"x": 1'), chunk_size=4)
+        with self.assertRaises(JSONDecodeError):
+            for key in stream.members():
+                stream.value()
+
+    def test_iter_config(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write('{"group1": {"users": {}}, "group2": 2}')
+            f.flush()
+            config = Config()
+            result = {key: stream.value() for key, stream in config.iter_config(f.name)}
+        self.assertEqual(result, {"group1": {"users": {}}, "group2": 2})
+
+    def test_iter_config_invalid(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write('{"group1": {"users": {}}, "group2"')
+            f.flush()
+            config = Config()
+            result = []
+            for key, stream in config.iter_config(f.name):
+                result.append(key)
+                stream.skip()
+        self.assertEqual(result, ['group1'])
@@ -1,8 +1,14 @@
 from certautomator.crypto_cmds import CryptoCommands
+from certautomator.manifest import BuildManifest
+from certautomator.metrics import Metrics
+from certautomator.plan import Plan
 from certautomator.user import CA, User
 from certautomator.utils import FileHandler
+import asyncio
+import tempfile
 import unittest
 from unittest.mock import MagicMock
+from unittest.mock import patch
 import os
 import sys
 sys.path.insert(0, os.path.abspath(
@@ -57,6 +63,7 @@ class Test_CryptoCommands(unittest.TestCase):
                     cert_name='c.crt')
         filehandler = FileHandler(logger=None)
         filehandler.file_exists = MagicMock(return_value=False)
+        filehandler.replace = MagicMock(return_value=True)
         cryptoCommands = CryptoCommands(logger=None,
                                         filehandler=filehandler)
         cryptoCommands._execute_command = MagicMock(return_value=True)
@@ -65,8 +72,125 @@ class Test_CryptoCommands(unittest.TestCase):
         self.assertEqual(commands[0][0][0], '/usr/bin/openssl')
         self.assertEqual(commands[0][0][1], 'genrsa')
         self.assertEqual(commands[0][0][2], '-out')
-        self.assertEqual(commands[0][0][3], '/test/dir/keys/a.key')
+        self.assertTrue(commands[0][0][3].startswith('/test/dir/keys/a.key.'))
         self.assertEqual(commands[0][0][4], '1')
+        filehandler.replace.assert_called_with(commands[0][0][3], '/test/dir/keys/a.key')
+        cryptoCommands._execute_command = MagicMock(return_value=False)
+        filehandler.replace.reset_mock()
+        self.assertFalse(cryptoCommands.generate_key(user))
+        filehandler.replace.assert_not_called()
+
+    def test_valid_generate_ec_key(self):
+        user = User(name='test', dir='/test/dir', key_name='a.key',
+                    request_name='r.csr',
+                    cert_name='c.crt',
+                    key_type='ec',
+                    curve='P-384')
+        filehandler = FileHandler(logger=None)
+        filehandler.file_exists = MagicMock(return_value=False)
+        filehandler.replace = MagicMock(return_value=True)
+        cryptoCommands = CryptoCommands(logger=None,
+                                        filehandler=filehandler)
+        cryptoCommands.key_pool = MagicMock()
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        self.assertTrue(cryptoCommands.generate_key(user))
+        cryptoCommands.key_pool.take.assert_not_called()
+        command = cryptoCommands._execute_command.call_args[0][0]
+        self.assertEqual(command[:3], ['/usr/bin/openssl', 'genpkey', '-out'])
+        self.assertTrue(command[3].startswith('/test/dir/keys/a.key.'))
+        self.assertEqual(command[4:], ['-algorithm', 'EC',
+                                       '-pkeyopt', 'ec_paramgen_curve:P-384',
+                                       '-pkeyopt', 'ec_param_enc:named_curve'])
+        filehandler.replace.assert_called_with(command[3], '/test/dir/keys/a.key')
+
+    def test_key_cpus(self):
+        user = User(name='test', dir='/test/dir', key_name='a.key',
+                    request_name='r.csr',
+                    cert_name='c.crt')
+        filehandler = FileHandler(logger=None)
+        filehandler.file_exists = MagicMock(return_value=False)
+        filehandler.replace = MagicMock(return_value=True)
+        cryptoCommands = CryptoCommands(filehandler=filehandler, key_cpus={0})
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        self.assertTrue(cryptoCommands.generate_key(user))
+        self.assertEqual(cryptoCommands._execute_command.call_args[1]['cpus'], {0})
+        with patch('os.sched_setaffinity', create=True) as sched_setaffinity:
+            cryptoCommands._pin(1234, {0, 1})
+            sched_setaffinity.assert_called_with(1234, {0, 1})
+            sched_setaffinity.side_effect = ProcessLookupError()
+            cryptoCommands._pin(1234, {0})
+            sched_setaffinity.reset_mock()
+            cryptoCommands._pin(1234, None)
+            sched_setaffinity.assert_not_called()
+        scheduler = CryptoCommands.scheduler({'jobs': 2, 'key_jobs': 4, 'backlog': 3})
+        self.assertEqual((scheduler._jobs, scheduler._pools, scheduler._backlog),
+                         (2, {'key': 4}, 3))
+
+    def test_passwords_are_piped(self):
+        cryptoCommands = CryptoCommands()
+        # -- Prints the argument of -passin and what its fd holds. --
+        script = 'import os, sys; print(sys.argv[2], os.read(int(sys.argv[2][3:]), 64))'
+        output = cryptoCommands._capture_command(
+            [sys.executable, '-c', script, '-passin', 'pass:secret', '-subj', 'pass:kept'])
+        self.assertRegex(output.decode(), r"^fd:\d+ b'secret\\n'")
+        command, pass_fds, pipes = cryptoCommands._pipe_passwords(
+            ['openssl', 'pkey', '-passin', 'pass:a', '-passout', 'pass:b', '-subj', 'pass:c'], (7,))
+        try:
+            self.assertEqual(command[2:5:2], ['-passin', '-passout'])
+            self.assertEqual(command[3], 'fd:{0}'.format(pipes[0]))
+            self.assertEqual(command[5], 'fd:{0}'.format(pipes[1]))
+            self.assertEqual(command[7], 'pass:c')
+            self.assertEqual(pass_fds, (7,) + tuple(pipes))
+            self.assertEqual(os.read(pipes[1], 64), b'b\n')
+        finally:
+            for fd in pipes:
+                os.close(fd)
+
+    def test_password_file_is_read_once(self):
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(return_value=True)
+        filehandler.read = MagicMock(return_value='secret\nignored\n')
+        cryptoCommands = CryptoCommands(filehandler=filehandler)
+        for name in ['user1', 'user2']:
+            user = User(name=name, protected=True, password_file='/test/password.txt',
+                        key_name='a.key', request_name='r.csr', cert_name='c.crt')
+            self.assertEqual(cryptoCommands._access_password(user), 'pass:secret')
+        filehandler.read.assert_called_once_with('/test/password.txt')
+        filehandler.read = MagicMock(return_value=None)
+        user.password_file = '/test/unreadable.txt'
+        self.assertFalse(cryptoCommands._access_password(user))
+
+    def test_valid_generate_ed25519_key(self):
+        user = User(name='test', dir='/test/dir', key_name='a.key',
+                    request_name='r.csr',
+                    cert_name='c.crt',
+                    protected=True,
+                    password='secret',
+                    key_type='ed25519')
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(return_value=True)
+        filehandler.replace = MagicMock(return_value=True)
+        cryptoCommands = CryptoCommands(filehandler=filehandler)
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        self.assertTrue(cryptoCommands.generate_key(user, True))
+        command = cryptoCommands._execute_command.call_args[0][0]
+        self.assertEqual(command[1], 'genpkey')
+        self.assertEqual(command[4:], ['-algorithm', 'ED25519', '-des3', '-pass', 'pass:secret'])
+        self.assertTrue(cryptoCommands.generate_csr(user, True))
+        command = cryptoCommands._execute_command.call_args[0][0]
+        self.assertEqual(command[7:], ['-key', '/test/dir/keys/a.key', '-passin', 'pass:secret'])
+
+    def test_invalid_key_type(self):
+        user = User(name='test', dir='/test/dir', key_name='a.key',
+                    request_name='r.csr',
+                    cert_name='c.crt')
+        user.key_type = 'dsa'
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(return_value=False)
+        cryptoCommands = CryptoCommands(filehandler=filehandler)
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        self.assertFalse(cryptoCommands.generate_key(user))
+        cryptoCommands._execute_command.assert_not_called()
 
     def test_valid_generate_csr(self):
         filehandler = FileHandler()
@@ -78,6 +202,7 @@ class Test_CryptoCommands(unittest.TestCase):
                 return True
             return False
         filehandler.file_exists = MagicMock(side_effect=test_file_exists)
+        filehandler.replace = MagicMock(return_value=True)
         cryptoCommands = CryptoCommands(filehandler=filehandler)
         cryptoCommands._execute_command = MagicMock(return_value=True)
         user = User(name='test',
@@ -100,12 +225,14 @@ class Test_CryptoCommands(unittest.TestCase):
         self.assertEqual(commands[0][0][1], 'req')
         self.assertEqual(commands[0][0][2], '-new')
         self.assertEqual(commands[0][0][3], '-out')
-        self.assertEqual(commands[0][0][4], '/test/dir/csrs/r.csr')
+        self.assertTrue(commands[0][0][4].startswith('/test/dir/csrs/r.csr.'))
+        filehandler.replace.assert_called_with(commands[0][0][4], '/test/dir/csrs/r.csr')
         self.assertEqual(commands[0][0][5], '-subj')
         self.assertEqual(commands[0][0][6],
                          '/C=US/ST=State/L=City/O=Company/OU=Dept/CN=USER1/emailAddress=user@_unknown_.com/')
         self.assertEqual(commands[0][0][7], '-key')
         self.assertEqual(commands[0][0][8], '/test/dir/keys/a.key')
+        self.assertEqual(commands[0][0][9], '-sha256')
 
     def test_valid_generate_ca_certificate(self):
         filehandler = FileHandler()
@@ -115,6 +242,7 @@ class Test_CryptoCommands(unittest.TestCase):
                 return True
             return False
         filehandler.file_exists = MagicMock(side_effect=test_file_exists)
+        filehandler.replace = MagicMock(return_value=True)
         cryptoCommands = CryptoCommands(filehandler=filehandler)
         cryptoCommands._execute_command = MagicMock(return_value=True)
         ca = CA(name='test_ca_generate',
@@ -147,8 +275,8 @@ class Test_CryptoCommands(unittest.TestCase):
         self.assertEqual(commands[0][0][8], '-days')
         self.assertEqual(commands[0][0][9], '10000')
         self.assertEqual(commands[0][0][10], '-out')
-        self.assertEqual(commands[0][0][11],
-                         '/test/dir/ca/crts/c.crt')
+        self.assertTrue(commands[0][0][11].startswith('/test/dir/ca/crts/c.crt.'))
+        filehandler.replace.assert_called_with(commands[0][0][11], '/test/dir/ca/crts/c.crt')
 
     def test_valid_sign_certificate(self):
         filehandler = FileHandler()
@@ -161,7 +289,10 @@ class Test_CryptoCommands(unittest.TestCase):
                 return True
             return False
         filehandler.file_exists = MagicMock(side_effect=test_file_exists)
-        cryptoCommands = CryptoCommands(filehandler=filehandler)
+        serials = MagicMock()
+        serials.next = MagicMock(return_value=31)
+        filehandler.replace = MagicMock(return_value=True)
+        cryptoCommands = CryptoCommands(filehandler=filehandler, serials=serials)
         cryptoCommands._execute_command = MagicMock(return_value=True)
         user = User(name='test',
                     bits=1,
@@ -197,21 +328,469 @@ class Test_CryptoCommands(unittest.TestCase):
         self.assertEqual(commands[0][0][0], '/usr/bin/openssl')
         self.assertEqual(commands[0][0][1], 'x509')
         self.assertEqual(commands[0][0][2], '-req')
-        self.assertEqual(commands[0][0][3], '-CAcreateserial')
-        self.assertEqual(commands[0][0][4], '-in')
-        self.assertEqual(commands[0][0][5],
+        self.assertEqual(commands[0][0][3], '-set_serial')
+        self.assertEqual(commands[0][0][4], '0x1F')
+        self.assertEqual(commands[0][0][5], '-in')
+        self.assertEqual(commands[0][0][6],
                          '/test/dir/csrs/r.csr')
-        self.assertEqual(commands[0][0][6], '-CA')
-        self.assertEqual(commands[0][0][7],
+        self.assertEqual(commands[0][0][7], '-CA')
+        self.assertEqual(commands[0][0][8],
                          '/test/dir/ca/crts/ca.crt')
-        self.assertEqual(commands[0][0][8], '-CAkey')
-        self.assertEqual(commands[0][0][9],
+        self.assertEqual(commands[0][0][9], '-CAkey')
+        self.assertEqual(commands[0][0][10],
                          '/test/dir/ca/keys/ca.key')
-        self.assertEqual(commands[0][0][10], '-out')
-        self.assertEqual(commands[0][0][11],
-                         '/test/dir/crts/c.crt')
-        self.assertEqual(commands[0][0][12], '-days')
-        self.assertEqual(commands[0][0][13], '1200')
+        self.assertEqual(commands[0][0][11], '-out')
+        self.assertTrue(commands[0][0][12].startswith('/test/dir/crts/c.crt.'))
+        filehandler.replace.assert_called_with(commands[0][0][12], '/test/dir/crts/c.crt')
+        self.assertEqual(commands[0][0][13], '-days')
+        self.assertEqual(commands[0][0][14], '1200')
+        self.assertEqual(commands[0][0][15], '-sha256')
+        serials.next.assert_called_with(ca)
+        user.message_digest = 'sha384'
+        ca.key_type = 'ed25519'
+        self.assertTrue(cryptoCommands.sign_certificate(user, True, ca))
+        self.assertEqual(len(cryptoCommands._execute_command.call_args[0][0]), 15)
+
+    def test_generate_parallel(self):
+        cryptoCommands = CryptoCommands()
+        calls = []
+
+        def record(step):
+            def action(user, *args, **kwargs):
+                calls.append((user.name, step))
+                return True
+            return action
+        cryptoCommands.generate_key = MagicMock(side_effect=record('key'))
+        cryptoCommands.generate_csr = MagicMock(side_effect=record('csr'))
+        cryptoCommands.generate_ca_certificate = MagicMock(
+            side_effect=record('ca_crt'))
+        cryptoCommands.sign_certificate = MagicMock(side_effect=record('crt'))
+        ca = CA(name='ca', key_name='ca.key',
+                request_name='ca.csr', cert_name='ca.crt')
+        users = {}
+        for i in range(20):
+            name = 'user{0}'.format(i)
+            users[name] = User(name=name, key_name='a.key',
+                               request_name='r.csr', cert_name='c.crt')
+        cryptoCommands.generate({'all': True, 'jobs': 4},
+                                {'ca': {'ca': ca}, 'users': users})
+        self.assertEqual(len(calls), 63)
+        ca_steps = [step for user, step in calls if user == 'ca']
+        self.assertEqual(ca_steps, ['key', 'csr', 'ca_crt'])
+        for name in users:
+            steps = [step for user, step in calls if user == name]
+            self.assertEqual(steps, ['key', 'csr', 'crt'])
+            self.assertGreater(calls.index((name, 'crt')),
+                               calls.index(('ca', 'ca_crt')))
+        for call in cryptoCommands.sign_certificate.call_args_list:
+            self.assertIs(call[0][2], ca)
+
+    def test_generate_routes_users_to_their_ca(self):
+        cryptoCommands = CryptoCommands()
+        cryptoCommands.generate_ca_certificate = MagicMock(return_value=True)
+        cryptoCommands.sign_certificate = MagicMock(return_value=True)
+        cas = {}
+        for name in ['ca1', 'ca2', 'ca3']:
+            cas[name] = CA(name=name, key_name='ca.key', request_name='ca.csr',
+                           cert_name='{0}.crt'.format(name))
+        users = {}
+        for name, signing_ca in [('user1', 'ca1'), ('user2', None), ('user3', 'ca1'),
+                                 ('user4', 'missing')]:
+            users[name] = User(name=name, key_name='a.key', request_name='r.csr',
+                               cert_name='c.crt', signing_ca=signing_ca)
+        results = cryptoCommands.generate({'sign': True},
+                                          {'ca': cas, 'users': users}, 'group')
+        signed = {call[0][0].name: call[0][2] for call in
+                  cryptoCommands.sign_certificate.call_args_list}
+        self.assertEqual(signed, {'user1': cas['ca1'], 'user2': cas['ca3'],
+                                  'user3': cas['ca1'], 'user4': None})
+        sessions = {call[0][0].name: call[0][3] for call in
+                    cryptoCommands.sign_certificate.call_args_list}
+        self.assertIs(sessions['user1'], sessions['user3'])
+        self.assertIsNot(sessions['user1'], sessions['user2'])
+        self.assertEqual(results[('group', 'user1', 'crt')], 'succeeded')
+        cryptoCommands.sign_certificate.reset_mock()
+        cryptoCommands.generate({'sign': True, 'ca': 'ca2'},
+                                {'ca': cas, 'users': users}, 'group')
+        signed = {call[0][0].name: call[0][2] for call in
+                  cryptoCommands.sign_certificate.call_args_list}
+        self.assertIs(signed['user1'], cas['ca1'])
+        self.assertIs(signed['user2'], cas['ca2'])
+
+    def test_generate_failure_skips_user_steps(self):
+        cryptoCommands = CryptoCommands()
+        cryptoCommands.generate_key = MagicMock(
+            side_effect=lambda user, *args: user.name != 'user1')
+        cryptoCommands.generate_csr = MagicMock(return_value=True)
+        cryptoCommands.sign_certificate = MagicMock(return_value=True)
+        users = {}
+        for name in ['user1', 'user2']:
+            users[name] = User(name=name, key_name='a.key',
+                               request_name='r.csr', cert_name='c.crt')
+        results = cryptoCommands.generate({'key': True, 'req': True},
+                                          {'users': users}, 'group')
+        self.assertEqual(results[('group', 'user1', 'key')], 'failed')
+        self.assertEqual(results[('group', 'user1', 'csr')], 'skipped')
+        self.assertEqual(results[('group', 'user2', 'csr')], 'succeeded')
+        self.assertEqual(cryptoCommands.generate_csr.call_count, 1)
+        cryptoCommands.sign_certificate.assert_not_called()
+
+    def test_backend(self):
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(
+            side_effect=lambda location: location.endswith(('.csr', 'ca.key', 'ca.crt')))
+        backend = MagicMock()
+        backend.open_signing_context = MagicMock(return_value='context')
+        backend.sign_with_context = MagicMock(return_value=True)
+        serials = MagicMock()
+        serials.next = MagicMock(return_value=7)
+        cryptoCommands = CryptoCommands(filehandler=filehandler,
+                                        backend=backend,
+                                        serials=serials)
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        user = User(name='test', key_name='a.key',
+                    request_name='r.csr', cert_name='c.crt')
+        ca = CA(name='ca', protected=True, password='secret',
+                key_name='ca.key', request_name='ca.csr', cert_name='ca.crt')
+        self.assertTrue(cryptoCommands.sign_certificate(user, False, ca))
+        backend.open_signing_context.assert_called_with(ca, 'pass:secret')
+        backend.sign_with_context.assert_called_with(user, 'context', serial=7)
+        cryptoCommands._execute_command.assert_not_called()
+
+    def test_signing_session_loads_ca_once(self):
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(
+            side_effect=lambda location: location.endswith(('.csr', 'ca.key', 'ca.crt')))
+        filehandler.replace = MagicMock(return_value=True)
+        cryptoCommands = CryptoCommands(filehandler=filehandler)
+        cryptoCommands._capture_command = MagicMock(return_value=b'decrypted')
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        ca = CA(name='ca', protected=True, password='secret', ca_dir='/ca',
+                key_name='ca.key', request_name='ca.csr', cert_name='ca.crt')
+        session = cryptoCommands.open_signing_session(ca)
+        for i in range(3):
+            user = User(name='user{0}'.format(i), dir='/users',
+                        key_name='a.key', request_name='r{0}.csr'.format(i),
+                        cert_name='c{0}.crt'.format(i))
+            self.assertTrue(cryptoCommands.sign_certificate(
+                user, False, ca, session))
+        self.assertEqual(cryptoCommands._capture_command.call_count, 1)
+        self.assertEqual(cryptoCommands._capture_command.call_args[0][0],
+                         ['/usr/bin/openssl', 'pkey', '-in', '/ca/keys/ca.key',
+                          '-passin', 'pass:secret'])
+        self.assertEqual(cryptoCommands._execute_command.call_count, 3)
+        command = cryptoCommands._execute_command.call_args[0][0]
+        self.assertNotIn('-passin', command)
+        self.assertTrue(command[command.index('-CAkey') + 1].startswith('/dev/fd/'))
+
+    def test_generate_key_from_pool(self):
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(return_value=False)
+        key_pool = MagicMock()
+        key_pool.take = MagicMock(return_value='/pool/2048/a.key.claimed')
+        key_pool.password = 'file:/pool/pool.pass'
+        filehandler.replace = MagicMock(return_value=True)
+        cryptoCommands = CryptoCommands(filehandler=filehandler,
+                                        key_pool=key_pool)
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        user = User(name='test', dir='/test/dir', protected=True,
+                    password='secret', key_name='a.key',
+                    request_name='r.csr', cert_name='c.crt')
+        with patch('os.remove') as remove:
+            self.assertTrue(cryptoCommands.generate_key(user))
+            remove.assert_any_call('/pool/2048/a.key.claimed')
+        key_pool.take.assert_called_with(2048)
+        command = cryptoCommands._execute_command.call_args[0][0]
+        self.assertEqual(command[:7] + command[8:],
+                         ['/usr/bin/openssl', 'pkey',
+                          '-in', '/pool/2048/a.key.claimed',
+                          '-passin', 'file:/pool/pool.pass',
+                          '-out',
+                          '-des3', '-passout', 'pass:secret'])
+        filehandler.replace.assert_called_with(command[7], '/test/dir/keys/a.key')
+        key_pool.take = MagicMock(return_value=None)
+        self.assertTrue(cryptoCommands.generate_key(user))
+        self.assertEqual(cryptoCommands._execute_command.call_args[0][0][1],
+                         'genrsa')
+
+    def _writing(self, attribute):
+        """
+        Returns a mock of a step writing the file of the user, like the
+        steps do, unless it exists and overwrite is False.
+        """
+
+        def write(user, overwrite=False, *args):
+            location = getattr(user, attribute)
+            if overwrite or not os.path.exists(location):
+                os.makedirs(os.path.dirname(location), exist_ok=True)
+                with open(location + '.tmp', 'w') as f:
+                    f.write(str(user.common_name))
+                os.replace(location + '.tmp', location)
+            return True
+        return MagicMock(side_effect=write)
+
+    def _manifest_commands(self, directory):
+        cryptoCommands = CryptoCommands(manifest=BuildManifest('/unused/manifest.json'))
+        cryptoCommands.generate_key = self._writing('key_file')
+        cryptoCommands.generate_csr = self._writing('certificate_signing_request_file')
+        users = {'user1': User(name='user1', common_name='user1', key_name='a.key',
+                               request_name='r.csr', cert_name='c.crt', dir=directory)}
+        return cryptoCommands, users
+
+    def test_generate_skips_up_to_date_users(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cryptoCommands, users = self._manifest_commands(directory)
+            results = cryptoCommands.generate({'key': True, 'req': True},
+                                              {'users': users}, 'group')
+            self.assertEqual(len(results), 2)
+            results = cryptoCommands.generate({'key': True, 'req': True},
+                                              {'users': users}, 'group')
+            self.assertEqual(results, {})
+            self.assertEqual(cryptoCommands.generate_key.call_count, 1)
+            results = cryptoCommands.generate({'key': True, 'req': True, 'overwrite': True},
+                                              {'users': users}, 'group')
+            self.assertEqual(len(results), 2)
+            users['user1'].bits = 4096
+            results = cryptoCommands.generate({'key': True},
+                                              {'users': users}, 'group')
+            self.assertEqual(len(results), 1)
+
+    def test_generate_reissues_changed_steps(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cryptoCommands, users = self._manifest_commands(directory)
+            parameters = {'key': True, 'req': True, 'reissue_changed': True}
+            cryptoCommands.generate(parameters, {'users': users}, 'group')
+            cryptoCommands.generate_key.assert_called_once_with(users['user1'], False)
+            cryptoCommands.generate_csr.assert_called_once_with(users['user1'], False)
+            users['user1'].common_name = 'changed'
+            cryptoCommands.generate(parameters, {'users': users}, 'group')
+            cryptoCommands.generate_key.assert_called_with(users['user1'], False)
+            cryptoCommands.generate_csr.assert_called_with(users['user1'], True)
+            with open(users['user1'].certificate_signing_request_file) as f:
+                self.assertEqual(f.read(), 'changed')
+
+    def test_generate_reissues_existing_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cryptoCommands, users = self._manifest_commands(directory)
+            manifest = cryptoCommands.manifest
+            csr = users['user1'].certificate_signing_request_file
+            cryptoCommands.generate({'key': True, 'req': True}, {'users': users}, 'group')
+            # -- A run without reissue_changed keeps the existing request --
+            # -- and the fingerprint it was generated with. --
+            users['user1'].common_name = 'changed'
+            cryptoCommands.generate({'key': True, 'req': True}, {'users': users}, 'group')
+            with open(csr) as f:
+                self.assertEqual(f.read(), 'user1')
+            cryptoCommands.generate({'key': True, 'req': True, 'reissue_changed': True},
+                                    {'users': users}, 'group')
+            with open(csr) as f:
+                self.assertEqual(f.read(), 'changed')
+            self.assertEqual(cryptoCommands.generate({'key': True, 'req': True},
+                                                     {'users': users}, 'group'), {})
+
+            # -- Files that existed before the manifest are not recorded, --
+            # -- unless adopted. --
+            users['user2'] = User(name='user2', common_name='user2', key_name='b.key',
+                                  request_name='s.csr', cert_name='d.crt', dir=directory)
+            cryptoCommands.generate_key(users['user2'])
+            cryptoCommands.generate_csr(users['user2'])
+            cryptoCommands.generate({'key': True, 'req': True}, {'users': users}, 'group')
+            self.assertFalse(manifest.is_recorded('group/users/user2', 'csr'))
+            cryptoCommands.generate({'key': True, 'req': True, 'adopt_existing': True},
+                                    {'users': users}, 'group')
+            self.assertTrue(manifest.is_recorded('group/users/user2', 'csr'))
+
+    def test_generate_resumes_from_journal(self):
+        journal = MagicMock(resuming=True)
+        journal.is_done = MagicMock(
+            side_effect=lambda entity_id, step, location:
+                entity_id == 'group/users/user1' or step == 'key')
+        journal.is_untrusted = MagicMock(
+            side_effect=lambda location: location == '/users/csrs/user2.csr')
+        cryptoCommands = CryptoCommands(journal=journal)
+        cryptoCommands.generate_key = MagicMock(return_value=True)
+        cryptoCommands.generate_csr = MagicMock(return_value=True)
+        cryptoCommands.sign_certificate = MagicMock(return_value=True)
+        users = {}
+        for name in ['user1', 'user2', 'user3']:
+            users[name] = User(name=name, dir='/users', key_name='{0}.key'.format(name),
+                               request_name='{0}.csr'.format(name),
+                               cert_name='{0}.crt'.format(name))
+        results = cryptoCommands.generate({'key': True, 'req': True},
+                                          {'users': users}, 'group')
+        self.assertNotIn(('group', 'user1', 'key'), results)
+        self.assertEqual(results[('group', 'user2', 'key')], 'succeeded')
+        cryptoCommands.generate_key.assert_not_called()
+        cryptoCommands.generate_csr.assert_any_call(users['user2'], True)
+        cryptoCommands.generate_csr.assert_any_call(users['user3'], False)
+        self.assertEqual(cryptoCommands.generate_csr.call_count, 2)
+        journal.record.assert_any_call('group/users/user2', 'csr', '/users/csrs/user2.csr')
+        self.assertEqual(journal.record.call_count, 2)
+
+    def test_generate_records_metrics(self):
+        metrics = Metrics()
+        cryptoCommands = CryptoCommands(metrics=metrics)
+        process = MagicMock(returncode=0)
+        process.communicate = MagicMock(return_value=(b'', None))
+        users = {'user1': User(name='user1', key_name='a.key',
+                               request_name='r.csr', cert_name='c.crt', dir='/unused')}
+        with patch('subprocess.Popen', return_value=process):
+            cryptoCommands.generate({'key': True, 'overwrite': True},
+                                    {'users': users}, 'group')
+        summary = metrics.summary()
+        self.assertEqual(summary['steps']['key']['count'], 1)
+        self.assertEqual(summary['steps']['key']['exit_codes'], {'0': 1})
+        self.assertEqual(summary['steps']['key']['slowest'][0]['entity'],
+                         'group/users/user1')
+        self.assertEqual(summary['commands']['genrsa']['count'], 1)
+
+    def test_generate_async(self):
+        metrics = Metrics()
+        filehandler = FileHandler()
+        filehandler.replace = MagicMock(return_value=True)
+        cryptoCommands = CryptoCommands(filehandler=filehandler, metrics=metrics, max_processes=2)
+        commands = []
+        running = []
+        peak = []
+
+        async def execute(*command, **kwargs):
+            commands.append(command)
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+            process = MagicMock(returncode=0)
+
+            async def communicate():
+                return (b'', None)
+            process.communicate = communicate
+            return process
+        users = {}
+        for i in range(5):
+            name = 'user{0}'.format(i)
+            users[name] = User(name=name, key_name='a.key', request_name='r.csr',
+                               cert_name='c.crt', dir='/unused')
+        loop = asyncio.new_event_loop()
+        try:
+            with patch('asyncio.create_subprocess_exec', side_effect=execute):
+                results = loop.run_until_complete(cryptoCommands.generate_async(
+                    {'key': True, 'overwrite': True, 'jobs': 5}, {'users': users}, 'group'))
+        finally:
+            loop.close()
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(state == 'succeeded' for state in results.values()))
+        self.assertEqual(len(commands), 5)
+        self.assertEqual(commands[0][1], 'genrsa')
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(metrics.summary()['steps']['key']['exit_codes'], {'0': 5})
+
+    def test_generate_batch_sign(self):
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(
+            side_effect=lambda location: location.endswith(('.csr', 'ca.key', 'ca.crt')))
+        filehandler.write_bytes = MagicMock(return_value=True)
+        cryptoCommands = CryptoCommands(filehandler=filehandler)
+        certificates = b''.join(
+            '-----BEGIN CERTIFICATE-----\n{0}\n-----END CERTIFICATE-----\n'.format(i).encode()
+            for i in range(3))
+        cryptoCommands._capture_command = MagicMock(return_value=certificates)
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        ca = CA(name='ca', ca_dir='/ca', ca_conf='/ca/openssl.cnf',
+                key_name='ca.key', request_name='ca.csr', cert_name='ca.crt')
+        users = {}
+        for i in range(3):
+            name = 'user{0}'.format(i)
+            users[name] = User(name=name, dir='/users', key_name='a.key',
+                               request_name='{0}.csr'.format(name),
+                               cert_name='{0}.crt'.format(name))
+        results = cryptoCommands.generate({'sign': True, 'batch_sign': True},
+                                          {'ca': {'ca': ca}, 'users': users}, 'group')
+        for name in users:
+            self.assertEqual(results[('group', name, 'crt')], 'succeeded')
+        self.assertEqual(cryptoCommands._capture_command.call_count, 1)
+        command = cryptoCommands._capture_command.call_args[0][0]
+        self.assertEqual(command[1], 'ca')
+        self.assertEqual(command[command.index('-config') + 1], '/ca/openssl.cnf')
+        self.assertEqual(command[command.index('-md') + 1], 'sha256')
+        self.assertEqual(command[command.index('-infiles') + 1:],
+                         ['/users/csrs/user0.csr', '/users/csrs/user1.csr', '/users/csrs/user2.csr'])
+        written = [call[0] for call in filehandler.write_bytes.call_args_list]
+        self.assertEqual(written[0][0], '/users/crts/user0.crt')
+        self.assertIn(b'\n0\n', written[0][1])
+        self.assertEqual(written[2][0], '/users/crts/user2.crt')
+        self.assertIn(b'\n2\n', written[2][1])
+        cryptoCommands._execute_command.assert_not_called()
+
+    def test_generate_batch_sign_falls_back(self):
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(
+            side_effect=lambda location: location.endswith(('.csr', 'ca.key', 'ca.crt')))
+        filehandler.replace = MagicMock(return_value=True)
+        cryptoCommands = CryptoCommands(filehandler=filehandler)
+        cryptoCommands._capture_command = MagicMock(return_value=None)
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        ca = CA(name='ca', ca_dir='/ca', ca_conf='/ca/openssl.cnf',
+                key_name='ca.key', request_name='ca.csr', cert_name='ca.crt')
+        users = {}
+        for name in ['user1', 'user2']:
+            users[name] = User(name=name, dir='/users', key_name='a.key',
+                               request_name='{0}.csr'.format(name),
+                               cert_name='{0}.crt'.format(name))
+        results = cryptoCommands.generate({'sign': True, 'batch_sign': True},
+                                          {'ca': {'ca': ca}, 'users': users}, 'group')
+        self.assertEqual(results[('group', 'user1', 'crt')], 'succeeded')
+        self.assertEqual(results[('group', 'user2', 'crt')], 'succeeded')
+        self.assertEqual(cryptoCommands._execute_command.call_count, 2)
+        self.assertEqual(cryptoCommands._execute_command.call_args[0][0][1], 'x509')
+
+    def test_generate_plan(self):
+        files = {'/users/keys/user2.key'}
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(side_effect=lambda location: location in files)
+        filehandler.mark_written = MagicMock(side_effect=files.add)
+        plan = Plan()
+        cryptoCommands = CryptoCommands(filehandler=filehandler, metrics=Metrics(), plan=plan)
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        cryptoCommands._capture_command = MagicMock(return_value=b'decrypted')
+        users = {}
+        for name in ['user1', 'user2']:
+            users[name] = User(name=name, dir='/users', key_name='{0}.key'.format(name),
+                               request_name='{0}.csr'.format(name),
+                               cert_name='{0}.crt'.format(name))
+        results = cryptoCommands.generate({'key': True, 'req': True},
+                                          {'users': users}, 'group')
+        self.assertTrue(all(state == 'succeeded' for state in results.values()))
+        cryptoCommands._execute_command.assert_not_called()
+        cryptoCommands._capture_command.assert_not_called()
+        self.assertEqual([(step, entity, command[1]) for step, entity, command in plan.operations],
+                         [('key', 'group/users/user1', 'genrsa'),
+                          ('csr', 'group/users/user1', 'req'),
+                          ('csr', 'group/users/user2', 'req')])
+
+    def test_plan_protected_ca(self):
+        filehandler = FileHandler()
+        filehandler.file_exists = MagicMock(
+            side_effect=lambda location: location.endswith(('.csr', 'ca.key', 'ca.crt')))
+        plan = Plan()
+        cryptoCommands = CryptoCommands(filehandler=filehandler, plan=plan)
+        cryptoCommands._execute_command = MagicMock(return_value=True)
+        cryptoCommands._capture_command = MagicMock(return_value=b'decrypted')
+        ca = CA(name='ca', protected=True, password='secret', ca_dir='/ca',
+                key_name='ca.key', request_name='ca.csr', cert_name='ca.crt')
+        user = User(name='user1', dir='/users', key_name='a.key',
+                    request_name='r.csr', cert_name='c.crt')
+        session = cryptoCommands.open_signing_session(ca)
+        self.assertTrue(cryptoCommands.sign_certificate(user, False, ca, session))
+        cryptoCommands._capture_command.assert_not_called()
+        cryptoCommands._execute_command.assert_not_called()
+        # -- The key is decrypted once, then given to openssl x509 through a pipe. --
+        commands = [command for _, _, command in plan.operations]
+        self.assertEqual(commands[0],
+                         ['/usr/bin/openssl', 'pkey', '-in', '/ca/keys/ca.key',
+                          '-passin', 'pass:*********'])
+        self.assertEqual(commands[1][1], 'x509')
+        self.assertTrue(commands[1][commands[1].index('-CAkey') + 1].startswith('/dev/fd/'))
+        self.assertEqual(len(commands), 2)
 
 
 if __name__ == '__main__':
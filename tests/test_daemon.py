@@ -0,0 +1,90 @@
+from certautomator.daemon import Daemon
+from certautomator.utils_parser import Utils_Parser
+import json
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+from unittest.mock import patch
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+class Test_Daemon(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._config = os.path.join(self._dir.name, 'config.json')
+        with open(self._config, 'w') as f:
+            json.dump({'group': {
+                'ssl_defaults': {'user_dir': os.path.join(self._dir.name, 'users'),
+                                 'ca_dir': os.path.join(self._dir.name, 'ca')},
+                'name_defaults': {'country': 'US'},
+                'users': {'user1': {'common_name': 'USER1', 'key_name': 'a.key',
+                                    'cert_name': 'a.crt', 'cert_request_name': 'a.csr'}}}}, f)
+        self._crypto_commands = MagicMock()
+        self._crypto_commands.add_ca_tasks = MagicMock(return_value={})
+        self._issued = []
+
+        def add_user_tasks(scheduler, parameters, users, group_key, issuers):
+            for name, user in users.items():
+                def write(user=user):
+                    self._issued.append((group_key, user.name, parameters['overwrite']))
+                    with open(user.certificate_file, 'w') as f:
+                        f.write('certificate of {0}'.format(user.common_name))
+                    return True
+                scheduler.add_task((group_key, name, 'crt'), write)
+        self._crypto_commands.add_user_tasks = MagicMock(side_effect=add_user_tasks)
+        self._daemon = Daemon(self._crypto_commands, self._config, {'jobs': 1})
+
+    def tearDown(self):
+        self._daemon.close()
+        self._dir.cleanup()
+
+    def test_handle(self):
+        self.assertTrue(self._daemon.load())
+        self._crypto_commands.add_ca_tasks.assert_called_once()
+        response = self._daemon.handle({'command': 'issue', 'group': 'group', 'user': 'user1'})
+        self.assertEqual(response['status'], 'ok')
+        self.assertEqual(response['certificate'], 'certificate of USER1')
+        self.assertTrue(response['key_file'].endswith('a.key'))
+        # -- Only the user is parsed, not its group. --
+        with patch.object(Utils_Parser, 'parse') as parse:
+            response = self._daemon.handle({'command': 'issue', 'group': 'group', 'user': 'user2',
+                                            'values': {'common_name': 'USER2', 'key_name': 'b.key',
+                                                       'cert_name': 'b.crt', 'cert_request_name': 'b.csr'},
+                                            'overwrite': True})
+        parse.assert_not_called()
+        self.assertEqual(response['certificate'], 'certificate of USER2')
+        self.assertEqual(self._issued, [('group', 'user1', False), ('group', 'user2', True)])
+        self.assertEqual(self._daemon.handle({'command': 'status'}),
+                         {'status': 'ok', 'groups': 1, 'users': 1, 'issued': 2})
+        for request in [{'command': 'issue', 'group': 'other', 'user': 'user1'},
+                        {'command': 'issue', 'group': 'group', 'user': 'unknown'},
+                        {'command': 'issue', 'group': 'group'},
+                        {'command': 'unknown'},
+                        []]:
+            self.assertEqual(self._daemon.handle(request)['status'], 'error')
+
+    def test_socket(self):
+        socket_path = os.path.join(self._dir.name, 'daemon.sock')
+        self.assertTrue(self._daemon.load())
+        self.assertTrue(self._daemon.listen(socket_path))
+        self.assertEqual(os.stat(socket_path).st_mode & 0o777, 0o600)
+        server = threading.Thread(target=self._daemon.serve)
+        server.start()
+        try:
+            response = Daemon.send(socket_path, {'command': 'issue', 'group': 'group', 'user': 'user1'})
+            self.assertEqual(response['certificate'], 'certificate of USER1')
+            self.assertEqual(Daemon.send(socket_path, {'command': 'stop'}), {'status': 'ok'})
+        finally:
+            server.join(5)
+        self.assertFalse(server.is_alive())
+        self._daemon.close()
+        self.assertFalse(os.path.exists(socket_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
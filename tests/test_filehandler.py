@@ -1,5 +1,7 @@
 
 from certautomator.utils import FileHandler
+from certautomator.utils import SnapshotFileHandler
+import tempfile
 import unittest
 from unittest.mock import MagicMock
 from unittest.mock import patch
@@ -95,5 +97,43 @@ class Test_TestFileHandler(unittest.TestCase):
         result = fileHandler.write('sample_path','random_data')
         self.assertFalse(result)
 
+    def test_snapshot_file_exists(self):
+        with tempfile.TemporaryDirectory() as directory:
+            existing = os.path.join(directory, 'a.key')
+            with open(existing, 'w') as f:
+                f.write('key')
+            os.mkdir(os.path.join(directory, 'sub'))
+            fileHandler = SnapshotFileHandler()
+            with patch('os.scandir', wraps=os.scandir) as scandir:
+                self.assertTrue(fileHandler.file_exists(existing))
+                self.assertFalse(fileHandler.file_exists(os.path.join(directory, 'b.key')))
+                self.assertFalse(fileHandler.file_exists(os.path.join(directory, 'sub')))
+                self.assertFalse(fileHandler.file_exists(os.path.join(directory, 'missing', 'c.key')))
+                self.assertEqual(scandir.call_count, 2)
+            written = os.path.join(directory, 'b.key')
+            self.assertTrue(fileHandler.write_bytes(written, b'key'))
+            self.assertTrue(fileHandler.file_exists(written))
+            # -- Written by another process, e.g. openssl. --
+            with open(os.path.join(directory, 'c.key'), 'w') as f:
+                f.write('key')
+            self.assertFalse(fileHandler.file_exists(os.path.join(directory, 'c.key')))
+            fileHandler.mark_written(os.path.join(directory, 'c.key'))
+            self.assertTrue(fileHandler.file_exists(os.path.join(directory, 'c.key')))
+
+    def test_write_bytes_replaces_atomically(self):
+        with tempfile.TemporaryDirectory() as directory:
+            written = os.path.join(directory, 'a.key')
+            fileHandler = FileHandler()
+            self.assertTrue(fileHandler.write_bytes(written, b'old'))
+            with patch('os.fdopen', side_effect=OSError()):
+                self.assertFalse(fileHandler.write_bytes(written, b'new'))
+            with open(written, 'rb') as f:
+                self.assertEqual(f.read(), b'old')
+            self.assertEqual(os.listdir(directory), ['a.key'])
+            self.assertTrue(fileHandler.write_bytes(written, b'new', permissions=0o644))
+            with open(written, 'rb') as f:
+                self.assertEqual(f.read(), b'new')
+            self.assertEqual(os.stat(written).st_mode & 0o777, 0o644)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+from certautomator.journal import Journal
+import json
+import tempfile
+import time
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+class Test_Journal(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._dir.name, 'journal')
+        self._key = self._write('a.key', b'key')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, name, content):
+        location = os.path.join(self._dir.name, name)
+        with open(location, 'wb') as f:
+            f.write(content)
+        return location
+
+    def test_record_and_resume(self):
+        journal = Journal(self._filename)
+        self.assertTrue(journal.open())
+        self.assertFalse(journal.resuming)
+        journal.record('group/users/a', 'key', self._key)
+        # -- Interrupted: not closed, the last line is cut short. --
+        with open(self._filename, 'a') as f:
+            f.write('{"entity": "group/users/a", "st')
+        resumed = Journal(self._filename)
+        self.assertTrue(resumed.load())
+        self.assertTrue(resumed.open(resume=True))
+        self.assertTrue(resumed.resuming)
+        self.assertTrue(resumed.is_done('group/users/a', 'key', self._key))
+        self.assertFalse(resumed.is_done('group/users/a', 'csr', self._key))
+        self._write('a.key', b'truncated')
+        self.assertFalse(resumed.is_done('group/users/a', 'key', self._key))
+        self.assertTrue(resumed.is_untrusted(self._key))
+        self.assertFalse(resumed.is_untrusted(os.path.join(self._dir.name, 'missing')))
+        resumed.close()
+
+    def test_finished_run_is_not_resumed(self):
+        journal = Journal(self._filename)
+        journal.open()
+        journal.record('group/users/a', 'key', self._key)
+        journal.close()
+        with open(self._filename) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([sorted(line) for line in lines],
+                         [['started'], ['entity', 'file', 'sha256', 'step'], ['finished']])
+        resumed = Journal(self._filename)
+        self.assertTrue(resumed.load())
+        self.assertFalse(resumed.resuming)
+        resumed.open(resume=True)
+        # -- Files written before the resumed run started are trusted. --
+        old = time.time() - 60
+        os.utime(self._key, (old, old))
+        self.assertFalse(resumed.is_untrusted(self._key))
+        self.assertTrue(resumed.is_done('group/users/a', 'key', self._key))
+        resumed.close()
+
+    def test_open_without_resume_starts_over(self):
+        journal = Journal(self._filename)
+        journal.open()
+        journal.record('group/users/a', 'key', self._key)
+        journal.close(finished=False)
+        journal = Journal(self._filename)
+        journal.load()
+        journal.open()
+        self.assertFalse(journal.is_done('group/users/a', 'key', self._key))
+        journal.close()
+        with open(self._filename) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_missing_journal(self):
+        journal = Journal(self._filename)
+        self.assertFalse(journal.load())
+        self.assertFalse(journal.resuming)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+from certautomator.key_pool import KeyPool
+import tempfile
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+def generator(filename, bits, password):
+    with open(filename, 'w') as f:
+        f.write('{0} {1}'.format(bits, password))
+    return True
+
+
+class Test_KeyPool(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._pool_dir = os.path.join(self._dir.name, 'pool')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_setup_password(self):
+        pool = KeyPool(self._pool_dir, generator)
+        self.assertTrue(pool.setup())
+        password_file = os.path.join(self._pool_dir, 'pool.pass')
+        self.assertEqual(pool.password, 'file:' + password_file)
+        self.assertEqual(oct(os.stat(password_file).st_mode & 0o777), '0o600')
+        with open(password_file) as f:
+            password = f.read()
+        self.assertTrue(pool.setup())
+        with open(password_file) as f:
+            self.assertEqual(password, f.read())
+
+    def test_fill_and_take(self):
+        pool = KeyPool(self._pool_dir, generator, size=2)
+        pool.setup()
+        self.assertIsNone(pool.take(2048))
+        self.assertTrue(pool.fill(2048))
+        self.assertEqual(pool.available(2048), 2)
+        self.assertEqual(pool.available(4096), 0)
+        key = pool.take(2048)
+        self.assertTrue(os.path.isfile(key))
+        with open(key) as f:
+            self.assertEqual(f.read(), '2048 ' + pool.password)
+        self.assertEqual(pool.available(2048), 1)
+        self.assertNotEqual(pool.take(2048), key)
+        self.assertIsNone(pool.take(2048))
+
+    def test_failed_generation(self):
+        pool = KeyPool(self._pool_dir, lambda *args: False, size=2)
+        pool.setup()
+        self.assertFalse(pool.fill(2048))
+        self.assertEqual(os.listdir(os.path.join(self._pool_dir, '2048')), [])
+
+    def test_background_refill(self):
+        pool = KeyPool(self._pool_dir, generator, size=3, jobs=2)
+        pool.setup()
+        pool.start([1024, 2048, None])
+        pool.stop(wait_until_full=True)
+        self.assertEqual(pool.available(1024), 3)
+        self.assertEqual(pool.available(2048), 3)
+        pool.take(1024)
+        pool.start([1024, 2048])
+        pool.stop(wait_until_full=True)
+        self.assertEqual(pool.available(1024), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+from certautomator.manifest import BuildManifest
+from certautomator.user import User
+import tempfile
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+STEPS = ('key', 'csr', 'crt')
+
+
+def create_user(common_name='USER1', bits=2048, days=365, key_type='rsa', curve='P-256'):
+    return User(name='user1',
+                bits=bits,
+                key_type=key_type,
+                curve=curve,
+                common_name=common_name,
+                certificate_expiration=days,
+                dir='/test/dir',
+                key_name='a.key',
+                request_name='r.csr',
+                cert_name='c.crt')
+
+
+class Test_BuildManifest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._dir.name, 'manifest.json')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_fingerprints(self):
+        fingerprints = BuildManifest.fingerprints(create_user(), STEPS)
+        self.assertEqual(fingerprints,
+                         BuildManifest.fingerprints(create_user(), STEPS))
+        changed = BuildManifest.fingerprints(create_user(common_name='USER2'), STEPS)
+        self.assertEqual(fingerprints['key'], changed['key'])
+        self.assertNotEqual(fingerprints['csr'], changed['csr'])
+        self.assertNotEqual(fingerprints['crt'], changed['crt'])
+        changed = BuildManifest.fingerprints(create_user(days=10), STEPS)
+        self.assertEqual(fingerprints['csr'], changed['csr'])
+        self.assertNotEqual(fingerprints['crt'], changed['crt'])
+        changed = BuildManifest.fingerprints(create_user(bits=4096), STEPS)
+        self.assertNotEqual(fingerprints['key'], changed['key'])
+        self.assertNotEqual(fingerprints['csr'], changed['csr'])
+        changed = BuildManifest.fingerprints(create_user(curve='P-384'), STEPS)
+        self.assertEqual(fingerprints['key'], changed['key'])
+        ec = BuildManifest.fingerprints(create_user(key_type='ec'), STEPS)
+        self.assertNotEqual(fingerprints['key'], ec['key'])
+        changed = BuildManifest.fingerprints(create_user(key_type='ec', curve='P-384'), STEPS)
+        self.assertNotEqual(ec['key'], changed['key'])
+        changed = BuildManifest.fingerprints(create_user(), STEPS, 'issuer')
+        self.assertEqual(fingerprints['csr'], changed['csr'])
+        self.assertNotEqual(fingerprints['crt'], changed['crt'])
+
+    def test_record(self):
+        manifest = BuildManifest(self._filename)
+        entity_id = BuildManifest.entity_id('group', 'users', 'user1')
+        self.assertFalse(manifest.is_up_to_date(entity_id, {'key': 'a'}))
+        manifest.record(entity_id, 'key', 'a')
+        manifest.record(entity_id, 'csr', 'b')
+        self.assertTrue(manifest.is_up_to_date(entity_id, {'key': 'a', 'csr': 'b'}))
+        self.assertFalse(manifest.is_up_to_date(entity_id, {'key': 'a', 'crt': 'c'}))
+        self.assertFalse(manifest.is_up_to_date(entity_id, {'csr': 'c'}))
+
+    def test_is_stale(self):
+        manifest = BuildManifest(self._filename)
+        entity_id = BuildManifest.entity_id('group', 'users', 'user1')
+        self.assertFalse(manifest.is_stale(entity_id, 'key', 'a'))
+        manifest.record(entity_id, 'key', 'a')
+        self.assertFalse(manifest.is_stale(entity_id, 'key', 'a'))
+        self.assertTrue(manifest.is_stale(entity_id, 'key', 'b'))
+        self.assertFalse(manifest.is_stale(entity_id, 'csr', 'b'))
+
+    def test_save_and_load(self):
+        manifest = BuildManifest(self._filename)
+        self.assertFalse(manifest.load())
+        manifest.record('group/users/user1', 'key', 'a')
+        self.assertTrue(manifest.save())
+        manifest = BuildManifest(self._filename)
+        self.assertTrue(manifest.load())
+        self.assertTrue(manifest.is_up_to_date('group/users/user1', {'key': 'a'}))
+        self.assertEqual(os.listdir(self._dir.name), ['manifest.json'])
+
+    def test_invalid_manifest(self):
+        with open(self._filename, 'w') as f:
+            f.write('{"version": 2, "entities"')
+        manifest = BuildManifest(self._filename)
+        self.assertFalse(manifest.load())
+        self.assertFalse(manifest.is_up_to_date('group/users/user1', {'key': 'a'}))
+
+    def test_older_version_is_ignored(self):
+        with open(self._filename, 'w') as f:
+            f.write('{"version": 1, "entities": {"group/users/user1": {"key": "a"}}}')
+        manifest = BuildManifest(self._filename)
+        self.assertFalse(manifest.load())
+        self.assertFalse(manifest.is_up_to_date('group/users/user1', {'key': 'a'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+from certautomator.metrics import Histogram
+from certautomator.metrics import Metrics
+import json
+import tempfile
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+class Test_Metrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.quantile(0.5))
+        for duration in [0.001, 0.02, 0.02, 0.3, 4.0]:
+            histogram.observe(duration)
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.total, 4.341)
+        self.assertEqual(histogram.minimum, 0.001)
+        self.assertEqual(histogram.maximum, 4.0)
+        self.assertEqual(histogram.quantile(0.5), 0.025)
+        self.assertEqual(histogram.quantile(1), 4.0)
+
+    def test_operation(self):
+        metrics = Metrics()
+        with metrics.operation('key', 'group/users/user1') as operation:
+            metrics.command('genrsa', 0.5, 0)
+            operation.succeeded = True
+            operation.bytes_written = 1704
+        with metrics.operation('key', 'group/users/user2') as operation:
+            metrics.command('genrsa', 0.1, 1)
+        metrics.command('pkey', 0.1, 0)
+        summary = metrics.summary()
+        key = summary['steps']['key']
+        self.assertEqual(key['count'], 2)
+        self.assertEqual(key['failed'], 1)
+        self.assertEqual(key['bytes_written'], 1704)
+        self.assertEqual(key['exit_codes'], {'0': 1, '1': 1})
+        self.assertEqual(sorted(s['entity'] for s in key['slowest']),
+                         ['group/users/user1', 'group/users/user2'])
+        self.assertEqual(summary['commands']['genrsa']['count'], 2)
+        self.assertEqual(summary['commands']['pkey']['exit_codes'], {'0': 1})
+
+    def test_exception_fails_operation(self):
+        metrics = Metrics()
+        with self.assertRaises(ValueError):
+            with metrics.operation('csr', 'group/users/user1') as operation:
+                operation.succeeded = True
+                raise ValueError()
+        self.assertEqual(metrics.summary()['steps']['csr']['failed'], 1)
+
+    def test_slowest(self):
+        metrics = Metrics(slowest=2)
+        for i in range(5):
+            with metrics.operation('crt', 'user{0}'.format(i)) as operation:
+                operation.succeeded = True
+        slowest = metrics.summary()['steps']['crt']['slowest']
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0]['seconds'], slowest[1]['seconds'])
+
+    def test_write(self):
+        metrics = Metrics()
+        with metrics.operation('key', 'group/users/user1') as operation:
+            metrics.command('genrsa', 0.5, 0)
+            operation.succeeded = True
+        metrics.stage('config_parse', 0.25)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'metrics.json')
+            self.assertTrue(metrics.write(filename))
+            with open(filename) as f:
+                self.assertEqual(json.load(f)['stages'], {'config_parse': 0.25})
+            filename = os.path.join(directory, 'metrics.prom')
+            self.assertTrue(metrics.write(filename))
+            with open(filename) as f:
+                content = f.read()
+        self.assertIn('certautomator_step_duration_seconds_count{step="key"} 1', content)
+        self.assertIn('certautomator_step_duration_seconds_bucket{step="key",le="+Inf"} 1', content)
+        self.assertIn('certautomator_command_exit_codes_total{command="genrsa",code="0"} 1', content)
+        self.assertIn('certautomator_stage_seconds_total{stage="config_parse"} 0.25', content)
+
+
+if __name__ == '__main__':
+    unittest.main()
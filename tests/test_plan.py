@@ -0,0 +1,38 @@
+from certautomator.plan import Plan
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+class Test_Plan(unittest.TestCase):
+
+    def test_estimate(self):
+        plan = Plan()
+        plan.add('key', 'group/users/user1', ['openssl', 'genrsa', '-passout', 'pass:secret'])
+        plan.add('key', 'group/users/user2', ['openssl', 'genrsa'])
+        plan.add('crt', 'group/users/user1', None)
+        self.assertEqual(plan.operations[0][2], ['openssl', 'genrsa', '-passout', 'pass:*********'])
+        timings = {'steps': {'key': {'mean_seconds': 0.5},
+                             'crt': {'mean_seconds': 0.25}}}
+        estimate = plan.estimate(timings, jobs=2)
+        self.assertEqual(estimate['operations'], 3)
+        self.assertEqual(estimate['steps']['key'], {'count': 2, 'seconds': 1.0})
+        self.assertEqual(estimate['total_seconds'], 1.25)
+        self.assertEqual(estimate['wall_seconds'], 0.625)
+        report = plan.report(timings, jobs=2).splitlines()
+        self.assertEqual(report[2], 'crt group/users/user1: (in process)')
+        self.assertEqual(report[-1], 'Total: 3 operations, estimated 1.2s, 0.6s with 2 jobs.')
+
+    def test_estimate_without_timings(self):
+        plan = Plan()
+        plan.add('key', 'group/users/user1', ['openssl', 'genrsa'])
+        estimate = plan.estimate({'steps': {'csr': {'mean_seconds': 1.0}}})
+        self.assertIsNone(estimate['steps']['key']['seconds'])
+        self.assertIsNone(estimate['total_seconds'])
+        self.assertIsNone(estimate['wall_seconds'])
+
+
+if __name__ == '__main__':
+    unittest.main()
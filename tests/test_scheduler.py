@@ -0,0 +1,178 @@
+from certautomator.scheduler import Task, TaskScheduler
+import asyncio
+import threading
+import time
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+class Test_TaskScheduler(unittest.TestCase):
+
+    def test_serial_order(self):
+        calls = []
+        scheduler = TaskScheduler()
+        for name in ['a', 'b']:
+            key = scheduler.add_task((name, 'key'),
+                                     lambda name=name: calls.append((name, 'key')) or True)
+            scheduler.add_task((name, 'csr'),
+                               lambda name=name: calls.append((name, 'csr')) or True,
+                               [key])
+        results = scheduler.run()
+        self.assertEqual(calls, [('a', 'key'), ('a', 'csr'),
+                                 ('b', 'key'), ('b', 'csr')])
+        self.assertEqual(set(results.values()), {Task.SUCCEEDED})
+        self.assertEqual(len(scheduler), 0)
+
+    def test_failure_skips_dependents_only(self):
+        scheduler = TaskScheduler()
+        ca = scheduler.add_task(('ca', 'ca_crt'), lambda: True)
+        a_key = scheduler.add_task(('a', 'key'), lambda: False)
+        a_csr = scheduler.add_task(('a', 'csr'), lambda: True, [a_key])
+        scheduler.add_task(('a', 'crt'), lambda: True, [a_csr, ca])
+        b_key = scheduler.add_task(('b', 'key'), lambda: True)
+        b_csr = scheduler.add_task(('b', 'csr'), lambda: True, [b_key])
+        scheduler.add_task(('b', 'crt'), lambda: True, [b_csr, ca])
+        results = scheduler.run()
+        self.assertEqual(results[('a', 'key')], Task.FAILED)
+        self.assertEqual(results[('a', 'csr')], Task.SKIPPED)
+        self.assertEqual(results[('a', 'crt')], Task.SKIPPED)
+        self.assertEqual(results[('b', 'crt')], Task.SUCCEEDED)
+
+    def test_exception_is_a_failure(self):
+        def fail():
+            raise Exception('error')
+        scheduler = TaskScheduler()
+        key = scheduler.add_task(('a', 'key'), fail)
+        scheduler.add_task(('a', 'csr'), lambda: True, [key])
+        results = scheduler.run()
+        self.assertEqual(results[('a', 'key')], Task.FAILED)
+        self.assertEqual(results[('a', 'csr')], Task.SKIPPED)
+
+    def test_invalid_graph(self):
+        scheduler = TaskScheduler()
+        scheduler.add_task(('a', 'key'), lambda: True)
+        with self.assertRaises(Exception):
+            scheduler.add_task(('a', 'key'), lambda: True)
+        with self.assertRaises(Exception):
+            scheduler.add_task(('a', 'csr'), lambda: True, [('b', 'key')])
+
+    def test_order(self):
+        calls = []
+        scheduler = TaskScheduler(jobs=4)
+        a = scheduler.add_task(('a', 'csr'), lambda: calls.append('a') or False)
+        b = scheduler.add_task(('b', 'csr'), lambda: calls.append('b') or True)
+        batch = scheduler.add_task(('batch',), lambda: calls.append('batch') or True)
+        scheduler.add_order(a, batch)
+        scheduler.add_order(b, batch)
+        with self.assertRaises(Exception):
+            scheduler.add_order(batch, a)
+        results = scheduler.run()
+        self.assertEqual(calls[-1], 'batch')
+        self.assertEqual(results[('a', 'csr')], Task.FAILED)
+        self.assertEqual(results[('batch',)], Task.SUCCEEDED)
+
+    def test_parallel_pipelining(self):
+        # -- a's request must be able to run while b's key is still running --
+        b_started = threading.Event()
+        a_csr_done = threading.Event()
+
+        def b_key():
+            b_started.set()
+            return a_csr_done.wait(5)
+
+        def a_csr():
+            b_started.wait(5)
+            a_csr_done.set()
+            return True
+        scheduler = TaskScheduler(jobs=2)
+        a = scheduler.add_task(('a', 'key'), lambda: True)
+        scheduler.add_task(('b', 'key'), b_key)
+        scheduler.add_task(('a', 'csr'), a_csr, [a])
+        results = scheduler.run()
+        self.assertEqual(set(results.values()), {Task.SUCCEEDED})
+
+    def test_run_async(self):
+        scheduler = TaskScheduler(jobs=3)
+        running = []
+        peak = []
+
+        def step(result):
+            async def action():
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+                return result
+            return action
+        ca = scheduler.add_task(('ca', 'ca_crt'), step(True))
+        for name in ['a', 'b', 'c', 'd']:
+            key = scheduler.add_task((name, 'key'), step(name != 'b'))
+            scheduler.add_task((name, 'crt'), lambda: True, [key, ca])
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(scheduler.run_async())
+        finally:
+            loop.close()
+        self.assertEqual(max(peak), 3)
+        self.assertEqual(results[('a', 'crt')], Task.SUCCEEDED)
+        self.assertEqual(results[('b', 'key')], Task.FAILED)
+        self.assertEqual(results[('b', 'crt')], Task.SKIPPED)
+        self.assertEqual(len(scheduler), 0)
+
+
+    def test_pools(self):
+        scheduler = TaskScheduler(jobs=1, pools={'key': 3})
+        running = {'key': [], 'csr': []}
+        peak = {'key': 0, 'csr': 0}
+
+        def step(name):
+            async def action():
+                running[name].append(1)
+                peak[name] = max(peak[name], len(running[name]))
+                await asyncio.sleep(0.01)
+                running[name].pop()
+                return True
+            return action
+        for name in ['a', 'b', 'c', 'd', 'e', 'f']:
+            key = scheduler.add_task((name, 'key'), step('key'))
+            scheduler.add_task((name, 'csr'), step('csr'), [key])
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(scheduler.run_async())
+        finally:
+            loop.close()
+        self.assertEqual(set(results.values()), {Task.SUCCEEDED})
+        self.assertEqual(peak, {'key': 3, 'csr': 1})
+
+    def test_backlog(self):
+        # -- Each request queued behind a's pauses the keys, so d's key --
+        # -- can't start before a's request is done.                   --
+        scheduler = TaskScheduler(jobs=1, pools={'key': 2}, backlog=1)
+        events = []
+
+        def key(name):
+            def action():
+                events.append(name + ' key')
+                return True
+            return action
+
+        def csr(name):
+            def action():
+                time.sleep(0.05)
+                events.append(name + ' csr')
+                return True
+            return action
+        for name in ['a', 'b', 'c', 'd']:
+            scheduler.add_task((name, 'csr'), csr(name),
+                               [scheduler.add_task((name, 'key'), key(name))])
+        results = scheduler.run()
+        self.assertEqual(set(results.values()), {Task.SUCCEEDED})
+        self.assertLess(events.index('a csr'), events.index('d key'))
+        self.assertEqual(len(events), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
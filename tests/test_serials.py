@@ -0,0 +1,52 @@
+from certautomator.serials import CounterSerials, RandomSerials
+from certautomator.user import CA
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import unittest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+class Test_Serials(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._ca = CA(name='ca', ca_dir=self._dir.name, key_name='ca.key',
+                      request_name='ca.csr', cert_name='ca.crt')
+        self._serial_file = os.path.join(self._dir.name, 'crts', 'ca.srl')
+        os.makedirs(os.path.dirname(self._serial_file))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_random_serials(self):
+        serials = RandomSerials()
+        values = [serials.next(self._ca) for i in range(100)]
+        self.assertEqual(len(set(values)), 100)
+        for value in values:
+            self.assertEqual(value.bit_length(), 159)
+
+    def test_counter_serials(self):
+        self.assertEqual(CounterSerials.serial_file(self._ca), self._serial_file)
+        with open(self._serial_file, 'w') as f:
+            f.write('0F\n')
+        first = CounterSerials(block=10)
+        second = CounterSerials(block=10)
+        self.assertEqual([first.next(self._ca) for i in range(3)], [16, 17, 18])
+        self.assertEqual(second.next(self._ca), 26)
+        with open(self._serial_file) as f:
+            self.assertEqual(f.read(), '23\n')
+        self.assertEqual([first.next(self._ca) for i in range(8)],
+                         [19, 20, 21, 22, 23, 24, 25, 36])
+
+    def test_counter_serials_concurrent(self):
+        serials = CounterSerials(block=7)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            values = list(executor.map(lambda i: serials.next(self._ca), range(200)))
+        self.assertEqual(sorted(values), list(range(1, 201)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -105,3 +105,29 @@ class Test_TestUser(unittest.TestCase):
             'c.crt'
         )
         self.assertFalse(user.is_valid())
+
+    def test_key_type(self):
+        user = User("user1", key_name='a.key', request_name='r.csr', cert_name='c.crt',
+                    dir='./', key_type='EC', curve='P-384')
+        self.assertEqual((user.key_type, user.curve), ('ec', 'P-384'))
+        self.assertTrue(user.is_valid())
+        user.curve = ''
+        self.assertIsNone(user.curve)
+        self.assertFalse(user.is_valid())
+        user.key_type = 'ed25519'
+        self.assertTrue(user.is_valid())
+        user.key_type = 'dsa'
+        self.assertIsNone(user.key_type)
+        self.assertFalse(user.is_valid())
+        with self.assertRaises(Exception):
+            User("user1", key_name='a.key', request_name='r.csr', cert_name='c.crt',
+                 key_type='dsa')
+        with self.assertRaises(Exception):
+            User("user1", key_name='a.key', request_name='r.csr', cert_name='c.crt',
+                 key_type='ec', curve='')
+
+    def test_slots(self):
+        user = User("user1", key_name='a.key', request_name='r.csr', cert_name='c.crt')
+        self.assertFalse(hasattr(user, '__dict__'))
+        with self.assertRaises(AttributeError):
+            user.unknown = True
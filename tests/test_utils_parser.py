@@ -1,7 +1,10 @@
 from certautomator.crypto_cmds import CryptoCommands
 from certautomator.user import CA, User
 from certautomator.utils import FileHandler
+from certautomator.utils import JSONStream
 from certautomator.utils_parser import Utils_Parser, CAParser, UserParser
+import io
+import json
 import unittest
 from unittest.mock import MagicMock
 import os
@@ -1072,3 +1075,123 @@ class Test_UserParser(unittest.TestCase):
         self.assertEqual(expected_user.dir, user.dir)
         self.assertEqual(expected_user.format_distinguished_names(),
                          user.format_distinguished_names())
+
+    def test_iter_parse(self):
+        file_handler = FileHandler()
+        file_handler.create_directory = MagicMock(return_value=True)
+        defaults = {
+            "ssl_defaults": {
+                "bits": 2048,
+                "days": 3650,
+                "protected": False,
+                "message_digest": "sha512",
+                "user_dir": "/some/random/directory/test_dir",
+                "ca_dir": "/some/random/directory/test_dir/ca"
+            },
+            "name_defaults": {
+                "country": "US",
+                "email": "test@test.com"
+            }
+        }
+        users = {"user{0}".format(i): {"common_name": "user{0}".format(i),
+                                        "key_name": "user{0}.key".format(i),
+                                        "cert_name": "user{0}.crt".format(i),
+                                        "cert_request_name": "user{0}.csr".format(i)}
+                 for i in range(5)}
+        ca = {"test_ca": {"common_name": "test_ca",
+                          "key_name": "test_ca.key",
+                          "cert_name": "test_ca.crt",
+                          "cert_request_name": "test_ca.csr"}}
+        # -- The users of the second group come before its ca. --
+        data = '{{"first": {0}, "second": {1}, "skipped": {2}}}'.format(
+            json.dumps(dict(defaults, ca=ca, users=users)),
+            json.dumps(dict(defaults, users=users, ca=ca)),
+            json.dumps(dict(defaults, users=users)))
+        utilsParser = Utils_Parser(filehandler=file_handler)
+        stream = JSONStream(io.StringIO(data), chunk_size=16)
+        result = list(utilsParser.iter_parse(((key, stream) for key in stream.members()),
+                                             specified_groups=['first', 'second'],
+                                             batch_size=2,
+                                             wait_for_ca=True))
+        self.assertEqual([(group, list(batch.keys())[0], len(list(batch.values())[0]))
+                          for group, batch in result],
+                         [('first', 'ca', 1),
+                          ('first', 'users', 2),
+                          ('first', 'users', 2),
+                          ('first', 'users', 1),
+                          ('second', 'ca', 1),
+                          ('second', 'users', 2),
+                          ('second', 'users', 2),
+                          ('second', 'users', 1)])
+        user = result[1][1]['users']['user0']
+        self.assertEqual(user.bits, 2048)
+        self.assertEqual(user.country, 'US')
+        self.assertEqual(user.common_name, 'user0')
+        # -- keys, csrs and crts of the user_dir and ca_dir, prepared once. --
+        self.assertEqual(file_handler.create_directory.call_count, 6)
+
+    def test_iter_parse_specified_users(self):
+        file_handler = FileHandler()
+        file_handler.create_directory = MagicMock(return_value=True)
+        data = ('{"group": {"ssl_defaults": {"bits": 2048, "user_dir": "/dir"}, '
+                '"name_defaults": {}, '
+                '"users": {"user1": {"common_name": "user1"}, '
+                '"user2": {"common_name": "user2"}}}}')
+        utilsParser = Utils_Parser(filehandler=file_handler)
+        stream = JSONStream(io.StringIO(data))
+        result = list(utilsParser.iter_parse(((key, stream) for key in stream.members()),
+                                             specified_users=['user2']))
+        self.assertEqual(len(result), 1)
+        self.assertEqual(list(result[0][1]['users'].keys()), ['user2'])
+
+    def test_parse_overlays_group_defaults(self):
+        file_handler = FileHandler()
+        file_handler.create_directory = MagicMock(return_value=True)
+        data = {"group": {
+            "ssl_defaults": {"bits": 2048, "days": 30, "user_dir": "/users", "ca_dir": "/ca"},
+            "name_defaults": {"country": "US", "state": "State"},
+            "ca": {"ca": {"key_name": "ca.key", "cert_name": "ca.crt",
+                          "cert_request_name": "ca.csr", "days": 3650}},
+            "users": {"user1": {"key_name": "a.key", "cert_name": "a.crt",
+                                "cert_request_name": "a.csr", "bits": 4096,
+                                "country": None, "user_dir": "/other"},
+                      "user2": {"key_name": "b.key", "cert_name": "b.crt",
+                                "cert_request_name": "b.csr", "state": "Other",
+                                "ca": "ca"}}}}
+        utilsParser = Utils_Parser(filehandler=file_handler)
+        result = utilsParser.parse(data)['group']
+        user1 = result['users']['user1']
+        user2 = result['users']['user2']
+        self.assertEqual((user1.bits, user1.country, user1.state, user1.dir),
+                         (4096, 'US', 'State', '/other'))
+        self.assertEqual((user2.bits, user2.country, user2.state, user2.dir),
+                         (2048, 'US', 'Other', '/users'))
+        self.assertEqual(user2.certificate_expiration, 30)
+        self.assertEqual((user2.message_digest, user2.key_type, user2.curve),
+                         ('sha256', 'rsa', 'P-256'))
+        self.assertIsNone(user1.signing_ca)
+        self.assertEqual(user2.signing_ca, 'ca')
+        ca = result['ca']['ca']
+        self.assertEqual((ca.certificate_expiration, ca.ca_dir, ca.country),
+                         (3650, '/ca', 'US'))
+        data['group']['ssl_defaults'].update(key_type='ec', curve='P-384', message_digest='sha384')
+        data['group']['users']['user1']['key_type'] = 'ed25519'
+        result = utilsParser.parse(data)['group']
+        user1 = result['users']['user1']
+        user2 = result['users']['user2']
+        self.assertEqual(user1.key_type, 'ed25519')
+        self.assertEqual((user2.message_digest, user2.key_type, user2.curve),
+                         ('sha384', 'ec', 'P-384'))
+        self.assertEqual(result['ca']['ca'].key_type, 'ec')
+        user = utilsParser.parse_user(data['group'], 'user3',
+                                      {'key_name': 'c.key', 'cert_name': 'c.crt',
+                                       'cert_request_name': 'c.csr', 'days': 7})
+        self.assertEqual((user.name, user.certificate_expiration, user.key_type, user.dir),
+                         ('user3', 7, 'ec', '/users'))
+        self.assertIsNone(utilsParser.parse_user({}, 'user3', {}))
+        # -- Users with an unknown key type or no curve are rejected. --
+        data['group']['users']['user1']['key_type'] = 'dsa'
+        data['group']['users']['user2']['curve'] = ''
+        with self.assertLogs('certautomator.utils_parser', level='WARNING'):
+            result = utilsParser.parse(data)['group']
+        self.assertEqual(result['users'], {'user1': None, 'user2': None})
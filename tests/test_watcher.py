@@ -0,0 +1,115 @@
+from certautomator.utils import Config
+from certautomator.utils import FileHandler
+from certautomator.utils_parser import Utils_Parser
+from certautomator.watcher import ConfigWatcher
+from json.decoder import JSONDecodeError
+import json
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+
+class Test_ConfigWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._config = os.path.join(self._dir.name, 'config.json')
+        file_handler = FileHandler()
+        file_handler.create_directory = MagicMock(return_value=True)
+        self._parser = Utils_Parser(filehandler=file_handler)
+        self._watcher = ConfigWatcher(self._config, interval=0.01)
+        self._group = {
+            'ssl_defaults': {'bits': 2048, 'days': 365,
+                             'user_dir': os.path.join(self._dir.name, 'users'),
+                             'ca_dir': os.path.join(self._dir.name, 'ca')},
+            'name_defaults': {'country': 'US'},
+            'ca': {'ca1': self._values('ca1')},
+            'users': {name: self._values(name) for name in ('user1', 'user2', 'user3')}}
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _values(self, name):
+        return {'common_name': name, 'key_name': name + '.key',
+                'cert_name': name + '.crt', 'cert_request_name': name + '.csr'}
+
+    def _write(self, groups, mtime_ns):
+        with open(self._config, 'w') as f:
+            json.dump(groups, f)
+        os.utime(self._config, ns=(mtime_ns, mtime_ns))
+
+    def _filter(self):
+        batches = self._parser.iter_parse(Config().iter_config(self._config, strict=True),
+                                          wait_for_ca=True)
+        return [(group_key, kind, sorted(entities))
+                for group_key, batch in self._watcher.filter(batches)
+                for kind, entities in batch.items()]
+
+    def test_filter(self):
+        self._write({'group': self._group}, 1000000000)
+        self.assertTrue(self._watcher.changed())
+        self.assertEqual(self._filter(),
+                         [('group', 'ca', ['ca1']),
+                          ('group', 'users', ['user1', 'user2', 'user3'])])
+        self.assertEqual(len(self._watcher.report(first=True)['added']), 4)
+        self.assertFalse(self._watcher.changed())
+
+        # -- Unchanged users are left out, the cas are always passed on. --
+        self._group['users']['user1']['days'] = 30
+        self._group['users']['user2']['ca'] = 'ca1'
+        del self._group['users']['user3']
+        self._group['users']['user4'] = self._values('user4')
+        self._write({'group': self._group}, 2000000000)
+        self.assertTrue(self._watcher.changed())
+        self.assertEqual(self._filter(),
+                         [('group', 'ca', ['ca1']),
+                          ('group', 'users', ['user1', 'user2', 'user4'])])
+        self.assertEqual(self._watcher.report(),
+                         {'added': ['group/users/user4'],
+                          'changed': ['group/users/user1', 'group/users/user2'],
+                          'removed': ['group/users/user3']})
+
+        self.assertEqual(self._filter(), [('group', 'ca', ['ca1'])])
+        self.assertEqual(self._watcher.report(),
+                         {'added': [], 'changed': [], 'removed': []})
+        self.assertIsNone(self._watcher.report())
+
+    def test_filter_ca_changed(self):
+        self._write({'group': self._group}, 1000000000)
+        self._filter()
+        # -- The users of the group may have to be signed again. --
+        self._group['ca']['ca1']['days'] = 3650
+        self._write({'group': self._group}, 2000000000)
+        self.assertEqual(self._filter(),
+                         [('group', 'ca', ['ca1']),
+                          ('group', 'users', ['user1', 'user2', 'user3'])])
+        self.assertEqual(self._watcher.report()['changed'], ['group/ca/ca1'])
+
+    def test_filter_invalid_config(self):
+        self._write({'group': self._group}, 1000000000)
+        self._filter()
+        self._watcher.report(first=True)
+        with open(self._config, 'w') as f:
+            f.write('{"group": {"ssl_defaults": ')
+        with self.assertRaises(JSONDecodeError):
+            self._filter()
+        # -- An incomplete parse reports nothing and keeps the previous one. --
+        self.assertIsNone(self._watcher.report())
+        self._write({'group': self._group}, 2000000000)
+        self.assertEqual(self._filter(), [('group', 'ca', ['ca1'])])
+
+    def test_wait(self):
+        self._write({'group': self._group}, 1000000000)
+        self.assertTrue(self._watcher.wait())
+        self._watcher.stop()
+        self.assertFalse(self._watcher.wait())
+        os.remove(self._config)
+        self.assertFalse(self._watcher.changed())
+
+
+if __name__ == '__main__':
+    unittest.main()